@@ -0,0 +1,143 @@
+#- geo3D_qgis: 2026
+#- arkriger
+
+"""
+Import-time benchmark: the first notebook cell (import city3D) and the
+importlib.reload the notebook does, with the heavy dependencies loaded lazily
+against the eager layout (every dependency imported up front).
+
+Each cold import runs in a fresh interpreter, so nothing is cached in
+sys.modules. Run with a Python that can import the QGIS bindings:
+
+    python benchmarks/bench_import.py --runs 7
+    python benchmarks/bench_import.py --importtime     # slowest modules of one import
+
+The QGIS bindings themselves are timed on their own ("qgis bindings"): inside
+the QGIS application they are already loaded, so the difference to that row
+is what a notebook cell pays.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#- what `import city3D` pulled in before the lazy layout
+EAGER = ["processing", "pandas", "geopandas", "shapely", "shapely.strtree", "pyproj",
+         "osgeo.gdal", "osgeo.ogr", "osgeo.osr", "qgis.PyQt.QtNetwork",
+         "gzip", "struct", "difflib", "tracemalloc", "multiprocessing", "concurrent.futures",
+         "xml.etree.ElementTree"]
+
+_CHILD = """
+import sys, time, importlib
+sys.path.insert(0, {root!r})
+{setup}
+start = time.perf_counter()
+{body}
+print(time.perf_counter() - start)
+"""
+
+
+def _plugins_setup():
+    """processing lives with the QGIS plugins; outside QGIS their folder must be on sys.path."""
+    from qgis.core import QgsApplication
+    return f"sys.path.append({os.path.join(QgsApplication.pkgDataPath(), 'python', 'plugins')!r})"
+
+
+def _eager_body():
+    lines = ["import city3D"]
+    for name in EAGER:
+        lines.append(f"try:\n    importlib.import_module({name!r})\nexcept ImportError:\n    pass")
+    return "\n".join(lines)
+
+
+def scenarios():
+    """{name: (untimed setup, timed body)}"""
+    return {
+        "qgis bindings": ("", "import qgis.core, qgis.PyQt.QtCore, numpy"),
+        "import city3D (lazy)": ("", "import city3D"),
+        "import city3D + deps (eager)": (_plugins_setup(), _eager_body()),
+    }
+
+
+def _child(setup, body, importtime=False):
+    code = _CHILD.format(root=ROOT, setup=setup, body=body)
+    cmd = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    proc = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "child failed")
+    return float(proc.stdout.strip().splitlines()[-1]), proc.stderr
+
+
+def reload_times(runs):
+    """importlib.reload(city3D) in this process, after one warm import."""
+    import importlib
+    sys.path.insert(0, ROOT)
+    import city3D
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        importlib.reload(city3D)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def slowest_imports(top=15):
+    """(cumulative seconds, module) of the slowest modules one lazy `import city3D` loads."""
+    _, stderr = _child("", "import city3D", importtime=True)
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = (p.strip() for p in line[len("import time:"):].split("|"))
+        rows.append((int(cumulative) / 1e6, name))
+    return sorted(rows, reverse=True)[:top]
+
+
+def run(runs=5):
+    rows = []
+    print(f"{'scenario':<32} {'median [s]':>11} {'min [s]':>9}")
+    for name, (setup, body) in scenarios().items():
+        try:
+            times = [_child(setup, body)[0] for _ in range(runs)]
+        except RuntimeError as e:
+            print(f"{name:<32} failed: {e}")
+            continue
+        rows.append({"scenario": name, "runs": times, "median": statistics.median(times), "min": min(times)})
+        print(f"{name:<32} {rows[-1]['median']:11.3f} {rows[-1]['min']:9.3f}")
+
+    times = reload_times(runs)
+    rows.append({"scenario": "importlib.reload(city3D)", "runs": times,
+                 "median": statistics.median(times), "min": min(times)})
+    print(f"{'importlib.reload(city3D)':<32} {rows[-1]['median']:11.3f} {rows[-1]['min']:9.3f}")
+
+    by_name = {r["scenario"]: r["median"] for r in rows}
+    base = by_name.get("qgis bindings", 0.0)
+    lazy, eager = by_name.get("import city3D (lazy)"), by_name.get("import city3D + deps (eager)")
+    if lazy is not None and eager is not None and lazy > base:
+        print(f"city3D's own import cost: {lazy - base:.3f}s lazy vs {eager - base:.3f}s eager "
+              f"({(eager - base) / (lazy - base):.1f}x)")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per scenario")
+    parser.add_argument("--importtime", action="store_true", help="list the slowest modules of a lazy import")
+    parser.add_argument("--json", default=None, help="also write the timings to this file")
+    args = parser.parse_args()
+
+    if args.importtime:
+        for seconds, name in slowest_imports():
+            print(f"{seconds:8.3f}s  {name}")
+        sys.exit(0)
+
+    rows = run(args.runs)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"python": sys.version.split()[0], "results": rows}, f, indent=1)
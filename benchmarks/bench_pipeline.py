@@ -0,0 +1,328 @@
+#- geo3D_qgis: 2026
+#- arkriger
+
+"""
+Offline pipeline benchmark: times the city3D stages on synthetic cities of
+1k, 10k and 100k buildings and writes machine-readable results that can be
+compared between commits.
+
+Stages (each gets fresh input, set-up is not timed):
+
+    fetch_overpass            _fetch_overpass against a local Overpass stand-in
+    parse_to_geojson          _parse_to_geojson on the Overpass response
+    overpass_to_layer         _overpass_to_layer (the harvesters' layer build)
+    process3D                 process3D on the harvested layer (--workers adds a partitioned run)
+    process_osm_tags_and_ids  hstore expansion on a PBF-shaped multipolygons layer
+    with_solar                _with_solar on buildings/panels in UTM
+    layer_to_geojson_dict     export of the processed buildings
+    create_3Dviz              interactiveOnly.html, one run per --payloads mode
+
+Run with a Python that can import the QGIS bindings (no QGIS GUI needed):
+
+    python benchmarks/bench_pipeline.py --sizes 1000 10000 100000 --repeat 3
+    python benchmarks/bench_pipeline.py --compare results/old.json results/new.json
+
+Results go to benchmarks/results/pipeline-<commit>.json unless --out is given.
+--baseline old.json compares a fresh run against earlier results straight away.
+
+process3D(..., workers=n) re-implements the QGIS geometry output (asWkt,
+asJson, makeValid, pointOnSurface, transform) in city3D_kernels; --parity
+checks that it writes the same columns as the serial run:
+
+    python benchmarks/bench_pipeline.py --parity --sizes 1000 10000 --workers 4
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+import contextlib
+from datetime import datetime, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+
+import synthetic_osm
+from overpass_stub import OverpassStub
+
+PARITY_COLUMNS = ["geometry_wkt", "footprint", "plus_code", "address", "building_height",
+                  "roof_height", "bottom_bridge_height", "bottom_roof_height", "fill_color"]
+
+STAGES = ["fetch_overpass", "parse_to_geojson", "overpass_to_layer", "process3D",
+          "process_osm_tags_and_ids", "with_solar", "layer_to_geojson_dict", "create_3Dviz"]
+
+
+def _qgis_app():
+    """A QgsApplication without GUI (reuses the running one inside QGIS)."""
+    from qgis.core import QgsApplication
+    app = QgsApplication.instance()
+    if app is None:
+        app = QgsApplication([], False)
+        app.initQgis()
+    # processing (imported by city3D) lives with the bundled plugins
+    plugins = os.path.join(QgsApplication.pkgDataPath(), "python", "plugins")
+    if plugins not in sys.path:
+        sys.path.append(plugins)
+    return app
+
+
+def _git(*args):
+    try:
+        return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True, timeout=30).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def _environment():
+    from qgis.core import Qgis
+    from osgeo import gdal
+    return {
+        "commit": _git("rev-parse", "--short", "HEAD") or None,
+        "dirty": bool(_git("status", "--porcelain", "--", "city3D.py", "city3D_kernels.py")),
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "qgis": Qgis.version(),
+        "gdal": gdal.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def _timed(setup, func, repeat):
+    """Runs func(*setup()) repeat times; returns (seconds per run, last output)."""
+    runs, out = [], None
+    for _ in range(repeat):
+        args = setup()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            out = func(*args)
+            runs.append(time.perf_counter() - start)
+    return runs, out
+
+
+class PipelineBench:
+    """All stages for one synthetic city of n buildings."""
+
+    def __init__(self, city3D, n, repeat=3, workers=None, payloads=("json",), tmp=None):
+        self.c3 = city3D
+        self.n = n
+        self.repeat = repeat
+        self.workers = workers
+        self.payloads = payloads
+        self.tmp = tmp or tempfile.mkdtemp(prefix="geo3D_bench_")
+        self.rows = []
+
+        city = synthetic_osm.synthetic_city(n)
+        self.raw = synthetic_osm.overpass_json(city)
+        self.payload = json.dumps(self.raw).encode("utf-8")
+        self.pbf_path = os.path.join(self.tmp, f"pbf_buildings_{n}.geojson")
+        with open(self.pbf_path, "w") as f:
+            json.dump(synthetic_osm.pbf_geojson(city), f)
+        self.solar = synthetic_osm.solar_frames(city)
+
+        # prepared once: the harvested layer and its processed copy feed the later stages
+        self.layer = self.c3._overpass_to_layer(self.raw, f"Buildings_{n}")
+        self.processed = self._fresh(self.layer)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.c3.process3D(self.processed)
+
+    @staticmethod
+    def _fresh(layer):
+        from qgis.core import QgsFeatureRequest
+        return layer.materialize(QgsFeatureRequest())
+
+    def _record(self, stage, features, runs, **extra):
+        row = {"stage": stage, "size": self.n, "features": features, "runs": runs,
+               "min": min(runs), "median": statistics.median(runs)}
+        row.update(extra)
+        self.rows.append(row)
+        print(f"{stage:>32} {self.n:>8} {features:>9} {row['min']:10.3f} {row['median']:10.3f}")
+        return row
+
+    def fetch_overpass(self):
+        query = self.c3._theme_query("buildings", "Cape Town", "Observatory")
+        with OverpassStub(self.payload, module=self.c3) as stub:
+            runs, raw = _timed(lambda: (), lambda: self.c3._fetch_overpass(query, cache=False), self.repeat)
+            self._record("fetch_overpass", len(raw["elements"]), runs, bytes=len(self.payload),
+                         requests=len(stub.requests))
+
+    def parse_to_geojson(self):
+        runs, gj = _timed(lambda: (self.raw,), self.c3._parse_to_geojson, self.repeat)
+        self._record("parse_to_geojson", len(gj["features"]), runs)
+
+    def overpass_to_layer(self):
+        runs, layer = _timed(lambda: (self.raw, "bench"), self.c3._overpass_to_layer, self.repeat)
+        self._record("overpass_to_layer", layer.featureCount(), runs)
+
+    def process3D(self):
+        runs, _ = _timed(lambda: (self._fresh(self.layer),), self.c3.process3D, self.repeat)
+        self._record("process3D", self.layer.featureCount(), runs)
+        if self.workers:
+            runs, _ = _timed(lambda: (self._fresh(self.layer),),
+                             lambda layer: self.c3.process3D(layer, workers=self.workers), self.repeat)
+            self._record(f"process3D[workers={self.workers}]", self.layer.featureCount(), runs)
+
+    def parity(self, columns=PARITY_COLUMNS):
+        """
+        Runs process3D with workers on a fresh copy of the harvested layer and
+        compares it with the serial run (self.processed); returns the differing
+        values as (fid, column, serial, partitioned).
+        """
+        partitioned = self._fresh(self.layer)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.c3.process3D(partitioned, workers=self.workers or 2)
+        expected = {f.id(): f for f in self.processed.getFeatures()}
+        diffs = []
+        for feat in partitioned.getFeatures():
+            ref = expected.pop(feat.id(), None)
+            if ref is None:
+                diffs.append((feat.id(), None, None, "extra feature"))
+                continue
+            diffs.extend((feat.id(), col, ref[col], feat[col]) for col in columns if ref[col] != feat[col])
+        diffs.extend((fid, None, "missing feature", None) for fid in expected)
+        return diffs
+
+    def process_osm_tags_and_ids(self):
+        from qgis.core import QgsVectorLayer
+        source = QgsVectorLayer(self.pbf_path, "multipolygons", "ogr")
+        runs, _ = _timed(lambda: (self._fresh(source),), self.c3.process_osm_tags_and_ids, self.repeat)
+        self._record("process_osm_tags_and_ids", source.featureCount(), runs)
+
+    def with_solar(self):
+        blds, panels = self.solar
+        runs, _ = _timed(lambda: (blds.copy(), panels.copy()), self.c3._with_solar, self.repeat)
+        self._record("with_solar", len(blds), runs, panels=len(panels))
+        if self.workers:
+            runs, _ = _timed(lambda: (blds.copy(), panels.copy()),
+                             lambda b, s: self.c3._with_solar(b, s, workers=self.workers), self.repeat)
+            self._record(f"with_solar[workers={self.workers}]", len(blds), runs, panels=len(panels))
+
+    def layer_to_geojson_dict(self):
+        runs, gj = _timed(lambda: (self.processed,), self.c3.layer_to_geojson_dict, self.repeat)
+        self._record("layer_to_geojson_dict", len(gj["features"]), runs)
+
+    def create_3Dviz(self):
+        for payload in self.payloads:
+            out_dir = os.path.join(self.tmp, f"viz_{payload}")
+            os.makedirs(out_dir, exist_ok=True)
+            runs, html = _timed(lambda: (out_dir, self.processed),
+                                lambda d, layer: self.c3.create_3Dviz(d, layer, payload=payload), self.repeat)
+            self._record("create_3Dviz" if payload == "json" else f"create_3Dviz[{payload}]",
+                         self.processed.featureCount(), runs, bytes=os.path.getsize(html))
+
+    def run(self, stages=STAGES):
+        for stage in stages:
+            getattr(self, stage)()
+        return self.rows
+
+
+def _key(row):
+    return f"{row['stage']}@{row['size']}"
+
+
+def compare(old, new, threshold=0.10):
+    """
+    Prints median times of two result files side by side.
+    Returns the keys that got slower by more than threshold (0.10 = 10 %).
+    """
+    old_rows = {_key(r): r for r in old["results"]}
+    slower = []
+    print(f"old: {old['environment'].get('commit')} ({old['environment'].get('date')})")
+    print(f"new: {new['environment'].get('commit')} ({new['environment'].get('date')})")
+    print(f"{'stage@size':>42} {'old [s]':>10} {'new [s]':>10} {'change':>9}")
+    for row in new["results"]:
+        key = _key(row)
+        if key not in old_rows:
+            print(f"{key:>42} {'-':>10} {row['median']:10.3f} {'new':>9}")
+            continue
+        before, after = old_rows[key]["median"], row["median"]
+        change = (after - before) / before if before else 0.0
+        flag = ""
+        if change > threshold:
+            slower.append(key)
+            flag = "  slower"
+        elif change < -threshold:
+            flag = "  faster"
+        print(f"{key:>42} {before:10.3f} {after:10.3f} {change:+8.1%}{flag}")
+    return slower
+
+
+def parity(sizes, workers=None, show=10):
+    """Serial vs partitioned process3D on each synthetic city; True when they agree."""
+    _qgis_app()
+    import city3D
+
+    ok = True
+    with tempfile.TemporaryDirectory(prefix="geo3D_parity_") as tmp:
+        for n in sizes:
+            diffs = PipelineBench(city3D, n, workers=workers, tmp=tmp).parity()
+            print(f"process3D parity {n:>8}: {len(diffs)} differing values")
+            for fid, col, serial, partitioned in diffs[:show]:
+                print(f"    fid {fid} {col}: {serial!r} != {partitioned!r}")
+            ok = ok and not diffs
+    return ok
+
+
+def _load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def run(sizes, repeat=3, stages=STAGES, workers=None, payloads=("json",)):
+    _qgis_app()
+    import city3D
+
+    saved_cache = dict(city3D.OVERPASS_CACHE)
+    city3D.set_overpass_cache(offline=False)
+    rows = []
+    print(f"{'stage':>32} {'size':>8} {'features':>9} {'min [s]':>10} {'median [s]':>10}")
+    try:
+        with tempfile.TemporaryDirectory(prefix="geo3D_bench_") as tmp:
+            for n in sizes:
+                bench = PipelineBench(city3D, n, repeat, workers, payloads, tmp)
+                rows.extend(bench.run(stages))
+    finally:
+        city3D.OVERPASS_CACHE.update(saved_cache)
+
+    return {"environment": _environment(),
+            "settings": {"sizes": sizes, "repeat": repeat, "workers": workers, "payloads": list(payloads)},
+            "results": rows}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per stage")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--workers", type=int, default=None, help="also time the partitioned process3D/_with_solar")
+    parser.add_argument("--payloads", nargs="+", choices=["json", "inline", "sidecar"], default=["json"])
+    parser.add_argument("--out", default=None, help="results file (default benchmarks/results/pipeline-<commit>.json)")
+    parser.add_argument("--baseline", default=None, help="earlier results file to compare this run against")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="only compare two results files")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change reported as slower/faster")
+    parser.add_argument("--parity", action="store_true", help="only check process3D with --workers (default 2) against the serial run")
+    args = parser.parse_args()
+
+    if args.parity:
+        sys.exit(0 if parity(args.sizes, args.workers) else 1)
+
+    if args.compare:
+        sys.exit(1 if compare(_load(args.compare[0]), _load(args.compare[1]), args.threshold) else 0)
+
+    results = run(args.sizes, args.repeat, args.stages, args.workers, args.payloads)
+    out = args.out or os.path.join(HERE, "results", f"pipeline-{results['environment']['commit'] or 'local'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(results, f, indent=1)
+    print(f"results -> {out}")
+
+    if args.baseline:
+        sys.exit(1 if compare(_load(args.baseline), results, args.threshold) else 0)
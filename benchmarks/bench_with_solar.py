@@ -0,0 +1,123 @@
+#- geo3D_qgis: 2026
+#- arkriger
+
+"""
+Scaling benchmark: city3D._with_solar (bulk STRtree join) against the
+original brute-force double loop.
+
+Run with a Python that can import the QGIS bindings, e.g.
+
+    python benchmarks/bench_with_solar.py --sizes 100 250 500 1000 10000
+
+or from the QGIS Python console:
+
+    exec(open('/full/path/benchmarks/bench_with_solar.py').read())
+
+The brute-force baseline is O(n*m) and is skipped above --loop-max buildings.
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import geopandas as gpd
+from shapely.geometry import box
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import city3D
+
+
+def synthetic_city(n_buildings, panels_per_building=1.0, seed=0):
+    """Grid of 10x8 m footprints (UTM metres); ~panels_per_building panels inside them."""
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(n_buildings)))
+    ix, iy = np.divmod(np.arange(n_buildings), side)
+    x0, y0 = 250000.0 + ix * 15.0, 6240000.0 + iy * 12.0
+    blds = gpd.GeoDataFrame(
+        {"osm_id": np.arange(n_buildings).astype(str)},
+        geometry=[box(x, y, x + 10.0, y + 8.0) for x, y in zip(x0, y0)],
+        crs="EPSG:32734",
+    )
+
+    n_panels = int(n_buildings * panels_per_building)
+    host = rng.integers(0, n_buildings, n_panels)
+    px = x0[host] + rng.uniform(0.5, 7.5, n_panels)
+    py = y0[host] + rng.uniform(0.5, 5.5, n_panels)
+    sol = gpd.GeoDataFrame(
+        {
+            "osm_id": (n_buildings + np.arange(n_panels)).astype(str),
+            "generator:method": rng.choice(["photovoltaic", "thermal"], n_panels),
+        },
+        geometry=[box(x, y, x + 2.0, y + 1.7) for x, y in zip(px, py)],
+        crs="EPSG:32734",
+    )
+    return blds, sol
+
+
+def _with_solar_loop(gdf_buildings, gdf_solar):
+    """The original O(n*m) join, kept here as the baseline."""
+    n_bld = len(gdf_buildings["geometry"])
+    n_sol = len(gdf_solar["geometry"])
+    solar_id_lists = [[] for _ in range(n_bld)]
+    solar_m = [[] for _ in range(n_bld)]
+    has_solar = [False] * n_bld
+    bld_id_lists = [[] for _ in range(n_sol)]
+
+    for i in range(n_bld):
+        b_geom = gdf_buildings["geometry"].iloc[i]
+        bld_id = gdf_buildings["osm_id"].iloc[i]
+        for j in range(n_sol):
+            s_geom = gdf_solar["geometry"].iloc[j]
+            sol_id = gdf_solar["osm_id"].iloc[j]
+            s_m = gdf_solar['generator:method'].iloc[j]
+            if b_geom.contains(s_geom):
+                has_solar[i] = True
+                solar_id_lists[i].append(sol_id)
+                solar_m[i].append(s_m)
+                bld_id_lists[j].append(bld_id)
+
+    gdf_buildings["children"] = [l or None for l in solar_id_lists]
+    gdf_buildings["has_solar"] = has_solar
+    gdf_buildings["method"] = solar_m
+    gdf_solar["parent"] = [l or None for l in bld_id_lists]
+    return gdf_buildings, gdf_solar
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    out = func(*args)
+    return time.perf_counter() - start, out
+
+
+def run(sizes, loop_max=500, panels_per_building=1.0):
+    rows = []
+    for n in sizes:
+        blds, sol = synthetic_city(n, panels_per_building)
+        t_idx, (b_new, s_new) = _timed(city3D._with_solar, blds.copy(), sol.copy())
+
+        t_loop = None
+        if n <= loop_max:
+            t_loop, (b_old, s_old) = _timed(_with_solar_loop, blds.copy(), sol.copy())
+            for col in ("children", "has_solar", "method"):
+                assert b_old[col].tolist() == b_new[col].tolist(), f"building column {col} differs"
+            assert s_old["parent"].tolist() == s_new["parent"].tolist(), "solar column parent differs"
+
+        rows.append((n, len(sol), t_loop, t_idx))
+
+    print(f"{'buildings':>10} {'panels':>8} {'loop [s]':>10} {'strtree [s]':>12} {'speed-up':>9}")
+    for n, m, t_loop, t_idx in rows:
+        loop = f"{t_loop:10.3f}" if t_loop is not None else f"{'skipped':>10}"
+        speed = f"{t_loop / t_idx:8.0f}x" if t_loop is not None else f"{'':>9}"
+        print(f"{n:>10} {m:>8} {loop} {t_idx:12.3f} {speed}")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 250, 500, 1000, 10000, 50000])
+    parser.add_argument("--loop-max", type=int, default=500, help="largest size the brute-force loop is run at")
+    parser.add_argument("--panels", type=float, default=1.0, help="panels per building")
+    args = parser.parse_args()
+    run(args.sizes, args.loop_max, args.panels)
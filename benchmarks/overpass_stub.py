@@ -0,0 +1,106 @@
+#- geo3D_qgis: 2026
+#- arkriger
+
+"""
+Local stand-in for the Overpass API, so harvesters can be timed (and run)
+without a network.
+
+    with OverpassStub(payload) as stub:     # payload: dict or raw JSON bytes
+        raw = city3D._fetch_overpass(query, cache=False)
+    stub.requests                            # queries the stub answered
+
+The stub listens on 127.0.0.1 (a free port) and points city3D.OVERPASS_URL
+at itself for the duration of the with block. It answers
+/api/interpreter?data=... with the payload (or routes(query) -> payload)
+and /api/status with a rate-limit report. latency adds a fixed server delay
+per answer; busy=n answers the first n interpreter requests with HTTP 429.
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class OverpassStub:
+    def __init__(self, payload=None, routes=None, latency=0.0, slots=4, busy=0, module=None):
+        self.payload = self._encode(payload if payload is not None else {"elements": []})
+        self.routes = routes
+        self.latency = latency
+        self.slots = slots
+        self.busy = busy
+        self.module = module
+        self.requests = []
+        self.bytes_sent = 0
+        self._server = None
+        self._thread = None
+        self._saved_url = None
+
+    @staticmethod
+    def _encode(payload):
+        return payload if isinstance(payload, (bytes, bytearray)) else json.dumps(payload).encode("utf-8")
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api/interpreter"
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                if parts.path.endswith("/status"):
+                    text = f"Connected as: 0\nRate limit: {stub.slots}\n{stub.slots} slots available now.\n"
+                    return self._send(200, text.encode(), "text/plain")
+
+                query = parse_qs(parts.query).get("data", [""])[0]
+                stub.requests.append(query)
+                if stub.latency:
+                    time.sleep(stub.latency)
+                if len(stub.requests) <= stub.busy:
+                    return self._send(429, b"Too Many Requests", "text/plain")
+                body = stub._encode(stub.routes(query)) if stub.routes else stub.payload
+                stub.bytes_sent += len(body)
+                self._send(200, body, "application/json")
+
+            def _send(self, status, body, content_type):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+        if self.module is None:
+            import city3D
+            self.module = city3D
+        self._saved_url = self.module.OVERPASS_URL
+        self.module.OVERPASS_URL = self.url
+        return self
+
+    def stop(self):
+        if self.module is not None and self._saved_url is not None:
+            self.module.OVERPASS_URL = self._saved_url
+            self._saved_url = None
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,238 @@
+#- geo3D_qgis: 2026
+#- arkriger
+
+"""
+Synthetic OSM data for the benchmarks: a city block grid of buildings with
+realistic tags, and solar panels on some of the roofs.
+
+The same city comes out in the shapes city3D reads:
+
+    overpass_json(city)     -> Overpass `out geom;` response (dict)
+    pbf_geojson(city)       -> GeoJSON shaped like the GDAL OSM driver
+                               'multipolygons' layer (osm_id/osm_way_id, other_tags)
+    solar_overpass_json(city), solar_pbf_geojson(city)
+                            -> the solar theme in both shapes
+
+Pure Python/numpy, so the data can be made (and cached as files) without QGIS.
+"""
+
+import json
+
+import numpy as np
+
+#- somewhere in Cape Town
+ORIGIN = (18.42, -33.93)
+_M_LAT = 1.0 / 111320.0
+_M_LON = float(_M_LAT / np.cos(np.radians(ORIGIN[1])))
+
+_BUILDING_TYPES = ["house", "residential", "apartments", "detached", "yes", "commercial",
+                   "retail", "school", "church", "cabin", "roof", "bridge", "garage", "shed"]
+_BUILDING_P = [0.25, 0.15, 0.12, 0.08, 0.12, 0.06, 0.04, 0.03, 0.02, 0.03, 0.03, 0.01, 0.03, 0.03]
+_STREETS = ["Main Road", "Station Road", "Church Street", "Long Street", "Kloof Street",
+            "Victoria Road", "Buitengracht Street", "Voortrekker Road"]
+_SUBURBS = ["Observatory", "Woodstock", "Salt River", "Mowbray", "Rondebosch"]
+_AMENITIES = ["school", "place_of_worship", "clinic", "community_centre", "library"]
+
+
+def synthetic_city(n_buildings, solar_share=0.3, relation_share=0.05, seed=0):
+    """
+    n_buildings footprints on a street grid (about 10 x 8 m each, 15 m apart).
+    solar_share: fraction of buildings with a panel on the roof.
+    relation_share: fraction drawn as multipolygon relations with a courtyard.
+    Returns a dict of plain-list columns; the shape converters below read it.
+    """
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(n_buildings)))
+    iy, ix = np.divmod(np.arange(n_buildings), side)
+
+    w = rng.uniform(7.0, 14.0, n_buildings)
+    h = rng.uniform(6.0, 10.0, n_buildings)
+    x0 = ix * 18.0 + rng.uniform(0.0, 2.0, n_buildings)
+    y0 = iy * 14.0 + rng.uniform(0.0, 2.0, n_buildings)
+
+    btype = rng.choice(_BUILDING_TYPES, n_buildings, p=_BUILDING_P)
+    levels = rng.integers(1, 7, n_buildings)
+    has_levels = rng.random(n_buildings) < 0.7
+    has_addr = rng.random(n_buildings) < 0.6
+    has_name = rng.random(n_buildings) < 0.05
+    amenity = np.where(rng.random(n_buildings) < 0.03, rng.choice(_AMENITIES, n_buildings), "")
+    flats = np.where((btype == "apartments") & (rng.random(n_buildings) < 0.5),
+                     rng.integers(4, 60, n_buildings), 0)
+    relation = rng.random(n_buildings) < relation_share
+
+    has_solar = rng.random(n_buildings) < solar_share
+    hosts = np.flatnonzero(has_solar)
+    pw, ph = np.full(len(hosts), 2.0), np.full(len(hosts), 1.7)
+    px = x0[hosts] + rng.uniform(0.5, w[hosts] - pw - 0.5)
+    py = y0[hosts] + rng.uniform(0.5, h[hosts] - ph - 0.5)
+    method = rng.choice(["photovoltaic", "thermal"], len(hosts), p=[0.8, 0.2])
+
+    columns = {
+        "footprint": _rings(x0, y0, w, h),
+        "courtyard": _rings(x0 + w * 0.35, y0 + h * 0.35, w * 0.3, h * 0.3),
+        "panel": _rings(px, py, pw, ph),
+        "building": btype, "levels": levels, "has_levels": has_levels,
+        "has_addr": has_addr, "housenumber": rng.integers(1, 400, n_buildings),
+        "street": rng.choice(_STREETS, n_buildings), "suburb": rng.choice(_SUBURBS, n_buildings),
+        "has_name": has_name, "amenity": amenity, "flats": flats, "relation": relation,
+        "solar_host": hosts, "solar_method": method,
+    }
+    city = {k: v if isinstance(v, list) else v.tolist() for k, v in columns.items()}
+    city.update(n=n_buildings, seed=seed)
+    return city
+
+
+def _rings(x0, y0, w, h):
+    """Closed lon/lat rings (counter-clockwise) of local-metre rectangles, as nested lists."""
+    xs = np.stack([x0, x0 + w, x0 + w, x0, x0], axis=1)
+    ys = np.stack([y0, y0, y0 + h, y0 + h, y0], axis=1)
+    lon = np.round(ORIGIN[0] + xs * _M_LON, 7)
+    lat = np.round(ORIGIN[1] + ys * _M_LAT, 7)
+    return np.stack([lon, lat], axis=2).tolist()
+
+
+def _building_tags(city, i):
+    tags = {"building": str(city["building"][i])}
+    if city["has_levels"][i]:
+        tags["building:levels"] = str(city["levels"][i])
+    if city["has_addr"][i]:
+        tags["addr:housenumber"] = str(city["housenumber"][i])
+        tags["addr:street"] = str(city["street"][i])
+        tags["addr:suburb"] = str(city["suburb"][i])
+        tags["addr:city"] = "Cape Town"
+    if city["has_name"][i]:
+        tags["name"] = f"Building {i}"
+    if city["amenity"][i]:
+        tags["amenity"] = str(city["amenity"][i])
+    if city["flats"][i]:
+        tags["building:flats"] = str(city["flats"][i])
+    if city["building"][i] == "bridge":
+        tags["min_height"] = "4"
+    return tags
+
+
+def _overpass_way(el_id, ring, tags=None):
+    el = {"type": "way", "id": el_id, "geometry": [{"lat": lat, "lon": lon} for lon, lat in ring]}
+    if tags is not None:
+        el["tags"] = tags
+    return el
+
+
+def overpass_json(city):
+    """Buildings as an Overpass `out geom;` response (ways, plus relations with inner rings)."""
+    elements = []
+    for i in range(city["n"]):
+        tags = _building_tags(city, i)
+        if city["relation"][i]:
+            members = [dict(_overpass_way(900000000 + 2 * i, city["footprint"][i]), role="outer"),
+                       dict(_overpass_way(900000001 + 2 * i, city["courtyard"][i]), role="inner")]
+            for m in members:
+                m["ref"] = m.pop("id")
+            elements.append({"type": "relation", "id": 10000000 + i,
+                             "tags": dict(tags, type="multipolygon"), "members": members})
+        else:
+            elements.append(_overpass_way(100000000 + i, city["footprint"][i], tags))
+    return _overpass_response(elements)
+
+
+def solar_overpass_json(city):
+    """Solar panels as an Overpass `out geom;` response."""
+    elements = []
+    for j in range(len(city["solar_host"])):
+        ring = city["panel"][j]
+        tags = {"power": "generator", "generator:source": "solar",
+                "generator:method": str(city["solar_method"][j]), "generator:type": "solar_photovoltaic_panel"}
+        elements.append(_overpass_way(500000000 + j, ring, tags))
+    return _overpass_response(elements)
+
+
+def _overpass_response(elements):
+    return {
+        "version": 0.6, "generator": "Overpass API (synthetic)",
+        "osm3s": {"timestamp_osm_base": "2026-01-01T00:00:00Z",
+                  "copyright": "synthetic data for benchmarks"},
+        "elements": elements,
+    }
+
+
+#- columns the GDAL OSM driver gives the multipolygons layer with the default osmconf.ini
+_PBF_COLUMNS = ["name", "type", "amenity", "building"]
+
+
+def _other_tags(tags):
+    """hstore text, as the GDAL OSM driver writes it."""
+    if not tags:
+        return None
+    return ",".join('"{}"=>"{}"'.format(k.replace('"', '\\"'), str(v).replace('"', '\\"'))
+                    for k, v in tags.items())
+
+
+def _pbf_feature(osm_id, osm_way_id, tags, rings):
+    props = {"osm_id": osm_id, "osm_way_id": osm_way_id}
+    for k in _PBF_COLUMNS:
+        props[k] = tags.get(k)
+    props["other_tags"] = _other_tags({k: v for k, v in tags.items() if k not in _PBF_COLUMNS})
+    return {"type": "Feature", "properties": props,
+            "geometry": {"type": "MultiPolygon", "coordinates": [rings]}}
+
+
+def pbf_geojson(city):
+    """
+    Buildings as the GDAL OSM driver 'multipolygons' layer: closed ways carry
+    osm_way_id, relations osm_id; every other key is folded into other_tags.
+    """
+    features = []
+    for i in range(city["n"]):
+        tags = _building_tags(city, i)
+        if city["relation"][i]:
+            features.append(_pbf_feature(str(10000000 + i), None, dict(tags, type="multipolygon"),
+                                         [city["footprint"][i], city["courtyard"][i]]))
+        else:
+            features.append(_pbf_feature(None, str(100000000 + i), tags, [city["footprint"][i]]))
+    return {"type": "FeatureCollection", "name": "multipolygons", "features": features}
+
+
+def solar_pbf_geojson(city):
+    """Solar panels as the GDAL OSM driver 'multipolygons' layer."""
+    features = []
+    for j in range(len(city["solar_host"])):
+        ring = city["panel"][j]
+        tags = {"power": "generator", "generator:source": "solar",
+                "generator:method": str(city["solar_method"][j])}
+        features.append(_pbf_feature(None, str(500000000 + j), tags, [ring]))
+    return {"type": "FeatureCollection", "name": "multipolygons", "features": features}
+
+
+def solar_frames(city, crs="EPSG:32734"):
+    """(buildings, panels) GeoDataFrames in a metric CRS, the input of city3D._with_solar."""
+    import geopandas as gpd
+    from shapely.geometry import Polygon
+
+    blds = gpd.GeoDataFrame(
+        {"osm_id": [str(100000000 + i) for i in range(city["n"])]},
+        geometry=[Polygon(r) for r in city["footprint"]], crs="EPSG:4326")
+    panels = gpd.GeoDataFrame(
+        {"osm_id": [str(500000000 + j) for j in range(len(city["solar_host"]))],
+         "generator:method": city["solar_method"]},
+        geometry=[Polygon(r) for r in city["panel"]], crs="EPSG:4326")
+    return blds.to_crs(crs), panels.to_crs(crs)
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(description="Write synthetic OSM files for a benchmark size.")
+    parser.add_argument("n", type=int, help="number of buildings")
+    parser.add_argument("--out", default=".", help="output directory")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    city = synthetic_city(args.n, seed=args.seed)
+    os.makedirs(args.out, exist_ok=True)
+    for name, data in (("overpass_buildings", overpass_json(city)), ("overpass_solar", solar_overpass_json(city)),
+                       ("pbf_buildings", pbf_geojson(city)), ("pbf_solar", solar_pbf_geojson(city))):
+        path = os.path.join(args.out, f"{name}_{args.n}.json")
+        with open(path, "w") as f:
+            json.dump(data, f)
+        print(path)
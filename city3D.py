@@ -2,49 +2,488 @@
 #- arkriger
 
 import os
+import sys
 import json
-import processing
+import time
+import hashlib
+import tempfile
+import base64
+import functools
+import contextlib
+from array import array
+from collections import OrderedDict
 from urllib.parse import quote
 import re
 import numpy as np
-import pandas as pd
-import geopandas as gpd
 
 from qgis.core import (
     QgsField, QgsProject, QgsDistanceArea, QgsCoordinateTransform, QgsFeatureRequest,
-    QgsCoordinateReferenceSystem, QgsGeometry, QgsVariantUtils, QgsVectorLayer, QgsVectorFileWriter,
-    QgsLineSymbol, QgsSingleSymbolRenderer, QgsMapLayer, QgsCoordinateTransformContext,
-    NULL, QgsField, QgsFeature
+    QgsCoordinateReferenceSystem, QgsGeometry, QgsRectangle, QgsVariantUtils, QgsWkbTypes, QgsVectorLayer, QgsVectorFileWriter,
+    QgsLineSymbol, QgsFillSymbol, QgsSingleSymbolRenderer, QgsMapLayer, QgsCoordinateTransformContext, QgsProviderRegistry,
+    NULL, QgsField, QgsFeature, QgsExpression
 )
-from qgis.PyQt.QtCore import QEventLoop, QUrl
-from qgis.PyQt.QtNetwork import QNetworkAccessManager, QNetworkRequest
+from qgis.PyQt.QtCore import Qt, QEventLoop, QTimer, QUrl
 from qgis.PyQt.QtGui import QColor
 
 from PyQt5.QtCore import QVariant
 
-from pyproj import CRS
+from city3D_kernels import (
+    get_rgb_color, encode_plus_codes, get_homebaked_plus_code, decode_plus_code, calculate_azimuths, grid_partitions,
+    process3D_partition, solar_partition, azimuth_partition, estimate_population, _numeric, _population_building,
+    _round2, _format2, _building_heights, _encode_viz_layer, _VIZ_MAX_PRECISION, _LazyModule
+)
 
-from osgeo import gdal, ogr, osr
+#- heavy dependencies load on first use (see benchmarks/bench_import.py)
+processing = _LazyModule("processing")
+pd = _LazyModule("pandas")
+gpd = _LazyModule("geopandas")
+shapely = _LazyModule("shapely")
+pyproj = _LazyModule("pyproj")
+gdal = _LazyModule("osgeo.gdal")
+ogr = _LazyModule("osgeo.ogr")
+osr = _LazyModule("osgeo.osr")
+QtNetwork = _LazyModule("qgis.PyQt.QtNetwork")
+#- and the standard-library modules only some functions need
+gzip = _LazyModule("gzip")
+struct = _LazyModule("struct")
+difflib = _LazyModule("difflib")
+tracemalloc = _LazyModule("tracemalloc")
+ET = _LazyModule("xml.etree.ElementTree")
 
 def _remove_layer_by_name(name):
     """Finds and removes any existing layer with the same name to prevent duplicates."""
     existing_layers = QgsProject.instance().mapLayersByName(name)
     for layer in existing_layers:
         QgsProject.instance().removeMapLayer(layer.id())
-        
-def _fetch_overpass(query):
-    """Synchronous network fetcher using QGIS-native QNetworkAccessManager."""
-    manager = QNetworkAccessManager()
+
+#- opt-in stage profiling. change with set_profiling(); read with profile_summary() / export_profile()
+PROFILE = {
+    "enabled": False,
+    "memory": True      # peak Python memory per stage (tracemalloc; slows allocation-heavy stages)
+}
+_PROFILE_RECORDS = []
+_PROFILE_STACK = []
+
+def set_profiling(enabled=None, memory=None):
+    """Switch stage profiling on/off; arguments left as None keep their current value."""
+    for key, value in (("enabled", enabled), ("memory", memory)):
+        if value is not None:
+            PROFILE[key] = value
+    if PROFILE["enabled"] and PROFILE["memory"] and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif tracemalloc.is_tracing() and not (PROFILE["enabled"] and PROFILE["memory"]):
+        tracemalloc.stop()
+    return dict(PROFILE)
+
+def reset_profile():
+    """Forgets every recorded stage."""
+    _PROFILE_RECORDS.clear()
+
+def _feature_count(obj):
+    """Features in a layer, (Geo)DataFrame, GeoJSON/Overpass dict, {name: layer} or (first of) a tuple."""
+    if isinstance(obj, tuple) and obj:
+        obj = obj[0]
+    if isinstance(obj, QgsVectorLayer):
+        return obj.featureCount()
+    if isinstance(obj, dict):
+        for key in ("features", "elements"):
+            if isinstance(obj.get(key), list):
+                return len(obj[key])
+        layers = [v for v in obj.values() if isinstance(v, QgsVectorLayer)]
+        return sum(l.featureCount() for l in layers) if layers else None
+    if hasattr(obj, "shape") and hasattr(obj, "__len__"):
+        return len(obj)
+    return None
+
+@contextlib.contextmanager
+def profile_stage(name, features_in=None):
+    """
+    Records the block as one stage while profiling is on (a no-op otherwise):
+    wall time, features in/out, bytes fetched/written and peak Python memory.
+    Stages opened inside it are nested below it. Yields the stage record
+    (None when off); set record["out"] to report the features produced.
+    """
+    if not PROFILE["enabled"]:
+        yield None
+        return
+    rec = {"stage": name, "depth": len(_PROFILE_STACK), "parent": _PROFILE_STACK[-1]["index"] if _PROFILE_STACK else None,
+           "index": len(_PROFILE_RECORDS), "seconds": None, "in": features_in, "out": None,
+           "fetched": 0, "written": 0, "peak_bytes": None, "error": None}
+    _PROFILE_RECORDS.append(rec)
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        current, peak = tracemalloc.get_traced_memory()
+        if _PROFILE_STACK and "_peak" in _PROFILE_STACK[-1]:
+            _PROFILE_STACK[-1]["_peak"] = max(_PROFILE_STACK[-1]["_peak"], peak)
+        tracemalloc.reset_peak()
+        rec["_base"] = rec["_peak"] = current
+    _PROFILE_STACK.append(rec)
+    start = time.perf_counter()
+    try:
+        yield rec
+    except BaseException as e:
+        rec["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        rec["seconds"] = time.perf_counter() - start
+        _PROFILE_STACK.pop()
+        if "_base" in rec:
+            base, peak = rec.pop("_base"), rec.pop("_peak")
+            if tracemalloc.is_tracing():
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                rec["peak_bytes"] = peak - base
+                if _PROFILE_STACK and "_peak" in _PROFILE_STACK[-1]:
+                    _PROFILE_STACK[-1]["_peak"] = max(_PROFILE_STACK[-1]["_peak"], peak)
+                tracemalloc.reset_peak()
+
+def _profile_bytes(fetched=0, written=0):
+    """Adds transferred bytes to every open stage (totals include nested stages)."""
+    for rec in _PROFILE_STACK:
+        rec["fetched"] += fetched
+        rec["written"] += written
+
+def _profile_out(n):
+    """Features produced by the innermost open stage, when the return value doesn't tell."""
+    if _PROFILE_STACK:
+        _PROFILE_STACK[-1]["out"] = n
+
+def _profiled(func):
+    """Records every call of a public entry point as a stage while profiling is on."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not PROFILE["enabled"]:
+            return func(*args, **kwargs)
+        counts = (_feature_count(a) for a in list(args) + list(kwargs.values()))
+        with profile_stage(func.__name__, next((c for c in counts if c is not None), None)) as rec:
+            result = func(*args, **kwargs)
+            if rec["out"] is None:
+                rec["out"] = _feature_count(result)
+            return result
+    return wrapper
+
+def _format_bytes(n):
+    if not n:
+        return "-"
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+
+def profile_summary(show=True):
+    """
+    Prints the recorded stages as a table (nested stages indented) and names
+    the stage with the largest self time (own time, nested stages excluded).
+    Returns the records as a list of dicts.
+    """
+    rows = [{k: v for k, v in rec.items() if not k.startswith("_")} for rec in _PROFILE_RECORDS]
+    for row in rows:
+        row["self_seconds"] = row["seconds"]
+    for row in rows:
+        if row["parent"] is not None and row["seconds"] is not None and rows[row["parent"]]["self_seconds"] is not None:
+            rows[row["parent"]]["self_seconds"] -= row["seconds"]
+    if not show:
+        return rows
+    if not rows:
+        print("No stages recorded (enable with set_profiling(True)).")
+        return rows
+
+    def cell(v):
+        return "-" if v is None else f"{v:,}"
+
+    print(f"{'stage':<36} {'total [s]':>10} {'self [s]':>9} {'in':>9} {'out':>9} {'fetched':>10} {'written':>10} {'peak mem':>10}")
+    for row in rows:
+        name = ("  " * row["depth"] + row["stage"])[:36]
+        total = "running" if row["seconds"] is None else f"{row['seconds']:.3f}"
+        own = "-" if row["self_seconds"] is None else f"{row['self_seconds']:.3f}"
+        peak = "-" if row["peak_bytes"] is None else _format_bytes(max(row["peak_bytes"], 0))
+        flag = "  (failed)" if row["error"] else ""
+        print(f"{name:<36} {total:>10} {own:>9} {cell(row['in']):>9} {cell(row['out']):>9} "
+              f"{_format_bytes(row['fetched']):>10} {_format_bytes(row['written']):>10} {peak:>10}{flag}")
+    done = [r for r in rows if r["self_seconds"] is not None]
+    if done:
+        slow = max(done, key=lambda r: r["self_seconds"])
+        top = sum(r["seconds"] for r in done if r["parent"] is None) or 1.0
+        print(f"Slowest stage: {slow['stage']} ({slow['self_seconds']:.3f}s, {slow['self_seconds'] / top:.0%} of the total)")
+    return rows
+
+def export_profile(path):
+    """Writes the recorded stages (see profile_summary) to a JSON file; returns path."""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": sys.version.split()[0],
+                   "memory": PROFILE["memory"], "stages": profile_summary(show=False)}, f, indent=1)
+    return path
+
+OVERPASS_URL = 'https://overpass-api.de/api/interpreter'
+
+#- on-disk Overpass response cache. change with set_overpass_cache()
+OVERPASS_CACHE = {
+    "enabled": True,
+    "dir": os.path.join(os.path.expanduser("~"), ".geo3D_cache", "overpass"),
+    "ttl": 7 * 24 * 3600,               # seconds before a response is fetched again
+    "max_bytes": 256 * 1024 * 1024,     # least recently used responses are evicted above this
+    "offline": False                    # True: serve only from the cache, never the network
+}
+
+def set_overpass_cache(enabled=None, cache_dir=None, ttl=None, max_bytes=None, offline=None):
+    """Adjust the Overpass cache; arguments left as None keep their current value."""
+    for key, value in (("enabled", enabled), ("dir", cache_dir), ("ttl", ttl),
+                       ("max_bytes", max_bytes), ("offline", offline)):
+        if value is not None:
+            OVERPASS_CACHE[key] = value
+    return dict(OVERPASS_CACHE)
+
+def clear_overpass_cache():
+    """Deletes every cached Overpass response."""
+    cache_dir = OVERPASS_CACHE["dir"]
+    if not os.path.isdir(cache_dir):
+        return 0
+    removed = 0
+    for fname in os.listdir(cache_dir):
+        if fname.endswith(".json"):
+            os.remove(os.path.join(cache_dir, fname))
+            removed += 1
+    return removed
+
+def _normalize_query(query):
+    """Collapses whitespace outside quoted strings so cosmetic edits share a cache entry."""
+    parts = re.split(r'("(?:[^"\\]|\\.)*")', query)
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r"\s*([;()\[\]{}=,])\s*", r"\1", re.sub(r"\s+", " ", parts[i]))
+    return "".join(parts).strip()
+
+def _overpass_cache_path(query):
+    key = hashlib.sha256(f"{OVERPASS_URL}\n{_normalize_query(query)}".encode("utf-8")).hexdigest()
+    return os.path.join(OVERPASS_CACHE["dir"], f"{key}.json")
+
+def _read_overpass_cache(path, allow_stale=False):
+    """Returns cached bytes (and marks them recently used) or None if missing/expired."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if not allow_stale and time.time() - st.st_mtime > OVERPASS_CACHE["ttl"]:
+        return None
+    with open(path, "rb") as f:
+        payload = f.read()
+    # atime tracks last use (LRU), mtime stays the fetch time (TTL)
+    os.utime(path, (time.time(), st.st_mtime))
+    return payload
+
+def _write_overpass_cache(path, payload):
+    """Atomically stores a response, then evicts least recently used entries over the size cap."""
+    cache_dir = os.path.dirname(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(payload)
+    os.replace(tmp, path)
+
+    entries = []
+    for fname in os.listdir(cache_dir):
+        if fname.endswith(".json"):
+            st = os.stat(os.path.join(cache_dir, fname))
+            entries.append((st.st_atime, st.st_size, os.path.join(cache_dir, fname)))
+    total = sum(size for _, size, _ in entries)
+    for _, size, fpath in sorted(entries):
+        if total <= OVERPASS_CACHE["max_bytes"]:
+            break
+        if fpath != path:
+            os.remove(fpath)
+            total -= size
+
+_SHARED_MANAGER = []
+
+def _network_manager():
+    """One QNetworkAccessManager for every Overpass request (connections are reused)."""
+    if not _SHARED_MANAGER:
+        _SHARED_MANAGER.append(QtNetwork.QNetworkAccessManager())
+    return _SHARED_MANAGER[0]
+
+def overpass_slots():
+    """
+    Free query slots reported by the Overpass server (api/status).
+    Returns None when the server has no rate limit or the status is unavailable.
+    """
+    url = OVERPASS_URL.rsplit("/", 1)[0] + "/status"
+    reply = _network_manager().get(QtNetwork.QNetworkRequest(QUrl(url)))
     loop = QEventLoop()
-    manager.finished.connect(loop.quit)
-    url = f'https://overpass-api.de/api/interpreter?data={quote(query)}'
-    reply = manager.get(QNetworkRequest(QUrl(url)))
+    reply.finished.connect(loop.quit)
     loop.exec_()
-    
-    if reply.error() != 0:
-        raise RuntimeError(f"Overpass request failed: {reply.errorString()}")
-    return json.loads(reply.readAll().data().decode())
+    text = reply.readAll().data().decode(errors="replace") if reply.error() == 0 else ""
+    reply.deleteLater()
+
+    if not text or re.search(r"Rate limit:\s*0\b", text):
+        return None
+    match = re.search(r"(\d+) slots? available now", text)
+    return int(match.group(1)) if match else 0
+
+def _print_progress(done, total, key, seconds):
+    print(f"[{done}/{total}] {key}: {seconds:.1f}s")
+
+class OverpassBatch:
+    """
+    Runs several Overpass queries at once on the shared network manager.
+
+    queries: {key: query}. At most max_concurrent requests are in flight, capped
+    by the free slots the server reports (check_slots=True). Responses go through
+    the Overpass cache like _fetch_overpass; busy answers (HTTP 429/504) are
+    retried with a back-off. progress(done, total, key, seconds) is called as each
+    query completes and on_finished(batch) once all have.
 
+    start() returns immediately (the QGIS event loop keeps running);
+    wait() blocks until every query is done and returns {key: raw_data}.
+    raw=True returns the response bytes unparsed (e.g. [out:xml] queries).
+    """
+    def __init__(self, queries, max_concurrent=4, cache=True, check_slots=True,
+                 progress=_print_progress, on_finished=None, retries=2, raw=False):
+        self.queries = dict(queries)
+        self.raw = raw
+        self.results, self.errors = {}, {}
+        self.max_concurrent = max_concurrent
+        self.limit = max_concurrent
+        self.cache = cache and OVERPASS_CACHE["enabled"]
+        self.check_slots = check_slots
+        self.progress = progress
+        self.on_finished = on_finished
+        self.retries = retries
+        self._pending, self._running, self._attempts, self._t0 = [], {}, {}, {}
+        self._loop = None
+        self._started = False
+        self._ready = False
+
+    @property
+    def done(self):
+        return len(self.results) + len(self.errors) == len(self.queries)
+
+    def start(self):
+        if self._started:
+            return self
+        self._started = True
+        for key, query in self.queries.items():
+            self._t0[key] = time.perf_counter()
+            self._attempts[key] = 0
+            if self.cache:
+                payload = _read_overpass_cache(_overpass_cache_path(query), allow_stale=OVERPASS_CACHE["offline"])
+                if payload is not None:
+                    self._complete(key, self._parse(payload))
+                    continue
+            if OVERPASS_CACHE["offline"]:
+                self._complete(key, error="Offline mode: no cached Overpass response for this query.")
+                continue
+            self._pending.append(key)
+
+        if self.check_slots and len(self._pending) > 1:
+            slots = overpass_slots()
+            if slots is not None:
+                self.limit = max(1, min(self.max_concurrent, slots))
+        self._ready = True
+        self._pump()
+        return self
+
+    def wait(self, strict=True):
+        """Blocks until all queries are done. strict: raise if any query failed."""
+        self.start()
+        if not self.done:
+            self._loop = QEventLoop()
+            self._loop.exec_()
+            self._loop = None
+        if strict and self.errors:
+            if len(self.errors) == 1:
+                raise RuntimeError(next(iter(self.errors.values())))
+            raise RuntimeError("; ".join(f"{k}: {e}" for k, e in self.errors.items()))
+        return {k: self.results[k] for k in self.queries if k in self.results}
+
+    def _pump(self):
+        if not self._ready:
+            return
+        while self._pending and len(self._running) < self.limit:
+            key = self._pending.pop(0)
+            try:
+                url = f'{OVERPASS_URL}?data={quote(self.queries[key])}'
+                reply = _network_manager().get(QtNetwork.QNetworkRequest(QUrl(url)))
+            except Exception as e:
+                # _complete pumps the rest of the queue
+                self._complete(key, error=f"{type(e).__name__}: {e}")
+                return
+            self._running[key] = reply
+            reply.finished.connect(lambda key=key: self._reply_finished(key))
+
+    def _retry(self, key):
+        self._pending.append(key)
+        self._pump()
+
+    def _reply_finished(self, key):
+        # Qt slot: an exception here would never reach wait(), so it becomes the query's error
+        reply = self._running.pop(key)
+        try:
+            outcome = self._read_reply(key, reply)
+        except Exception as e:
+            outcome = (None, f"{type(e).__name__}: {e}")
+        if outcome is None:
+            self._pump()
+        else:
+            self._complete(key, *outcome)
+
+    def _read_reply(self, key, reply):
+        """(data, error) of a finished reply, or None when the query was queued for a retry."""
+        status = reply.attribute(QtNetwork.QNetworkRequest.HttpStatusCodeAttribute)
+        failed, message = reply.error() != 0, reply.errorString()
+        payload = reply.readAll().data()
+        reply.deleteLater()
+        _profile_bytes(fetched=len(payload))
+        query = self.queries[key]
+        cache_path = _overpass_cache_path(query) if self.cache else None
+
+        if status in (429, 504) and self._attempts[key] < self.retries:
+            # the server is out of slots: back off, let the others proceed
+            self._attempts[key] += 1
+            QTimer.singleShot(5000 * self._attempts[key], lambda key=key: self._retry(key))
+            return None
+
+        if failed:
+            # a stale answer beats no answer in a low-connectivity venue
+            stale = _read_overpass_cache(cache_path, allow_stale=True) if self.cache else None
+            if stale is not None:
+                print(f"Overpass request failed ({message}); using an expired cached response.")
+                return self._parse(stale), None
+            return None, f"Overpass request failed: {message}"
+
+        data = self._parse(payload)
+        failed = b"runtime error" in payload[-2048:] if self.raw else data.get("remark", "").startswith("runtime error")
+        if self.cache and not failed:
+            _write_overpass_cache(cache_path, payload)
+        return data, None
+
+    def _parse(self, payload):
+        return payload if self.raw else json.loads(payload.decode())
+
+    def _complete(self, key, data=None, error=None):
+        if error is None:
+            self.results[key] = data
+        else:
+            self.errors[key] = error
+        if self.progress:
+            self.progress(len(self.results) + len(self.errors), len(self.queries), key,
+                          time.perf_counter() - self._t0[key])
+        if not self.done:
+            self._pump()
+            return
+        if self._loop is not None:
+            self._loop.quit()
+        if self.on_finished:
+            self.on_finished(self)
+
+@_profiled
+def _fetch_overpass(query, cache=True, raw=False):
+    """
+    Synchronous network fetcher using QGIS-native QNetworkAccessManager.
+    Responses are kept in a content-addressed disk cache (see OVERPASS_CACHE).
+    raw=True returns the response bytes instead of parsed JSON.
+    """
+    batch = OverpassBatch({"query": query}, max_concurrent=1, cache=cache, check_slots=False, progress=None, raw=raw)
+    return batch.wait()["query"]
+
+@_profiled
 def _parse_to_geojson(raw_data, geom_type="Polygon"):
     """Generic Overpass JSON to GeoJSON converter."""
     geojson = {"type": "FeatureCollection", "features": []}
@@ -97,95 +536,751 @@ def _parse_to_geojson(raw_data, geom_type="Polygon"):
                     
     return geojson
 
-def overpass2qgis(large, focus, zoom=True):
-    """Harvest buildings and add to project."""
-    name = f"Buildings_{focus}"
-    query = (f'[out:json][timeout:180];area[name="{large}"]->.L;area[name="{focus}"](area.L)->.a;(way["building"](area.a);relation["building"]["type"="multipolygon"](area.a););out geom;')
-    data = _fetch_overpass(query)
-    vlayer = QgsVectorLayer(json.dumps(_parse_to_geojson(data, "Polygon")), name, "ogr")
-    final = vlayer.materialize(QgsFeatureRequest())
-    
+_ADDRESS_KEYS = ['name', 'addr:housename', 'addr:flats', 'addr:housenumber', 'addr:street', 'addr:suburb', 'addr:postcode', 'addr:city', 'addr:province']
+
+#- OSM keys read by process3D, the address builder and the population rules.
+#- pass as tags= to keep a harvested building layer lean
+BUILDING_TAGS = [
+    'building', 'building:levels', 'building:use', 'building:flats', 'building:units',
+    'beds', 'rooms', 'residential', 'amenity', 'social_facility', 'operator',
+    'height', 'min_height', 'roof:shape'
+] + _ADDRESS_KEYS
+
+def _coords_wkb(points):
+    """Point count + little-endian doubles for a list of Overpass {lat, lon} dicts."""
+    xy = array('d')
+    for pt in points:
+        xy.append(pt["lon"])
+        xy.append(pt["lat"])
+    return struct.pack('<I', len(points)) + xy.tobytes()
+
+def _overpass_geometry(el, geom_type="Polygon"):
+    """
+    QgsGeometry for one Overpass element, built from WKB.
+    Follows the same rules as _parse_to_geojson; None when the element is skipped.
+    """
+    wkb = None
+    if el.get("type") == "way" and "geometry" in el:
+        pts = el["geometry"]
+        if len(pts) < 2: return None
+        if geom_type == "MultiLineString":
+            wkb = struct.pack('<BII', 1, 5, 1) + struct.pack('<BI', 1, 2) + _coords_wkb(pts)
+        elif geom_type == "Polygon":
+            if len(pts) < 4: return None
+            wkb = struct.pack('<BII', 1, 3, 1) + _coords_wkb(pts)
+        else:
+            wkb = struct.pack('<BI', 1, 2) + _coords_wkb(pts)
+
+    elif el.get("type") == "relation" and "members" in el:
+        if geom_type == "MultiLineString":
+            lines = [m["geometry"] for m in el["members"] if m.get("type") == "way" and "geometry" in m]
+            if lines:
+                wkb = struct.pack('<BII', 1, 5, len(lines)) + b"".join(
+                    struct.pack('<BI', 1, 2) + _coords_wkb(l) for l in lines)
+        elif geom_type == "Polygon":
+            outers = [m["geometry"] for m in el["members"] if m.get("role") == "outer" and "geometry" in m]
+            inners = [m["geometry"] for m in el["members"] if m.get("role") == "inner" and "geometry" in m]
+            if outers:
+                rings = outers + inners
+                wkb = struct.pack('<BII', 1, 3, len(rings)) + b"".join(_coords_wkb(r) for r in rings)
+
+    if wkb is None:
+        return None
+    geom = QgsGeometry()
+    geom.fromWkb(wkb)
+    return geom
+
+@_profiled
+def _overpass_to_layer(raw_data, name, geom_type="Polygon", tags=None, converters=None, batch_size=5000):
+    """
+    Streams Overpass elements straight into a typed memory layer (EPSG:4326),
+    skipping the GeoJSON dict -> json string -> OGR -> materialize copies.
+
+    tags: whitelist of OSM keys that make up the schema; None keeps every key found.
+    converters: {key: (QgsField, func)} for non-string columns (e.g. colour as an integer list).
+    Every layer also carries osm_id and osm_type.
+    """
+    elements = raw_data.get("elements", [])
+    converters = converters or {}
+
+    # ---- fixed schema: whitelist, or every key (a cheap pass over the tags only) ----
+    if tags is None:
+        seen = {}
+        for el in elements:
+            seen.update(dict.fromkeys(el.get("tags", {})))
+        tags = list(seen)
+    tags = [k for k in tags if k not in ('osm_id', 'osm_type')]
+
+    layer = QgsVectorLayer(f"{geom_type}?crs=EPSG:4326", name, "memory")
+    pr = layer.dataProvider()
+    pr.addAttributes(
+        [QgsField('osm_id', QVariant.String), QgsField('osm_type', QVariant.String)]
+        + [converters[k][0] if k in converters else QgsField(k, QVariant.String) for k in tags]
+    )
+    layer.updateFields()
+    fields = layer.fields()
+
+    # ---- features go to the provider in batches; nothing else is held in memory ----
+    batch = []
+    for el in elements:
+        geom = _overpass_geometry(el, geom_type)
+        if geom is None: continue
+        el_tags = el.get("tags", {})
+        attrs = [str(el.get("id")), el.get("type")]
+        for k in tags:
+            v = el_tags.get(k)
+            if v is not None and k in converters:
+                v = converters[k][1](v)
+            attrs.append(v)
+
+        feat = QgsFeature(fields)
+        feat.setGeometry(geom)
+        feat.setAttributes(attrs)
+        batch.append(feat)
+        if len(batch) >= batch_size:
+            pr.addFeatures(batch)
+            batch = []
+    if batch:
+        pr.addFeatures(batch)
+
+    # the data's OSM timestamp: the starting point of update_osm
+    osm_base = raw_data.get("osm3s", {}).get("timestamp_osm_base")
+    if osm_base:
+        layer.setCustomProperty(_OSM_BASE_PROPERTY, osm_base)
+    layer.updateExtents()
+    return layer
+
+#- Overpass filters per theme. shared by the single-theme harvesters and q_themes
+_THEMES = {
+    "buildings": {"layer": "Buildings_{focus}", "keep_empty": True,
+                  "filters": ['way["building"]', 'relation["building"]["type"="multipolygon"]']},
+    "farmland": {"layer": "Farmland_{focus}", "keep_empty": False,
+                 "filters": ['way["landuse"="farmland"]', 'relation["landuse"="farmland"]["type"="multipolygon"]']},
+    "green": {"layer": "GreenSpaces_{focus}", "keep_empty": False,
+              "filters": ['way["leisure"~"park|track|pitch"]', 'relation["leisure"~"park|track|pitch"]["type"="multipolygon"]']},
+    "water": {"layer": "Water_{focus}", "keep_empty": False,
+              "filters": ['way["water"]', 'way["waterway"="stream"]', 'relation["water"]["type"="multipolygon"]']},
+    "solar": {"layer": "Solar_{focus}", "keep_empty": True,
+              "filters": ['way["power"="generator"]["generator:source"="solar"]']},
+}
+
+def _area_header(large, focus, settings="[out:json][timeout:180]"):
+    """Query prologue that resolves the focus area inside the large area into set .a"""
+    return f'{settings};area[name="{large}"]->.L;area[name="{focus}"](area.L)->.a;'
+
+def _theme_union(theme):
+    return "(" + "".join(f"{f}(area.a);" for f in _THEMES[theme]["filters"]) + ")"
+
+def _theme_query(theme, large, focus):
+    """Single-theme Overpass query."""
+    return f"{_area_header(large, focus)}{_theme_union(theme)};out geom;"
+
+def _multi_theme_query(themes, large, focus):
+    """
+    One query for several themes. Each theme is collected into its own set
+    and printed after a derived 'geo3d' marker element naming the theme,
+    so the response can be split locally.
+    """
+    sets = "".join(f"{_theme_union(t)}->.t{i};" for i, t in enumerate(themes))
+    outs = "".join(f'make geo3d theme="{t}";out;.t{i} out geom;' for i, t in enumerate(themes))
+    return f"{_area_header(large, focus)}{sets}{outs}"
+
+def _split_themes(raw_data):
+    """Splits a multi-theme response on its 'geo3d' markers into {theme: raw_data}."""
+    split, current = {}, None
+    for el in raw_data.get("elements", []):
+        if el.get("type") == "geo3d":
+            current = el.get("tags", {}).get("theme")
+            split[current] = {"osm3s": raw_data.get("osm3s", {}), "elements": []}
+        elif current is not None:
+            split[current]["elements"].append(el)
+    return split
+
+def _add_theme_layer(theme, focus, data, tags=None):
+    """Builds a theme layer from raw Overpass data and adds it to the project."""
+    name = _THEMES[theme]["layer"].format(focus=focus)
+    final = _overpass_to_layer(data, name, "Polygon", tags)
+
     _remove_layer_by_name(name)
-    QgsProject.instance().addMapLayer(final)
+    # Check if dataset is not empty before adding
+    if final.featureCount() > 0 or _THEMES[theme]["keep_empty"]:
+        QgsProject.instance().addMapLayer(final)
+        return final
+    else:
+        print(f"Skipped {name}: No features found.")
+        return None
+
+def _zoom_to(layer):
+    from qgis.utils import iface
+    iface.setActiveLayer(layer)
+    iface.zoomToActiveLayer()
+
+@_profiled
+def overpass2qgis(large, focus, zoom=True, tags=None):
+    """Harvest buildings and add to project. tags: optional key whitelist (e.g. BUILDING_TAGS)."""
+    final = _add_theme_layer("buildings", focus, _fetch_overpass(_theme_query("buildings", large, focus)), tags)
     
     if zoom:
-        from qgis.utils import iface
-        iface.setActiveLayer(final)
-        iface.zoomToActiveLayer()
+        _zoom_to(final)
+    return final
+
+@_profiled
+def q_themes(large, focus, themes=("buildings", "farmland", "green", "water", "solar"), zoom=True, tags=None):
+    """
+    Harvest several themes with ONE Overpass request (one area lookup)
+    and add each to the project. Returns {theme: layer or None}.
+    tags: optional {theme: key whitelist}.
+    """
+    unknown = [t for t in themes if t not in _THEMES]
+    if unknown:
+        raise ValueError(f"Unknown theme(s) {unknown}; choose from {list(_THEMES)}")
+
+    split = _split_themes(_fetch_overpass(_multi_theme_query(themes, large, focus)))
+    tags = tags or {}
+    layers = {t: _add_theme_layer(t, focus, split.get(t, {"elements": []}), tags.get(t)) for t in themes}
+
+    if zoom and layers.get("buildings") is not None:
+        _zoom_to(layers["buildings"])
+    return layers
+
+def q_themes_async(large, focus, themes=("buildings", "farmland", "green", "water", "solar"), zoom=True, tags=None,
+                   max_concurrent=4, progress=_print_progress, callback=None):
+    """
+    Harvest several themes with concurrent Overpass requests (one per theme) on the
+    shared network manager; total time is about that of the slowest theme.
+    Without callback: blocks and returns {theme: layer or None}.
+    With callback: returns the running OverpassBatch at once and later calls
+    callback({theme: layer or None}) (QGIS stays responsive meanwhile).
+    Failed themes are reported and come back as None.
+    """
+    unknown = [t for t in themes if t not in _THEMES]
+    if unknown:
+        raise ValueError(f"Unknown theme(s) {unknown}; choose from {list(_THEMES)}")
+    tags = tags or {}
+    layers = {}
+
+    def finished(batch):
+        for theme, error in batch.errors.items():
+            print(f"❌ {theme}: {error}")
+        for t in themes:
+            layers[t] = _add_theme_layer(t, focus, batch.results[t], tags.get(t)) if t in batch.results else None
+        if zoom and layers.get("buildings") is not None:
+            _zoom_to(layers["buildings"])
+        if callback is not None:
+            callback(dict(layers))
+
+    batch = OverpassBatch({t: _theme_query(t, large, focus) for t in themes}, max_concurrent=max_concurrent,
+                          progress=progress, on_finished=finished)
+    if callback is not None:
+        return batch.start()
+    batch.wait(strict=False)
+    return layers
+
+def _bbox_union(theme, bbox):
+    """Theme union restricted to a (south, west, north, east) tile."""
+    box = ",".join(f"{v:.7f}" for v in bbox)
+    return "(" + "".join(f"{f}(area.a)({box});" for f in _THEMES[theme]["filters"]) + ")"
+
+def _area_bounds(large, focus):
+    """(south, west, north, east) of the focus area, from the way/relation that defines it."""
+    data = _fetch_overpass(f"{_area_header(large, focus)}(rel(pivot.a);way(pivot.a););out bb;")
+    bounds = [el["bounds"] for el in data.get("elements", []) if "bounds" in el]
+    if not bounds:
+        raise ValueError(f"Area '{focus}' in '{large}' not found.")
+    return (min(b["minlat"] for b in bounds), min(b["minlon"] for b in bounds),
+            max(b["maxlat"] for b in bounds), max(b["maxlon"] for b in bounds))
+
+def _split_bbox(bbox):
+    s, w, n, e = bbox
+    mid_lat, mid_lon = (s + n) / 2, (w + e) / 2
+    return [(s, w, mid_lat, mid_lon), (s, mid_lon, mid_lat, e), (mid_lat, w, n, mid_lon), (mid_lat, mid_lon, n, e)]
+
+def _count_total(raw_data):
+    for el in raw_data.get("elements", []):
+        if el.get("type") == "count":
+            return int(el.get("tags", {}).get("total", 0))
+    return 0
+
+@_profiled
+def overpass2qgis_tiled(large, focus, theme="buildings", max_elements=2500, max_depth=5, max_concurrent=4,
+                        zoom=True, tags=None, progress=_print_progress):
+    """
+    Tiled harvest for AOIs too large for one 'out geom' request (> 2 500 buildings).
+
+    The focus bbox is split as an adaptive quadtree: each tile is counted ('out count')
+    and split again while it holds more than max_elements (up to max_depth levels).
+    The leaf tiles are fetched concurrently (OverpassBatch), ways and relations that
+    cross tile borders are kept once (by OSM type and id) and everything is merged
+    into one layer, added to the project as for overpass2qgis.
+    """
+    t0 = time.perf_counter()
+    header = _area_header(large, focus)
+    tiles, leaves, depth = [_area_bounds(large, focus)], [], 0
+
+    # 1. Quadtree on element counts, one concurrent batch per level
+    while tiles:
+        counts = OverpassBatch({i: f"{header}{_bbox_union(theme, t)};out count;" for i, t in enumerate(tiles)},
+                               max_concurrent=max_concurrent, progress=None).wait()
+        split = []
+        for i, tile in enumerate(tiles):
+            n = _count_total(counts[i])
+            if n > max_elements and depth < max_depth:
+                split.extend(_split_bbox(tile))
+            elif n:
+                leaves.append(tile)
+        tiles, depth = split, depth + 1
+    print(f"{len(leaves)} tiles after {depth} quadtree level(s)")
+
+    # 2. Fetch the leaves concurrently; drop duplicates across tile borders
+    results = OverpassBatch({i: f"{header}{_bbox_union(theme, t)};out geom;" for i, t in enumerate(leaves)},
+                            max_concurrent=max_concurrent, progress=progress).wait()
+    elements, seen, duplicates, bases = [], set(), 0, []
+    for i in range(len(leaves)):
+        tile = results.pop(i)
+        bases.append(tile.get("osm3s", {}).get("timestamp_osm_base"))
+        for el in tile["elements"]:
+            key = (el["type"], el["id"])
+            if key in seen:
+                duplicates += 1
+                continue
+            seen.add(key)
+            elements.append(el)
+
+    # the oldest tile decides where an update has to start
+    osm3s = {"timestamp_osm_base": min(b for b in bases if b)} if any(bases) else {}
+    final = _add_theme_layer(theme, focus, {"osm3s": osm3s, "elements": elements}, tags)
+    print(f"{len(elements)} elements ({duplicates} border duplicates dropped) in {time.perf_counter() - t0:.1f}s")
+    if zoom and final is not None:
+        _zoom_to(final)
     return final
 
-def get_rgb_color(bld):
-    """Returns RGB list as a string to match the original notebook format."""
-    if bld in ['house', 'semidetached_house', 'terrace']:
-        rgb = [255, 255, 204]
-    elif bld == 'apartments':
-        rgb = [252, 194, 3]
-    elif bld in ['residential', 'dormitory', 'cabin']:
-        rgb = [119, 3, 252]
-    elif bld in ['garage', 'parking']:
-        rgb = [3, 132, 252]
-    elif bld in ['retail', 'supermarket']:
-        rgb = [253, 141, 60]
-    elif bld in ['office', 'commercial']:
-        rgb = [185, 206, 37]
-    elif bld in ['school', 'kindergarten', 'university', 'college']:
-        rgb = [128, 0, 38]
-    elif bld in ['clinic', 'doctors', 'hospital']:
-        rgb = [89, 182, 178]
-    elif bld in ['community_centre', 'service', 'post_office', 'hall', 'civic', 
-                  'townhall', 'police', 'library', 'fire_station']:
-        rgb = [181, 182, 89]
-    elif bld in ['warehouse', 'industrial']:
-        rgb = [193, 255, 193]
-    elif bld == 'hotel':
-        rgb = [139, 117, 0]
-    elif bld in ['church', 'mosque', 'synagogue']:
-        rgb = [225, 225, 51]
+# SCHEMA: All numeric outputs are set to String to force the "." decimal
+_PROCESS3D_SCHEMA = [
+    ('osm_id', QVariant.String), ('address', QVariant.String), 
+    ('building', QVariant.String), ('building:levels', QVariant.String), 
+    ('building:use', QVariant.String), ('building:flats', QVariant.String), 
+    ('building:units', QVariant.String), ('beds', QVariant.String), 
+    ('rooms', QVariant.String), ('residential', QVariant.String),
+    ('amenity', QVariant.String), ('social_facility', QVariant.String), 
+    ('operator', QVariant.String), 
+    ('building_height', QVariant.String), 
+    ('roof_height', QVariant.String), 
+    ('ground_height', QVariant.String), 
+    ('bottom_bridge_height', QVariant.String), 
+    ('bottom_roof_height', QVariant.String),
+    ('plus_code', QVariant.String), ('footprint', QVariant.String), 
+    ('geometry_wkt', QVariant.String), ('fill_color', QVariant.String)
+]
+
+def _to_float(val):
+    """Raw OSM value to float; NULL, empty or unparsable values become 0.0."""
+    if QgsVariantUtils.isNull(val) or val == "": return 0.0
+    try: return float(str(val).replace(',', '.'))
+    except: return 0.0
+
+def plus_code_area(code):
+    """Plus Code cell as a QgsGeometry rectangle in EPSG:4326 (for joins by location)."""
+    c = decode_plus_code(code)
+    return QgsGeometry.fromRect(QgsRectangle(c["west"], c["south"], c["east"], c["north"]))
+
+@_profiled
+def plus_code_cells(codes, name="PlusCodes"):
+    """
+    Memory layer (EPSG:4326) with one polygon per distinct Plus Code and a
+    count of how often it occurs; join other datasets on 'plus_code'.
+    """
+    codes = [c for c in codes if c]
+    uniq, counts = np.unique(np.asarray(codes, dtype=str), return_counts=True) if codes else ([], [])
+    layer = QgsVectorLayer("Polygon?crs=EPSG:4326", name, "memory")
+    pr = layer.dataProvider()
+    pr.addAttributes([QgsField('plus_code', QVariant.String), QgsField('count', QVariant.Int)])
+    layer.updateFields()
+    features = []
+    for code, count in zip(uniq, counts):
+        feat = QgsFeature(layer.fields())
+        feat.setGeometry(plus_code_area(str(code)))
+        feat.setAttributes([str(code), int(count)])
+        features.append(feat)
+    pr.addFeatures(features)
+    layer.updateExtents()
+    return layer
+
+def _points_to_lat_lon(points, crs):
+    """(lat, lon) arrays for a list of QgsPointXY, transformed to WGS84 as ONE multipoint."""
+    geom = QgsGeometry.fromMultiPointXY(points)
+    geom.transform(QgsCoordinateTransform(crs, QgsCoordinateReferenceSystem("EPSG:4326"), QgsProject.instance()))
+    lonlat = np.array([(p.x(), p.y()) for p in geom.asMultiPoint()], dtype=float).reshape(-1, 2)
+    return lonlat[:, 1], lonlat[:, 0]
+
+@_profiled
+def layer_plus_codes(layer, code_length=11):
+    """{feature id: Plus Code} of every feature's point-on-surface, encoded in one batch."""
+    fids, points = [], []
+    for feat in layer.getFeatures(QgsFeatureRequest().setNoAttributes()):
+        geom = feat.geometry()
+        if not geom or geom.isEmpty(): continue
+        fids.append(feat.id())
+        points.append(geom.pointOnSurface().asPoint())
+    if not fids:
+        return {}
+    lat, lon = _points_to_lat_lon(points, layer.crs())
+    return dict(zip(fids, encode_plus_codes(lat, lon, code_length)))
+
+def _process3D_bulk(layer, existing_names, code_length=11, fids=None):
+    """
+    Batched process3D: one read pass, array maths, one provider write.
+    Produces exactly the same attribute values as the per-feature loop.
+    fids: only these features (None = all).
+    """
+    pr = layer.dataProvider()
+    fields = layer.fields()
+
+    address_keys = [k for k in _ADDRESS_KEYS if k in existing_names]
+    read_keys = address_keys + [k for k in ('building', 'building:levels', 'mean', 'min_height') if k in existing_names]
+    request = QgsFeatureRequest().setSubsetOfAttributes(read_keys, fields)
+    if fids is not None:
+        request.setFilterFids(list(fids))
+
+    # --- 1. SINGLE READ PASS: columns + geometry derived strings ---
+    fids, points, footprints, wkts = [], [], [], []
+    cols = {k: [] for k in read_keys}
+    for feat in layer.getFeatures(request):
+        geom = feat.geometry()
+        if not geom or geom.isEmpty(): continue
+        if not geom.isGeosValid(): geom = geom.makeValid()
+
+        fids.append(feat.id())
+        for k in read_keys:
+            cols[k].append(feat[k])
+        points.append(geom.pointOnSurface().asPoint())
+        footprints.append(json.dumps(json.loads(geom.asJson())['coordinates']))
+        wkts.append(geom.asWkt())
+
+    if not fids:
+        layer.triggerRepaint()
+        return layer
+    n = len(fids)
+
+    # --- 2. RAW INPUT SANITIZATION (whole columns) ---
+    if 'building' in existing_names:
+        b_type = np.array(['house' if QgsVariantUtils.isNull(v) else str(v) for v in cols['building']], dtype=object)
+    else:
+        b_type = np.full(n, 'house', dtype=object)
+
+    def column(key, default):
+        if key not in existing_names:
+            return np.full(n, default)
+        return np.array([_to_float(v) for v in cols[key]], dtype=float)
+
+    levels = column('building:levels', 1.0)
+    ground_h = column('mean', 0.0)
+    min_h = column('min_height', 0.0)
+
+    # --- 3. HEIGHT CALCULATIONS (masks mirror the per-feature branches) ---
+    b_h, r_h, bb_h, br_h = _building_heights(b_type, levels, ground_h, min_h)
+
+    # --- 4. ADDRESS, COLOUR & PLUS CODE ---
+    address = [None] * n
+    if address_keys:
+        for i, row in enumerate(zip(*[cols[k] for k in address_keys])):
+            parts = [str(v).strip() for v in row if not QgsVariantUtils.isNull(v)]
+            address[i] = " ".join(parts) if parts else None
+
+    types, inverse = np.unique(b_type.astype(str), return_inverse=True)
+    fill_color = np.array([get_rgb_color(t) for t in types], dtype=object)[inverse].tolist()
+
+    # One transform for every point instead of one per feature
+    lat, lon = _points_to_lat_lon(points, layer.crs())
+    p_code = encode_plus_codes(lat, lon, code_length)
+
+    # --- 5. ONE BULK PROVIDER WRITE ---
+    outputs = {
+        'address': address,
+        'plus_code': p_code,
+        'building_height': _format2(b_h),
+        'roof_height': _format2(r_h),
+        'ground_height': _format2(ground_h),
+        'bottom_bridge_height': _format2(bb_h),
+        'bottom_roof_height': _format2(br_h),
+        'footprint': footprints,
+        'geometry_wkt': wkts,
+        'fill_color': fill_color
+    }
+    idx = {name: fields.indexFromName(name) for name in outputs}
+    changes = {
+        fid: {idx[name]: values[i] for name, values in outputs.items()}
+        for i, fid in enumerate(fids)
+    }
+    with profile_stage("attribute write", len(changes)):
+        if not pr.changeAttributeValues(changes):
+            return None
+
+    _bump_revision(layer)
+    layer.triggerRepaint()
+    return layer
+
+def _python_version(path):
+    import subprocess
+    try:
+        out = subprocess.run([path, "-c", "import sys; print(*sys.version_info[:2])"],
+                             capture_output=True, text=True, timeout=30).stdout.split()
+        return tuple(int(v) for v in out)
+    except (OSError, ValueError, subprocess.SubprocessError):
+        return None
+
+def _worker_python():
+    """
+    The Python interpreter matching this QGIS: the usual places under sys.exec_prefix
+    (OSGeo4W, Linux, QGIS.app, Flatpak), then python3.X / python3 on the PATH.
+    """
+    import shutil
+    version = f"python{sys.version_info.major}.{sys.version_info.minor}"
+    if os.name == "nt":
+        candidates = [os.path.join(sys.exec_prefix, "python.exe"), os.path.join(sys.exec_prefix, "bin", "python.exe")]
     else:
-        rgb = [255, 255, 204]
-    return str(rgb)
-
-def get_homebaked_plus_code(lat, lon):
-    """Computes 11-digit Plus Code based on the Base20 offset formula."""
-    alphabet = "23456789CFGHJMPQRVWX"
-    lat_val, lon_val = lat + 90.0, lon + 180.0
-    lat_digits, lon_digits = [], []
-    l_rem, n_rem = lat_val / 20.0, lon_val / 20.0
-    for _ in range(5):
-        l_idx = int(l_rem)
-        l_rem = (l_rem - l_idx) * 20.0
-        lat_digits.append(alphabet[max(0, min(19, l_idx))])
-        n_idx = int(n_rem)
-        n_rem = (n_rem - n_idx) * 20.0
-        lon_digits.append(alphabet[max(0, min(19, n_idx))])
-    row, col = int(l_rem * 5 / 20), int(n_rem * 4 / 20)
-    grid_idx = (row * 4) + col
-    last_digit = alphabet[max(0, min(19, grid_idx))]
-    return (f"{lat_digits[0]}{lon_digits[0]}{lat_digits[1]}{lon_digits[1]}"
-            f"{lat_digits[2]}{lon_digits[2]}{lat_digits[3]}{lon_digits[3]}+"
-            f"{lat_digits[4]}{lon_digits[4]}{last_digit}")
-
-def process3D(layer):
+        candidates = [os.path.join(sys.exec_prefix, "bin", name) for name in (version, "python3")]
+    candidates += [shutil.which(name) for name in (version, "python3")]
+    for path in dict.fromkeys(candidates):
+        if path and os.path.isfile(path) and os.access(path, os.X_OK) and _python_version(path) == sys.version_info[:2]:
+            return path
+    raise RuntimeError(f"No {version} interpreter found for the worker processes "
+                       f"(looked in {sys.exec_prefix} and on PATH); run without workers=")
+
+def _process_pool(workers):
+    """
+    Process pool for the partitioned stages. Inside QGIS sys.executable is the
+    QGIS binary, so the workers are pointed at the Python interpreter instead.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    ctx = multiprocessing.get_context("spawn")
+    if not os.path.basename(sys.executable).lower().startswith("python"):
+        ctx.set_executable(_worker_python())
+    return ProcessPoolExecutor(max_workers=workers, mp_context=ctx)
+
+def _process3D_partitioned(layer, existing_names, code_length=11, workers=4, cells_per_worker=4, fids=None):
+    """
+    process3D across processes: the read pass collects WKB and raw attribute
+    values, the buildings are split by spatial grid cell and each cell runs
+    process3D_partition in the pool; results come back in one provider write.
+    """
+    pr = layer.dataProvider()
+    fields = layer.fields()
+
+    address_keys = [k for k in _ADDRESS_KEYS if k in existing_names]
+    read_keys = address_keys + [k for k in ('building', 'building:levels', 'mean', 'min_height') if k in existing_names]
+    request = QgsFeatureRequest().setSubsetOfAttributes(read_keys, fields)
+    if fids is not None:
+        request.setFilterFids(list(fids))
+
+    fids, wkbs, cx, cy = [], [], [], []
+    cols = {k: [] for k in read_keys}
+    for feat in layer.getFeatures(request):
+        geom = feat.geometry()
+        if not geom or geom.isEmpty(): continue
+        fids.append(feat.id())
+        wkbs.append(bytes(geom.asWkb()))
+        centre = geom.boundingBox().center()
+        cx.append(centre.x())
+        cy.append(centre.y())
+        for k in read_keys:
+            v = feat[k]
+            cols[k].append(None if QgsVariantUtils.isNull(v) else v)
+
+    if not fids:
+        layer.triggerRepaint()
+        return layer
+
+    crs = layer.crs().authid() or layer.crs().toProj()
+    parts = grid_partitions(cx, cy, workers * cells_per_worker)
+    tasks = [{
+        "wkb": [wkbs[i] for i in idx],
+        "columns": {k: [cols[k][i] for i in idx] for k in read_keys},
+        "address_keys": address_keys, "crs": crs, "code_length": code_length
+    } for idx in parts]
+
+    idx = None
+    changes = {fid: {} for fid in fids}
+    with _process_pool(workers) as pool, profile_stage(f"process3D partitions ({len(tasks)})", len(fids)):
+        for rows, outputs in zip(parts, pool.map(process3D_partition, tasks)):
+            if idx is None:
+                idx = {name: fields.indexFromName(name) for name in outputs}
+            for name, values in outputs.items():
+                for i, value in zip(rows, values):
+                    changes[fids[i]][idx[name]] = value
+
+    with profile_stage("attribute write", len(changes)):
+        if not pr.changeAttributeValues(changes):
+            return None
+
+    _bump_revision(layer)
+    layer.triggerRepaint()
+    return layer
+
+@_profiled
+def ground_heights(layer, dem_path, block_rows=256, all_touched=False, fids=None):
+    """
+    Zonal statistics of a DEM under every footprint in one block-wise pass
+    (replaces a separate QGIS zonal-statistics run before process3D).
+
+    Footprints are rasterized into a label grid aligned to the DEM, one block of
+    rows at a time, and reduced per building with np.bincount (mean) and
+    ufunc.at (min/max) while the DEM is read once. Footprints that cover no
+    cell centre (smaller than a DEM cell) take the cell under their point on surface.
+    all_touched: label every cell a footprint touches, not only cell centres inside it.
+    fids: only these features (None = all); the DEM is then read under them only.
+
+    Writes 'mean' (read by process3D), 'ground_min', 'ground_max' and
+    'ground_height'. Returns the layer.
+    """
     if not layer or not layer.isValid():
         return None
+    t0 = time.perf_counter()
+    gdal.UseExceptions()
+    dem = gdal.Open(dem_path)
+    band = dem.GetRasterBand(1)
+    projection = dem.GetProjection()
+    dem_crs = QgsCoordinateReferenceSystem.fromWkt(projection)
+    xform = None
+    if layer.crs() != dem_crs:
+        xform = QgsCoordinateTransform(layer.crs(), dem_crs, QgsProject.instance())
+
+    # --- 1. footprints in the DEM CRS, label = position + 1 ---
+    mem = ogr.GetDriverByName("Memory").CreateDataSource("")
+    footprints = mem.CreateLayer("footprints", osr.SpatialReference(wkt=projection), ogr.wkbUnknown)
+    footprints.CreateField(ogr.FieldDefn("label", ogr.OFTInteger))
+    defn = footprints.GetLayerDefn()
+    request = QgsFeatureRequest().setNoAttributes()
+    if fids is not None:
+        request.setFilterFids(list(fids))
+    fids, points = [], []
+    for feat in layer.getFeatures(request):
+        geom = feat.geometry()
+        if not geom or geom.isEmpty(): continue
+        if xform is not None:
+            geom.transform(xform)
+        ogr_feat = ogr.Feature(defn)
+        ogr_feat.SetField(0, len(fids) + 1)
+        ogr_feat.SetGeometry(ogr.CreateGeometryFromWkb(bytes(geom.asWkb())))
+        footprints.CreateFeature(ogr_feat)
+        fids.append(feat.id())
+        p = geom.pointOnSurface().asPoint()
+        points.append((p.x(), p.y()))
+    n = len(fids)
+    if not n:
+        return layer
 
-    # SCHEMA: All numeric outputs are set to String to force the "." decimal
-    schema = [
-        ('osm_id', QVariant.String), ('address', QVariant.String), 
-        ('building', QVariant.String), ('building:levels', QVariant.String), 
-        ('building:use', QVariant.String), ('building:flats', QVariant.String), 
-        ('building:units', QVariant.String), ('beds', QVariant.String), 
-        ('rooms', QVariant.String), ('residential', QVariant.String),
-        ('amenity', QVariant.String), ('social_facility', QVariant.String), 
-        ('operator', QVariant.String), 
-        ('building_height', QVariant.String), 
-        ('roof_height', QVariant.String), 
-        ('ground_height', QVariant.String), 
-        ('bottom_bridge_height', QVariant.String), 
-        ('bottom_roof_height', QVariant.String),
-        ('plus_code', QVariant.String), ('footprint', QVariant.String), 
-        ('geometry_wkt', QVariant.String), ('fill_color', QVariant.String)
-    ]
+    # --- 2. DEM window under the footprints ---
+    ox, px, _, oy, _, py = dem.GetGeoTransform()
+    minx, maxx, miny, maxy = footprints.GetExtent()
+    c0, c1 = max(0, int(np.floor((minx - ox) / px))), min(band.XSize, int(np.ceil((maxx - ox) / px)))
+    r0, r1 = max(0, int(np.floor((maxy - oy) / py))), min(band.YSize, int(np.ceil((miny - oy) / py)))
+    nodata = band.GetNoDataValue()
+    scale, offset = band.GetScale() or 1.0, band.GetOffset() or 0.0
+
+    # --- 3. one block-wise pass: rasterize labels, read DEM, reduce ---
+    sums, counts = np.zeros(n + 1), np.zeros(n + 1, dtype=np.int64)
+    mins, maxs = np.full(n + 1, np.inf), np.full(n + 1, -np.inf)
+    options = ["ATTRIBUTE=label"] + (["ALL_TOUCHED=TRUE"] if all_touched else [])
+    width = c1 - c0
+    for r in range(r0, r1 if width > 0 else r0, block_rows):
+        rows = min(block_rows, r1 - r)
+        top = oy + r * py
+        footprints.SetSpatialFilterRect(ox + c0 * px, top + rows * py, ox + c1 * px, top)
+        labels_ds = gdal.GetDriverByName("MEM").Create("", width, rows, 1, gdal.GDT_Int32)
+        labels_ds.SetGeoTransform((ox + c0 * px, px, 0.0, top, 0.0, py))
+        labels_ds.SetProjection(projection)
+        gdal.RasterizeLayer(labels_ds, [1], footprints, options=options)
+        labels = labels_ds.ReadAsArray().ravel()
+        labels_ds = None
+
+        values = band.ReadAsArray(c0, r, width, rows).astype(float).ravel()
+        ok = labels > 0
+        if nodata is not None:
+            ok &= values != nodata
+        lab, val = labels[ok], values[ok] * scale + offset
+        sums += np.bincount(lab, val, n + 1)
+        counts += np.bincount(lab, minlength=n + 1)
+        np.minimum.at(mins, lab, val)
+        np.maximum.at(maxs, lab, val)
+    footprints.SetSpatialFilter(None)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = (sums / counts)[1:]
+    mins, maxs, counts = mins[1:], maxs[1:], counts[1:]
+
+    # --- 4. sub-cell footprints: the DEM cell under the point on surface ---
+    small = counts == 0
+    if small.any():
+        xy = np.asarray(points)[small]
+        value = _BlockReader(band).sample(np.floor((xy[:, 0] - ox) / px), np.floor((xy[:, 1] - oy) / py))
+        mean[small] = mins[small] = maxs[small] = value
+    dem = None
+
+    # --- 5. one bulk provider write ---
+    if layer.isEditable() and not layer.commitChanges():
+        return None
+    pr = layer.dataProvider()
+    names = layer.fields().names()
+    to_add = [QgsField(name, t) for name, t in (('mean', QVariant.Double), ('ground_min', QVariant.Double),
+                                                ('ground_max', QVariant.Double), ('ground_height', QVariant.String))
+              if name not in names]
+    if to_add:
+        pr.addAttributes(to_add)
+        layer.updateFields()
+    fields = layer.fields()
+    idx = [fields.indexFromName(name) for name in ('mean', 'ground_min', 'ground_max', 'ground_height')]
+
+    def value(v):
+        return None if np.isnan(v) else float(v)
+
+    ground = _format2(mean)
+    changes = {
+        fid: {idx[0]: value(mean[i]), idx[1]: value(mins[i]), idx[2]: value(maxs[i]), idx[3]: ground[i]}
+        for i, fid in enumerate(fids)
+    }
+    if not pr.changeAttributeValues(changes):
+        return None
+    _bump_revision(layer)
+
+    print(f"Ground heights for {n} buildings ({int(small.sum())} below DEM resolution) in {time.perf_counter() - t0:.2f}s")
+    return layer
+
+@_profiled
+def process3D(layer, bulk=True, code_length=11, workers=None, dem=None, fids=None):
+    """
+    Adds heights, address, plus code, footprint and colour attributes.
+    bulk=True computes whole columns at once and writes them in a single
+    provider call; bulk=False keeps the original feature-by-feature edit loop.
+    code_length sets the Plus Code length (11 = the homebaked default).
+    workers: run the bulk computation in that many processes, partitioned by
+    spatial grid cell (worth it from tens of thousands of buildings). The
+    workers re-implement the QGIS geometry output in city3D_kernels and are
+    meant to write the same values as the serial run;
+    benchmarks/bench_pipeline.py --parity checks that.
+    dem: path of a DEM; ground heights ('mean') are computed from it first
+    with ground_heights instead of a separate zonal-statistics run.
+    fids: recompute only these features (see update_osm); None = all.
+    """
+    if not layer or not layer.isValid():
+        return None
+    if dem is not None and ground_heights(layer, dem, fids=fids) is None:
+        return None
+
+    schema = _PROCESS3D_SCHEMA
+
+    if bulk:
+        # Flush any pending edits, the bulk path writes straight to the provider
+        if layer.isEditable() and not layer.commitChanges():
+            return None
+        existing_names = layer.fields().names()
+        to_add = [QgsField(n, t) for n, t in schema if n not in existing_names]
+        if to_add:
+            layer.dataProvider().addAttributes(to_add)
+            layer.updateFields()
+        if workers:
+            return _process3D_partitioned(layer, existing_names, code_length, workers, fids=fids)
+        return _process3D_bulk(layer, existing_names, code_length, fids)
 
     layer.startEditing()
     existing_names = layer.fields().names()
@@ -201,7 +1296,10 @@ def process3D(layer):
     # Coordinate Transformer for Plus Codes (WGS84)
     xform = QgsCoordinateTransform(layer.crs(), QgsCoordinateReferenceSystem("EPSG:4326"), QgsProject.instance())
 
-    for feat in layer.getFeatures():
+    request = QgsFeatureRequest()
+    if fids is not None:
+        request.setFilterFids(list(fids))
+    for feat in layer.getFeatures(request):
         geom = feat.geometry()
         if not geom or geom.isEmpty(): continue
         if not geom.isGeosValid(): geom = geom.makeValid()
@@ -241,12 +1339,15 @@ def process3D(layer):
             return "{:.2f}".format(float(val)).replace(',', '.')
 
         # --- 4. ADDRESS & PLUS CODE LOGIC ---
-        address_keys = ['name', 'addr:housename', 'addr:flats', 'addr:housenumber', 'addr:street', 'addr:suburb', 'addr:postcode', 'addr:city', 'addr:province']
+        address_keys = _ADDRESS_KEYS
         address_parts = [str(feat[k]).strip() for k in address_keys if k in existing_names and not QgsVariantUtils.isNull(feat[k])]
         
         pt_geom = geom.pointOnSurface()
         pt_geom.transform(xform)
-        p_code = get_homebaked_plus_code(pt_geom.asPoint().y(), pt_geom.asPoint().x())
+        if code_length == 11:
+            p_code = get_homebaked_plus_code(pt_geom.asPoint().y(), pt_geom.asPoint().x())
+        else:
+            p_code = encode_plus_codes(pt_geom.asPoint().y(), pt_geom.asPoint().x(), code_length)[0]
 
         # --- 5. APPLY UPDATES ---
         updates = {
@@ -264,29 +1365,258 @@ def process3D(layer):
         layer.changeAttributeValues(feat.id(), updates)
 
     if layer.commitChanges():
+        _bump_revision(layer)
         layer.triggerRepaint()
         return layer
     return None
 
+#- OSM keys promoted to real (indexable) columns when a .pbf is ingested with build_pbf_store
+PBF_STORE_TAGS = {
+    "multipolygons": ['name', 'type', 'place', 'amenity', 'building', 'building:levels', 'building:use',
+                      'building:flats', 'building:units', 'beds', 'rooms', 'residential', 'social_facility',
+                      'operator', 'height', 'min_height', 'landuse', 'leisure', 'natural', 'water',
+                      'power', 'generator:source', 'generator:method'] + _ADDRESS_KEYS[1:],
+    "lines": ['name', 'highway', 'waterway', 'railway', 'power', 'generator:source', 'generator:method'],
+    "points": ['name', 'amenity', 'shop', 'power', 'generator:source', 'generator:method'],
+}
+#- attribute indexes created on the store once the data is loaded
+PBF_STORE_INDEXES = {
+    "multipolygons": ['name', 'building', 'place', 'amenity', 'power'],
+    "lines": ['name', 'power'],
+    "points": ['name', 'power'],
+}
+
+def pbf_store_path(input_pbf):
+    """Default location of the indexed GeoPackage store for a .pbf."""
+    return f"{input_pbf}.gpkg"
+
+def _store_osmconf(layers):
+    """Writes an osmconf.ini (GDAL default + promoted keys, colons kept) and returns its path."""
+    default = gdal.GetConfigOption("OSM_CONFIG_FILE") or gdal.FindFile("gdal", "osmconf.ini")
+    if not default or not os.path.exists(default):
+        raise RuntimeError("GDAL's osmconf.ini was not found; set OSM_CONFIG_FILE.")
+
+    out, section = [], None
+    with open(default, "r", encoding="utf-8") as f:
+        for line in f.read().splitlines():
+            stripped = line.strip()
+            if stripped.startswith("[") and stripped.endswith("]"):
+                section = stripped[1:-1]
+            elif stripped.startswith("attribute_name_laundering"):
+                line = "attribute_name_laundering=no"
+            elif stripped.startswith("attributes=") and section in layers:
+                keys = stripped.split("=", 1)[1].split(",")
+                keys += [k for k in PBF_STORE_TAGS.get(section, []) if k not in keys]
+                line = "attributes=" + ",".join(keys)
+            out.append(line)
+
+    fd, path = tempfile.mkstemp(suffix="_osmconf.ini")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write("\n".join(out) + "\n")
+    return path
+
+@_profiled
+def build_pbf_store(input_pbf, store_path=None, layers=("multipolygons", "lines"), overwrite=False):
+    """
+    One-time ingestion of a .pbf into a spatially indexed GeoPackage.
+    Tags in PBF_STORE_TAGS become columns, PBF_STORE_INDEXES get attribute
+    indexes. extract_bndrs / extract_blds / _harvestSolar then query the store
+    (R-tree + index lookups) instead of scanning the .pbf every time.
+    """
+    gdal.UseExceptions()
+    store_path = store_path or pbf_store_path(input_pbf)
+    if os.path.exists(store_path):
+        if not overwrite:
+            print(f"Store exists: {store_path} (use overwrite=True to rebuild)")
+            return store_path
+        os.remove(store_path)
+
+    conf = _store_osmconf(layers)
+    try:
+        gdal.VectorTranslate(
+            store_path, input_pbf, format="GPKG", layers=list(layers),
+            options=["-oo", f"CONFIG_FILE={conf}", "-gt", "65536"],
+            layerCreationOptions=["SPATIAL_INDEX=YES"]
+        )
+    finally:
+        os.remove(conf)
+
+    # ---- attribute indexes, after the bulk load ----
+    ds = ogr.Open(store_path, 1)
+    for layer_name in layers:
+        for key in PBF_STORE_INDEXES.get(layer_name, []):
+            col = key.replace(":", "_")
+            ds.ExecuteSQL(f'CREATE INDEX IF NOT EXISTS "idx_{layer_name}_{col}" ON "{layer_name}" ("{key}")')
+    ds = None
+    _profile_bytes(written=os.path.getsize(store_path))
+
+    print(f"Indexed store written: {store_path}")
+    return store_path
+
+def _pbf_source(input_pbf):
+    """
+    Returns (path, is_store): a .gpkg is used as is; for a .pbf an up-to-date
+    store from build_pbf_store is preferred over scanning the raw file.
+    """
+    if input_pbf.lower().endswith(".gpkg"):
+        return input_pbf, True
+    store = pbf_store_path(input_pbf)
+    if os.path.exists(store) and os.path.getmtime(store) >= os.path.getmtime(input_pbf):
+        return store, True
+    return input_pbf, False
+
+#- AOI boundary types, in the order extract_bndrs prefers them
+_PLACE_TYPES = ["neighbourhood", "suburb", "quarter", "borough", "village", "town", "city"]
+_AMENITY_TYPES = ["university", "research_institute"]
+
+_PLACE_INDEX_CACHE = {}
+
+def _sql_quote(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+def place_index_path(input_pbf):
+    """Default location of the place-name index for a .pbf (or its store)."""
+    return f"{input_pbf}.places.json"
+
+@_profiled
+def build_place_index(input_pbf, index_path=None):
+    """
+    One scan of the multipolygons layer that records every named place and
+    amenity boundary: name, kind (place/amenity), type, bbox and fid.
+    Saved as JSON with the size and mtime of the files it was built from;
+    find_places and extract_bndrs answer from it while those are unchanged.
+    """
+    gdal.UseExceptions()
+    source, is_store = _pbf_source(input_pbf)
+    index_path = index_path or place_index_path(input_pbf)
+
+    ds = ogr.Open(source)
+    lyr = ds.GetLayerByName("multipolygons")
+    lyr.SetAttributeFilter("name IS NOT NULL AND (place IS NOT NULL OR amenity IS NOT NULL)")
+    defn = lyr.GetLayerDefn()
+    id_fields = [f for f in ("osm_id", "osm_way_id") if defn.GetFieldIndex(f) != -1]
+
+    entries = []
+    for feat in lyr:
+        geom = feat.GetGeometryRef()
+        if geom is None: continue
+        minx, maxx, miny, maxy = geom.GetEnvelope()
+        place, amenity = feat.GetField("place"), feat.GetField("amenity")
+        entries.append({
+            "name": feat.GetField("name"),
+            "kind": "place" if place else "amenity",
+            "type": place or amenity,
+            "bbox": [minx, miny, maxx, maxy],
+            "fid": feat.GetFID(),
+            "osm_id": next((feat.GetField(f) for f in id_fields if feat.GetField(f)), None)
+        })
+    ds = None
+
+    index = {"source": source, "is_store": is_store, "stamps": _source_stamps(input_pbf, source),
+             "entries": entries}
+    with open(index_path, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    print(f"Indexed {len(entries)} named boundaries: {index_path}")
+    return index_path
+
+def _source_stamps(*paths):
+    """{path: [size, mtime]} of the existing files among paths."""
+    return {p: [os.path.getsize(p), os.path.getmtime(p)] for p in dict.fromkeys(paths) if os.path.exists(p)}
+
+def _load_place_index(input_pbf):
+    """
+    Place index for input_pbf (cached per file version), or None if not built or
+    stale: the .pbf or store it was built from has been replaced since, so its
+    fids no longer point at the same boundaries.
+    """
+    path = place_index_path(input_pbf)
+    if not os.path.exists(path):
+        return None
+    mtime = os.path.getmtime(path)
+    cached = _PLACE_INDEX_CACHE.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        for e in index["entries"]:
+            e["_key"] = e["name"].casefold()
+        _PLACE_INDEX_CACHE[path] = cached = (mtime, index)
+    index = cached[1]
+    stamps = index.get("stamps")
+    if not stamps or _source_stamps(*stamps) != stamps:
+        print(f"Place index {path} is out of date; run build_place_index again.")
+        return None
+    return index
+
+@_profiled
+def find_places(input_pbf, text, limit=10, fuzzy=True):
+    """
+    Prefix, substring and (optionally) fuzzy search over the place index.
+    Prints the candidates and returns them; pass one to extract_bndrs.
+    """
+    index = _load_place_index(input_pbf)
+    if index is None:
+        raise RuntimeError(f"No place index for {input_pbf}; run build_place_index first.")
+
+    key = text.casefold()
+    entries = index["entries"]
+    hits = [e for e in entries if e["_key"].startswith(key)]
+    hits += [e for e in entries if key in e["_key"] and not e["_key"].startswith(key)]
+    if fuzzy and len(hits) < limit:
+        names = {e["_key"] for e in entries}
+        close = difflib.get_close_matches(key, names, n=limit, cutoff=0.6)
+        rank = {n: i for i, n in enumerate(close)}
+        hits += sorted((e for e in entries if e["_key"] in rank and e not in hits), key=lambda e: rank[e["_key"]])
+
+    hits = [{k: v for k, v in e.items() if k != "_key"} for e in hits[:limit]]
+    for i, e in enumerate(hits):
+        print(f"{i:>3}  {e['name']:40} {e['kind']}={e['type']}")
+    return hits
+
+def _index_lookup(input_pbf, name):
+    """Best exact-name boundary from the place index (extract_bndrs preference order)."""
+    index = _load_place_index(input_pbf)
+    if index is None:
+        return None
+    found = [e for e in index["entries"] if e["name"] == name]
+    order = [("place", t) for t in _PLACE_TYPES] + [("amenity", t) for t in _AMENITY_TYPES]
+    found.sort(key=lambda e: order.index((e["kind"], e["type"])) if (e["kind"], e["type"]) in order else len(order))
+    return {k: v for k, v in found[0].items() if k != "_key"} if found else None
+
+@_profiled
 def extract_bndrs(input_pbf, focus, zoom=True):
+    """
+    Loads the AOI boundary called focus (place, else amenity) as a layer.
+    focus may also be an entry from find_places. When a place index exists
+    (build_place_index) the boundary is a keyed lookup instead of a file scan.
+    """
     gdal.UseExceptions()
+    source, _ = _pbf_source(input_pbf)
+
+    if isinstance(focus, dict):
+        entry, focus = focus, focus["name"]
+    else:
+        entry = _index_lookup(input_pbf, focus)
+    # fids are only keys into the store the index was built from
+    index = _load_place_index(input_pbf)
+    fid_lookup = bool(entry and index and index.get("is_store") and index.get("source") == source)
     
     layer_name = f'aoi_{focus}'
     boundary_name = focus
     geojson_vsimem = "/vsimem/temp_boundary.geojson"
 
-    place_types = ["neighbourhood", "suburb", "quarter", "borough", "village", "town", "city"]
-    amenity_list = ["university", "research_institute"]
+    place_types = _PLACE_TYPES
+    amenity_list = _AMENITY_TYPES
 
-    def _run_gdal_translate(where_clause):
+    def _run_gdal_translate(options):
         try:
-            gdal.VectorTranslate(
-                geojson_vsimem,
-                input_pbf,
-                format="GeoJSON",
-                layers=["multipolygons"],
-                options=["-where", where_clause, "-makevalid"]
-            )
+            with profile_stage("gdal translate"):
+                gdal.VectorTranslate(
+                    geojson_vsimem,
+                    source,
+                    format="GeoJSON",
+                    layers=["multipolygons"],
+                    options=options + ["-makevalid"]
+                )
             
             # Load the temporary OGR layer
             temp_layer = QgsVectorLayer(geojson_vsimem, "temp", "ogr")
@@ -306,17 +1636,29 @@ def extract_bndrs(input_pbf, focus, zoom=True):
         return None
 
     _remove_layer_by_name(layer_name)
+    final = None
+
+    # Strategy 0: the place index. fid lookup in a store, else a bbox-limited read
+    if entry is not None:
+        if fid_lookup and entry.get("fid") is not None:
+            final = _run_gdal_translate(["-fid", str(entry["fid"])])
+        if final is None:
+            kind_filter = f"{entry['kind']} = {_sql_quote(entry['type'])}"
+            final = _run_gdal_translate(
+                ["-where", f"name = {_sql_quote(boundary_name)} AND {kind_filter}",
+                 "-spat"] + [str(v) for v in entry["bbox"]])
 
     # Strategy 1: Places
-    place_filter = " OR ".join([f"place = '{p}'" for p in place_types])
-    where_place = f"name = '{boundary_name}' AND ({place_filter})"
-    final = _run_gdal_translate(where_place)
+    if final is None:
+        place_filter = " OR ".join([f"place = '{p}'" for p in place_types])
+        where_place = f"name = {_sql_quote(boundary_name)} AND ({place_filter})"
+        final = _run_gdal_translate(["-where", where_place])
 
     # Strategy 2: Amenities
     if final is None:
         amenity_filter = " OR ".join([f"amenity = '{a}'" for a in amenity_list])
-        where_amenity = f"name = '{boundary_name}' AND ({amenity_filter})"
-        final = _run_gdal_translate(where_amenity)
+        where_amenity = f"name = {_sql_quote(boundary_name)} AND ({amenity_filter})"
+        final = _run_gdal_translate(["-where", where_amenity])
 
     if final is None:
         raise RuntimeError(f"No boundary found for '{boundary_name}'")
@@ -340,70 +1682,131 @@ def osm_key_to_field(key):
            .lower()
     )
 
-def process_osm_tags_and_ids(layer):
+# Regex for "key"=>"value"
+_HSTORE_PATTERN = re.compile(r'"(.*?)"=>"(.*?)"')
+
+#- plain ASCII numbers only: int()/float() also take "1_000", " 12 " or non-ASCII digits
+#- no leading zeros: "007" or "02134" are codes, a number column would drop the zeros
+_INT_PATTERN = re.compile(r"-?(0|[1-9][0-9]*)", re.ASCII)
+_FLOAT_PATTERN = re.compile(r"-?(0|[1-9][0-9]*)(\.[0-9]+)?", re.ASCII)
+
+def _typed_field(key, values):
+    """
+    QgsField + converter for a new column: Int, LongLong, Double when every value is such a number, else String.
+    Addresses and references (addr:*, ref, *:ref) are identifiers and stay String.
+    """
+    if key.startswith("addr:") or key == "ref" or key.endswith(":ref"):
+        return QgsField(key, QVariant.String), str
+    if all(_INT_PATTERN.fullmatch(v) for v in values):
+        if all(-2**31 <= int(v) < 2**31 for v in values):
+            return QgsField(key, QVariant.Int), int
+        if all(-2**63 <= int(v) < 2**63 for v in values):
+            return QgsField(key, QVariant.LongLong), int
+    elif all(_FLOAT_PATTERN.fullmatch(v) for v in values):
+        return QgsField(key, QVariant.Double), float
+    return QgsField(key, QVariant.String), str
+
+@_profiled
+def process_osm_tags_and_ids(layer, keys=None, min_count=None, typed=False):
+    """
+    Expands the hstore 'other_tags' column of a PBF layer into real columns
+    in a single read pass (each distinct hstore string is parsed once) and
+    one bulk provider write.
+
+    keys: whitelist of tags to add; min_count: also add tags present on at
+    least this many features. With neither, every tag found is added.
+    typed: new columns become Int/Double where all their values allow it.
+    Existing columns are only filled where empty; osm_id falls back to osm_way_id.
+    """
     if not layer:
         return None
 
-    layer.startEditing()
+    # Flush any pending edits, the write below goes straight to the provider
+    if layer.isEditable() and not layer.commitChanges():
+        return None
     pr = layer.dataProvider()
 
     fields = layer.fields()
     field_names = {f.name() for f in fields}
-
-    # Regex for "key"=>"value"
-    tag_pattern = re.compile(r'"(.*?)"=>"(.*?)"')
-
-    # ---- discover missing OSM keys ----
-    missing_keys = set()
-
-    for f in layer.getFeatures():
-        tags = f['other_tags']
-        if not tags:
-            continue
-
-        for k, v in tag_pattern.findall(tags):
-            if k not in field_names:
-                missing_keys.add(k)
-
-    # ---- add missing fields (with colons preserved) ----
-    if missing_keys:
-        pr.addAttributes(
-            [QgsField(k, QVariant.String) for k in sorted(missing_keys)]
-        )
-        layer.updateFields()
-        fields = layer.fields()
-
-    # ---- populate fields ----
+    has_tags = 'other_tags' in field_names
+    fix_ids = 'osm_id' in field_names and 'osm_way_id' in field_names
+
+    # ---- single pass: parse, count, note empty existing cells ----
+    parsed_cache = {}
+    parsed_rows = []      # (fid, [(k, v), ...]) sharing cached lists
+    counts = {}
+    updates = {}          # fid -> {field name: value}
     for f in layer.getFeatures():
-        attrs = {}
-        tags = f['other_tags']
-
+        tags = f['other_tags'] if has_tags else None
         if tags:
-            for k, v in tag_pattern.findall(tags):
-                idx = fields.indexFromName(k)
-                if idx != -1:
-                    # only fill if empty
-                    if f[k] in (None, "", NULL):
-                        attrs[idx] = v
+            parsed = parsed_cache.get(tags)
+            if parsed is None:
+                parsed = parsed_cache[tags] = _HSTORE_PATTERN.findall(tags)
+            parsed_rows.append((f.id(), parsed))
+            for k, v in parsed:
+                counts[k] = counts.get(k, 0) + 1
+                # only fill existing columns if empty
+                if k in field_names and f[k] in (None, "", NULL):
+                    updates.setdefault(f.id(), {})[k] = v
 
         # ---- osm_id fallback (safe) ----
-        if 'osm_id' in field_names and 'osm_way_id' in field_names:
-            if not f['osm_id']:
-                idx = fields.indexFromName('osm_id')
-                attrs[idx] = f['osm_way_id']
+        if fix_ids and not f['osm_id']:
+            updates.setdefault(f.id(), {})['osm_id'] = f['osm_way_id']
+
+    # ---- choose the new columns ----
+    new_keys = [k for k in counts if k not in field_names]
+    if keys is not None or min_count is not None:
+        wanted = set(keys or [])
+        threshold = min_count if min_count is not None else float("inf")
+        new_keys = [k for k in new_keys if k in wanted or counts[k] >= threshold]
+    new_keys.sort()
+    new_set = set(new_keys)
+
+    converters = {}
+    if new_keys:
+        if typed:
+            values = {k: [] for k in new_keys}
+            for parsed in parsed_cache.values():
+                for k, v in parsed:
+                    if k in new_set:
+                        values[k].append(v)
+            new_fields = []
+            for k in new_keys:
+                field, converters[k] = _typed_field(k, values[k])
+                new_fields.append(field)
+        else:
+            new_fields = [QgsField(k, QVariant.String) for k in new_keys]
+        # ---- add missing fields (with colons preserved) ----
+        pr.addAttributes(new_fields)
+        layer.updateFields()
+        fields = layer.fields()
 
-        if attrs:
-            layer.changeAttributeValues(f.id(), attrs)
+        for fid, parsed in parsed_rows:
+            for k, v in parsed:
+                if k in new_set:
+                    updates.setdefault(fid, {})[k] = converters[k](v) if k in converters else v
+
+    # ---- populate fields: one bulk write ----
+    if updates:
+        idx = {name: fields.indexFromName(name) for name in new_keys}
+        changes = {}
+        for fid, values in updates.items():
+            changes[fid] = {idx[k] if k in idx else fields.indexFromName(k): v for k, v in values.items()}
+        with profile_stage("attribute write", len(changes)):
+            if not pr.changeAttributeValues(changes):
+                return None
+        _bump_revision(layer)
 
-    layer.commitChanges()
     return layer
 
+@_profiled
 def extract_blds(input_pbf, focus, aoi_layer):
     """
     Extracts buildings within the bounding box, then clips them 
     to the irregular geometry of the aoi_layer.
     """
     gdal.UseExceptions()
+    source, _ = _pbf_source(input_pbf)
 
     layer_name = f"Buildings_{focus}"
     geojson_vsimem = "/vsimem/temp_buildings.geojson"
@@ -415,31 +1818,35 @@ def extract_blds(input_pbf, focus, aoi_layer):
 
     def _run_gdal_translate():
         try:
-            gdal.VectorTranslate(
-                geojson_vsimem,
-                input_pbf,
-                format="GeoJSON",
-                layers=["multipolygons"],
-                options=[
-                    "-where", "building IS NOT NULL", 
-                    "-makevalid", 
-                    "-spat", str(minx), str(miny), str(maxx), str(maxy)
-                ]
-            )
+            with profile_stage("gdal translate"):
+                gdal.VectorTranslate(
+                    geojson_vsimem,
+                    source,
+                    format="GeoJSON",
+                    layers=["multipolygons"],
+                    options=[
+                        "-where", "building IS NOT NULL", 
+                        "-makevalid", 
+                        "-spat", str(minx), str(miny), str(maxx), str(maxy)
+                    ]
+                )
             
             temp_layer = QgsVectorLayer(geojson_vsimem, "raw_harvest", "ogr")
             
             if temp_layer.isValid() and temp_layer.featureCount() > 0:
                 # 2. Clip the harvested buildings to the irregular AOI
                 # This removes buildings in the "corners" of the bounding box
-                clipped_result = processing.run(
-                    "native:clip",
-                    {
-                        'INPUT': temp_layer,
-                        'OVERLAY': aoi_layer,
-                        'OUTPUT': 'memory:'
-                    }
-                )
+                with profile_stage("clip", temp_layer.featureCount()) as rec:
+                    clipped_result = processing.run(
+                        "native:clip",
+                        {
+                            'INPUT': temp_layer,
+                            'OVERLAY': aoi_layer,
+                            'OUTPUT': 'memory:'
+                        }
+                    )
+                    if rec is not None:
+                        rec["out"] = clipped_result['OUTPUT'].featureCount()
                 
                 final_layer = clipped_result['OUTPUT']
                 final_layer.setName(layer_name)
@@ -469,81 +1876,42 @@ def extract_blds(input_pbf, focus, aoi_layer):
 
     return final_blds
 
+@_profiled
 def q_farmland(large, focus):
     """Harvest landuse=farmland and add to project."""
-    name = f"Farmland_{focus}"
-    query = (f'[out:json][timeout:180];area[name="{large}"]->.L;area[name="{focus}"](area.L)->.a;(way["landuse"="farmland"](area.a);relation["landuse"="farmland"]["type"="multipolygon"](area.a););out geom;')
-    data = _fetch_overpass(query)
-    vlayer = QgsVectorLayer(json.dumps(_parse_to_geojson(data, "Polygon")), name, "ogr")
-    final = vlayer.materialize(QgsFeatureRequest())
-    
-    _remove_layer_by_name(name)
-    # Check if dataset is not empty before adding
-    if final.featureCount() > 0:
-        QgsProject.instance().addMapLayer(final)
-        return final
-    else:
-        print(f"Skipped {name}: No features found.")
-        return None
+    return _add_theme_layer("farmland", focus, _fetch_overpass(_theme_query("farmland", large, focus)))
 
+@_profiled
 def q_green_spaces(large, focus):
     """Harvest leisure areas and add to project."""
-    name = f"GreenSpaces_{focus}"
-    query = (f'[out:json][timeout:180];area[name="{large}"]->.L;area[name="{focus}"](area.L)->.a;(way["leisure"~"park|track|pitch"](area.a);relation["leisure"~"park|track|pitch"]["type"="multipolygon"](area.a););out geom;')
-    data = _fetch_overpass(query)
-    vlayer = QgsVectorLayer(json.dumps(_parse_to_geojson(data, "Polygon")), name, "ogr")
-    final = vlayer.materialize(QgsFeatureRequest())
-    
-    _remove_layer_by_name(name)
-    # Check if dataset is not empty before adding
-    if final.featureCount() > 0:
-        QgsProject.instance().addMapLayer(final)
-        return final
-    else:
-        print(f"Skipped {name}: No features found.")
-        return None
+    return _add_theme_layer("green", focus, _fetch_overpass(_theme_query("green", large, focus)))
 
+@_profiled
 def q_water(large, focus):
     """Harvest water features and add to project."""
-    name = f"Water_{focus}"
-    query = (f'[out:json][timeout:180];area[name="{large}"]->.L;area[name="{focus}"](area.L)->.a;(way["water"](area.a);way["waterway"="stream"](area.a);relation["water"]["type"="multipolygon"](area.a););out geom;')
-    data = _fetch_overpass(query)
-    vlayer = QgsVectorLayer(json.dumps(_parse_to_geojson(data, "Polygon")), name, "ogr")
-    final = vlayer.materialize(QgsFeatureRequest())
-    
-    _remove_layer_by_name(name)
-    # Check if dataset is not empty before adding
-    if final.featureCount() > 0:
-        QgsProject.instance().addMapLayer(final)
-        return final
-    else:
-        print(f"Skipped {name}: No features found.")
-        return None
-    return final
+    return _add_theme_layer("water", focus, _fetch_overpass(_theme_query("water", large, focus)))
 
 def hex_to_rgb(h):
     h = h.lstrip("#")
     return tuple(int(h[i : i + 2], 16) for i in (0, 2, 4))
 
+def _colour_to_rgb(colour):
+    try:
+        return list(hex_to_rgb(colour))
+    except Exception:
+        return [255, 0, 0] # Fallback
+
+@_profiled
 def q_Troutes(large, operator='MyCiTi'):
     """Harvest bus routes and apply original RGB tuple conversion."""
     name = f"Transit_{operator}"
     query = (f'[out:json][timeout:180];area[name="{large}"];(relation["type"="route"]["route"="bus"]["operator"="{operator}"]["colour"](area););out geom;')
     
     data = _fetch_overpass(query)
-    geojson = _parse_to_geojson(data, "MultiLineString")
 
-    # Apply your hex_to_rgb conversion logic directly
-    for feat in geojson["features"]:
-        if "colour" in feat["properties"]:
-            try:
-                # Store the tuple directly as requested
-                feat["properties"]["colour"] = hex_to_rgb(feat["properties"]["colour"])
-            except Exception:
-                feat["properties"]["colour"] = (255, 0, 0) # Fallback
-            
-    vlayer = QgsVectorLayer(json.dumps(geojson), name, "ogr")
-    final = vlayer.materialize(QgsFeatureRequest())
+    # Apply your hex_to_rgb conversion logic directly, into an integer list column
+    colour_field = QgsField("colour", QVariant.List, "integerlist", 0, 0, "", QVariant.Int)
+    final = _overpass_to_layer(data, name, "MultiLineString", converters={"colour": (colour_field, _colour_to_rgb)})
     
     _remove_layer_by_name(name)
     # Check if dataset is not empty before adding
@@ -554,33 +1922,191 @@ def q_Troutes(large, operator='MyCiTi'):
         print(f"Skipped {name}: No features found.")
         return None
 
-def layer_to_geojson_dict(layer):
-    """Converts a QGIS layer to a GeoJSON-style dictionary in WGS84."""
-    options = QgsVectorFileWriter.SaveVectorOptions()
-    options.driverName = "GeoJSON"
-    # Ensure coordinates are in WGS84 for MapLibre
+def _json_value(value):
+    """QVariant/Qt attribute value -> JSON-ready Python value (GeoJSON driver semantics)."""
+    if QgsVariantUtils.isNull(value):
+        return None
+    if isinstance(value, str):
+        # GDAL's AUTODETECT_JSON_STRINGS: "[255, 0, 0]" is written as an array
+        if value[:1] in ("[", "{"):
+            try:
+                return json.loads(value)
+            except ValueError:
+                pass
+        return value
+    if isinstance(value, (bool, int)):
+        return value
+    if isinstance(value, float):
+        return value if np.isfinite(value) else None
+    if isinstance(value, (list, tuple)):
+        return [_json_value(v) for v in value]
+    if hasattr(value, "toString"):
+        # QDate / QTime / QDateTime
+        return value.toString(Qt.ISODate)
+    return str(value)
+
+def _geojson_parts(layer, precision=None, attributes=None):
+    """
+    Yields (properties dict, geometry JSON text) per feature, reprojected to
+    WGS84. Only the requested attributes are fetched from the provider.
+    """
     dest_crs = QgsCoordinateReferenceSystem("EPSG:4326")
-    
-    # Create a temporary file path
-    temp_path = os.path.join(os.path.expanduser("~"), "temp_layer.geojson")
-    QgsVectorFileWriter.writeAsVectorFormatV3(layer, temp_path, QgsProject.instance().transformContext(), options)
-    
-    with open(temp_path, 'r') as f:
-        data = json.load(f)
-    
-    os.remove(temp_path)
-    return data
+    fields = layer.fields()
+    names = [n for n in fields.names() if attributes is None or n in attributes]
+    request = QgsFeatureRequest().setSubsetOfAttributes(names, fields)
+    xform = None
+    if layer.crs() != dest_crs:
+        xform = QgsCoordinateTransform(layer.crs(), dest_crs, QgsProject.instance())
+    precision = 17 if precision is None else precision
+
+    for feat in layer.getFeatures(request):
+        geom = feat.geometry()
+        if geom is None or geom.isEmpty():
+            geometry = "null"
+        else:
+            if xform is not None:
+                geom.transform(xform)
+            geometry = geom.asJson(precision)
+        yield {n: _json_value(feat[n]) for n in names}, geometry
+
+@_profiled
+def layer_to_geojson_dict(layer, precision=None, attributes=None):
+    """
+    Converts a QGIS layer to a GeoJSON-style dictionary in WGS84, in memory
+    (no temporary file).
+    precision: decimal places kept for coordinates (None = full precision).
+    attributes: field names to export (None = all, [] = geometry only).
+    """
+    features = [
+        {"type": "Feature", "properties": props, "geometry": json.loads(geometry)}
+        for props, geometry in _geojson_parts(layer, precision, attributes)
+    ]
+    return {"type": "FeatureCollection", "features": features}
 
+@_profiled
+def write_geojson(layer, fh, precision=None, attributes=None):
+    """
+    Streams a layer as a GeoJSON FeatureCollection (WGS84) into an open text
+    file, one feature at a time, without building the whole dictionary.
+    Options as in layer_to_geojson_dict. Returns (features, characters written).
+    """
+    n = 0
+    written = fh.write('{"type": "FeatureCollection", "features": [')
+    for props, geometry in _geojson_parts(layer, precision, attributes):
+        written += fh.write(f'{", " if n else ""}{{"type": "Feature", "properties": {json.dumps(props)}, "geometry": {geometry}}}')
+        n += 1
+    written += fh.write("]}")
+    _profile_bytes(written=written)
+    return n, written
+
+#- properties the map reads per source (extrusion, colour, popup); everything else is pruned
+_VIZ_PROPERTIES = {
+    "water": [],
+    "green": [],
+    "bus": ["colour"],
+    "buildings": ["building", "address", "plus_code", "building_height", "fill_color"],
+}
+
+#- browser side of _encode_viz_layer
+_VIZ_DECODER_JS = """
+function geo3dDecode(buf) {
+    const dv = new DataView(buf);
+    const hlen = dv.getUint32(0, true);
+    const head = JSON.parse(new TextDecoder().decode(new Uint8Array(buf, 4, hlen)));
+    let off = 4 + hlen; off += (4 - off % 4) % 4;
+    const types = new Uint8Array(buf, off, head.n); off += head.n; off += (4 - off % 4) % 4;
+    const parts = new Uint32Array(buf, off, head.nparts); off += head.nparts * 4;
+    const xy = new Int32Array(buf, off, head.ncoords * 2);
+    let p = 0, c = 0, x = 0, y = 0;
+    const pt = () => { x += xy[c++]; y += xy[c++]; return [x / head.scale, y / head.scale]; };
+    const many = (f) => { const n = parts[p++]; const out = new Array(n); for (let i = 0; i < n; i++) out[i] = f(); return out; };
+    const line = () => many(pt);
+    const poly = () => many(line);
+    const kinds = [null, ['Polygon', poly], ['MultiPolygon', () => many(poly)], ['LineString', line],
+                   ['MultiLineString', () => many(line)], ['Point', pt], ['MultiPoint', line]];
+    const keys = Object.keys(head.props);
+    const features = new Array(head.n);
+    for (let i = 0; i < head.n; i++) {
+        const k = kinds[types[i]];
+        const properties = {};
+        for (const key of keys) { const col = head.props[key]; properties[key] = col.dict[col.idx[i]]; }
+        features[i] = { type: 'Feature', properties: properties,
+                        geometry: k ? { type: k[0], coordinates: k[1]() } : null };
+    }
+    return { type: 'FeatureCollection', features: features };
+}
+
+function geo3dLoad(name, src) {
+    if (src === 'inline') {
+        const b64 = document.getElementById('geo3d-' + name).textContent.trim();
+        const bytes = Uint8Array.from(atob(b64), ch => ch.charCodeAt(0));
+        return Promise.resolve(geo3dDecode(bytes.buffer));
+    }
+    return fetch(src).then(r => r.arrayBuffer()).then(geo3dDecode);
+}
+"""
 
-def create_3Dviz(result_dir, buildings_layer, farmland_layer=None, green_layer=None, water_layer=None, bus_layer=None):
+def _payload_report(rows):
+    """Prints the per-layer payload table: features, GeoJSON bytes, written bytes."""
+    print(f"{'layer':<10} {'features':>9} {'geojson':>12} {'written':>12} {'ratio':>7}")
+    for name, n, raw, written in rows:
+        ratio = f"{raw / written:6.1f}x" if written else f"{'-':>7}"
+        print(f"{name:<10} {n:>9} {raw:>12,} {written:>12,} {ratio}")
+    print(f"{'total':<10} {sum(r[1] for r in rows):>9} {sum(r[2] for r in rows):>12,} {sum(r[3] for r in rows):>12,}")
+
+@_profiled
+def create_3Dviz(result_dir, buildings_layer, farmland_layer=None, green_layer=None, water_layer=None, bus_layer=None,
+                 payload="json", precision=6, report=False):
+    """
+    Writes interactiveOnly.html (MapLibre, pseudo-3D buildings).
+
+    payload="json"    -> every layer inlined as GeoJSON (original behaviour),
+                         streamed feature by feature into the file.
+    payload="inline"  -> pruned, quantized binary layers embedded as base64 and
+                         decoded after the map loads (single shareable file).
+    payload="sidecar" -> the same binary written to interactiveOnly_data/*.bin and
+                         fetched lazily (serve the folder, e.g. python -m http.server).
+    precision: decimal places kept for coordinates in the binary modes (0-7).
+    report: print the payload size per layer and of the HTML file.
+    """
+    if payload not in ("json", "inline", "sidecar"):
+        raise ValueError("payload must be 'json', 'inline' or 'sidecar'")
+    if payload != "json" and not (isinstance(precision, int) and 0 <= precision <= _VIZ_MAX_PRECISION):
+        raise ValueError(f"precision must be an integer from 0 to {_VIZ_MAX_PRECISION}, got {precision!r}")
     html_path = os.path.join(result_dir, "interactiveOnly.html")
     
-    # 1. Convert layers to GeoJSON Data
-    building_data = layer_to_geojson_dict(buildings_layer)
-    green_data = layer_to_geojson_dict(green_layer) if green_layer else {"type": "FeatureCollection", "features": []}
-    farmland_data = layer_to_geojson_dict(farmland_layer) if farmland_layer else {"type": "FeatureCollection", "features": []}
-    water_data = layer_to_geojson_dict(water_layer) if water_layer else {"type": "FeatureCollection", "features": []}
-    bus_data = layer_to_geojson_dict(bus_layer) if bus_layer else {"type": "FeatureCollection", "features": []}
+    # 1. Source payloads (+ sizes for the report). In json mode each source is a marker,
+    #    streamed into the file below instead of being held as one big string.
+    layers = {"water": water_layer, "green": green_layer, "bus": bus_layer, "buildings": buildings_layer}
+    empty = json.dumps({"type": "FeatureCollection", "features": []})
+    sources, blobs, loads, sizes = [], [], [], []
+    data_dir = os.path.join(result_dir, "interactiveOnly_data")
+    for name, layer in layers.items():
+        if payload == "json":
+            sources.append(f"map.addSource('{name}', {{ type: 'geojson', data: \0{name}\0 }});")
+            continue
+
+        data = layer_to_geojson_dict(layer, attributes=_VIZ_PROPERTIES[name]) if layer else json.loads(empty)
+        raw = len(json.dumps(data))
+        n = len(data["features"])
+        binary = _encode_viz_layer(data, _VIZ_PROPERTIES[name], precision)
+        sources.append(f"map.addSource('{name}', {{ type: 'geojson', data: {empty} }});")
+        if payload == "inline":
+            b64 = base64.b64encode(binary).decode("ascii")
+            blobs.append(f'<script type="application/octet-stream" id="geo3d-{name}">{b64}</script>')
+            loads.append(f"geo3dLoad('{name}', 'inline').then(fc => map.getSource('{name}').setData(fc));")
+            sizes.append((name, n, raw, len(b64)))
+        else:
+            os.makedirs(data_dir, exist_ok=True)
+            with open(os.path.join(data_dir, f"{name}.bin"), "wb") as f:
+                _profile_bytes(written=f.write(binary))
+            loads.append(f"geo3dLoad('{name}', 'interactiveOnly_data/{name}.bin').then(fc => map.getSource('{name}').setData(fc));")
+            sizes.append((name, n, raw, len(binary)))
+
+    sources_js = "\n    ".join(sources)
+    loads_js = "\n    ".join(loads)
+    blobs_html = "\n".join(blobs)
+    decoder_js = _VIZ_DECODER_JS if payload != "json" else ""
 
     # 2. Get Map Center
     extent = buildings_layer.extent()
@@ -606,7 +2132,8 @@ def create_3Dviz(result_dir, buildings_layer, farmland_layer=None, green_layer=N
 </head>
 <body>
 <div id="map"></div>
-<script>
+{blobs_html}
+<script>{decoder_js}
 const map = new maplibregl.Map({{
     container: 'map',
     style: 'https://basemaps.cartocdn.com/gl/dark-matter-gl-style/style.json',
@@ -623,10 +2150,8 @@ map.addControl(new maplibregl.NavigationControl({{
 
 map.on('load', () => {{
     // Add Sources
-    map.addSource('water', {{ type: 'geojson', data: {json.dumps(water_data)} }});
-    map.addSource('green', {{ type: 'geojson', data: {json.dumps(green_data)} }});
-    map.addSource('bus', {{ type: 'geojson', data: {json.dumps(bus_data)} }});
-    map.addSource('buildings', {{ type: 'geojson', data: {json.dumps(building_data)} }});
+    {sources_js}
+    {loads_js}
 
     // Water
     map.addLayer({{
@@ -698,8 +2223,22 @@ map.on('load', () => {{
 </body>
 </html>
 """
+    # text, source name, text, ... (names only appear in json mode)
+    chunks = html_content.split("\0")
     with open(html_path, "w", encoding="utf-8") as f:
-        f.write(html_content)
+        for i, chunk in enumerate(chunks):
+            if i % 2 == 0:
+                _profile_bytes(written=f.write(chunk))
+            elif not layers[chunk]:
+                sizes.append((chunk, 0, f.write(empty), len(empty)))
+                _profile_bytes(written=len(empty))
+            else:
+                n, written = write_geojson(layers[chunk], f)
+                sizes.append((chunk, n, written, written))
+
+    if report:
+        _payload_report(sizes)
+        print(f"HTML: {os.path.getsize(html_path):,} bytes -> {html_path}")
     return html_path
 
 def get_utm_crs(gdf):
@@ -715,7 +2254,7 @@ def get_utm_crs(gdf):
     epsg_code = epsg_prefix + utm_zone
     
     # 2. Initialize the CRS object from the EPSG
-    utm_crs = CRS.from_epsg(epsg_code)
+    utm_crs = pyproj.CRS.from_epsg(epsg_code)
     
     # 3. Print the full detailed report
     # Using 'print(utm_crs)' in some environments only shows the code.
@@ -728,17 +2267,10 @@ def get_utm_crs(gdf):
     # (Matches the exact printout you requested)
     return epsg_code
 
+@_profiled
 def q_solar(large, focus):
     """Harvest solar (power=generator) and add to project."""
-    name = f"Solar_{focus}"
-    query = (f'[out:json][timeout:180];area[name="{large}"]->.L;area[name="{focus}"](area.L)->.a;(way["power"="generator"]["generator:source"="solar"](area.a););out geom;')
-    data = _fetch_overpass(query)
-    vlayer = QgsVectorLayer(json.dumps(_parse_to_geojson(data, "Polygon")), name, "ogr")
-    final = vlayer.materialize(QgsFeatureRequest())
-    
-    _remove_layer_by_name(name)
-    QgsProject.instance().addMapLayer(final)
-    return final
+    return _add_theme_layer("solar", focus, _fetch_overpass(_theme_query("solar", large, focus)))
 
 def read_vsimem_geojson(vsimem_path):
     """
@@ -748,6 +2280,7 @@ def read_vsimem_geojson(vsimem_path):
     gdf = gdf.set_crs("EPSG:4326", allow_override=True)
     return gdf
 
+@_profiled
 def _harvestSolar(input_pbf, focus, aoi_layer, epsg):
     """
     Harvests solar data. 
@@ -758,10 +2291,17 @@ def _harvestSolar(input_pbf, focus, aoi_layer, epsg):
     gdal.SetConfigOption("OGR_GEOMETRY_ACCEPT_UNCLOSED_RING", "NO")
     gdal.SetConfigOption("OGR_INTERLEAVED_READING", "YES")
 
-    sql_where_solar_generator = """
-        other_tags LIKE '%"power"=>"generator"%'
-        AND other_tags LIKE '%"generator:source"=>"solar"%'
-    """
+    source, is_store = _pbf_source(input_pbf)
+    if is_store:
+        # promoted columns in the indexed store
+        sql_where_solar_generator = """
+            "power" = 'generator' AND "generator:source" = 'solar'
+        """
+    else:
+        sql_where_solar_generator = """
+            other_tags LIKE '%"power"=>"generator"%'
+            AND other_tags LIKE '%"generator:source"=>"solar"%'
+        """
 
     # Get extent for GDAL harvesting
     extent = aoi_layer.extent()
@@ -772,21 +2312,23 @@ def _harvestSolar(input_pbf, focus, aoi_layer, epsg):
 
     # --- 1. Process Multipolygons ---
     geojson_poly = "/vsimem/solar_multipolygons.geojson"
-    gdal.VectorTranslate(
-        geojson_poly, input_pbf, format="GeoJSON", layers=["multipolygons"],
-        options=["-where", sql_where_solar_generator, "-makevalid",
-                 "-spat", str(minx), str(miny), str(maxx), str(maxy)]
-    )
+    with profile_stage("gdal translate (multipolygons)"):
+        gdal.VectorTranslate(
+            geojson_poly, source, format="GeoJSON", layers=["multipolygons"],
+            options=["-where", sql_where_solar_generator, "-makevalid",
+                     "-spat", str(minx), str(miny), str(maxx), str(maxy)]
+        )
     gdf_poly = read_vsimem_geojson(geojson_poly)
     if not gdf_poly.empty: all_solar_gdfs.append(gdf_poly)
 
     # --- 2. Process Lines ---
     geojson_lines = "/vsimem/solar_lines.geojson"
-    gdal.VectorTranslate(
-        geojson_lines, input_pbf, format="GeoJSON", layers=["lines"],
-        options=["-where", sql_where_solar_generator, "-makevalid",
-                 "-spat", str(minx), str(miny), str(maxx), str(maxy), "-nlt", "POLYGON"]
-    )
+    with profile_stage("gdal translate (lines)"):
+        gdal.VectorTranslate(
+            geojson_lines, source, format="GeoJSON", layers=["lines"],
+            options=["-where", sql_where_solar_generator, "-makevalid",
+                     "-spat", str(minx), str(miny), str(maxx), str(maxy), "-nlt", "POLYGON"]
+        )
     gdf_lines = read_vsimem_geojson(geojson_lines)
     if not gdf_lines.empty: all_solar_gdfs.append(gdf_lines)
 
@@ -870,10 +2412,32 @@ def calculate_azimuth_from_geometry(polygon):
 
     return azimuth
 
-def _with_solar(gdf_buildings, gdf_solar):
+def _solar_pairs_partitioned(buildings, panels, pool, parts):
+    """
+    (building, panel) 'contains' pairs computed per spatial grid cell in the pool.
+    Each cell gets the panels touching its buildings' bbox, so no pair is lost.
+    """
+    bounds = shapely.bounds(buildings)
+    cells = grid_partitions((bounds[:, 0] + bounds[:, 2]) / 2, (bounds[:, 1] + bounds[:, 3]) / 2, parts)
+    tree = shapely.STRtree(panels)
+    index, tasks = [], []
+    for rows in cells:
+        candidates = tree.query(shapely.box(*shapely.total_bounds(buildings[rows])))
+        index.append((rows, candidates))
+        tasks.append((shapely.to_wkb(buildings[rows]), shapely.to_wkb(panels[candidates])))
+    b_idx, s_idx = [], []
+    for (rows, candidates), (b, s) in zip(index, pool.map(solar_partition, tasks)):
+        b_idx.append(rows[b])
+        s_idx.append(candidates[s])
+    return np.concatenate(b_idx), np.concatenate(s_idx)
+
+@_profiled
+def _with_solar(gdf_buildings, gdf_solar, workers=None):
     """
     Efficient Dual Join: Performs both building-centric and solar-centric joins
-    in one loop.
+    with one bulk STRtree query (predicate: building contains panel).
+    workers: split the query and the panel azimuths over that many processes
+    (partitioned by spatial grid cell); the output is identical.
 
     Returns: (gdf_buildings_modified, gdf_solar_modified)
     """
@@ -886,75 +2450,427 @@ def _with_solar(gdf_buildings, gdf_solar):
     SOLAR_ID_COLUMN = "osm_id"
     
     # --- BUILDING-CENTRIC OUTPUT (for blds.df) ---
-    solar_id_lists = [[] for _ in range(n_bld)]  # List of solar IDs for each building
+    solar_id_lists = [None] * n_bld  # List of solar IDs for each building
     solar_m = [[] for _ in range(n_bld)]
     has_solar = [False] * n_bld
 
     # --- SOLAR-CENTRIC OUTPUT (for gdf_solar.df) ---
-    bld_id_lists = [[] for _ in range(n_sol)]  # List of building IDs for each solar panel
-    #bld_id_lists =[None] * n_sol
-    
-    # Brute-force intersection
-    for i in range(n_bld):
-        b_geom = gdf_buildings["geometry"].iloc[i]
-        bld_id = gdf_buildings[BLD_ID_COLUMN].iloc[i] # Get the building ID
-
-        for j in range(n_sol):
-            s_geom = gdf_solar["geometry"].iloc[j]
-            sol_id = gdf_solar[SOLAR_ID_COLUMN].iloc[j] # Get the solar ID
-            s_m = gdf_solar['generator:method'].iloc[j] # Get the building ID
-
-            if b_geom.contains(s_geom):
-                # 1. Building-Centric Logic (Attaches solar ID to building)
+    bld_id_lists = [None] * n_sol  # List of building IDs for each solar panel
+
+    # the pool (if any) is shut down on every exit, errors included
+    with _process_pool(workers) if workers and n_sol else contextlib.nullcontext() as pool:
+        if n_bld and n_sol:
+            if pool is not None:
+                b_idx, s_idx = _solar_pairs_partitioned(np.asarray(gdf_buildings["geometry"]),
+                                                        np.asarray(gdf_solar["geometry"]), pool, workers * 4)
+            else:
+                # One index over the panels, one bulk query for every building
+                tree = shapely.STRtree(np.asarray(gdf_solar["geometry"]))
+                b_idx, s_idx = tree.query(np.asarray(gdf_buildings["geometry"]), predicate="contains")
+
+            bld_ids = gdf_buildings[BLD_ID_COLUMN].to_numpy()
+            sol_ids = gdf_solar[SOLAR_ID_COLUMN].to_numpy()
+            sol_method = gdf_solar['generator:method'].to_numpy()
+
+            # 1. Building-Centric Logic: panels in solar order per building
+            for i, j in zip(*(a[np.lexsort((s_idx, b_idx))] for a in (b_idx, s_idx))):
+                if solar_id_lists[i] is None:
+                    solar_id_lists[i] = []
                 has_solar[i] = True
-                solar_id_lists[i].append(sol_id)
-                solar_m[i].append(s_m)
-
-                # 2. Solar-Centric Logic (Attaches building ID to solar panel)
-                bld_id_lists[j].append(bld_id)
-                #if bld_id_lists[j] is None:
-                #    bld_id_lists[j] = bld_id
-
-    # --- Finalize Lists (Replace [] with None) ---
-    for i in range(n_bld):
-        if not solar_id_lists[i]:
-            solar_id_lists[i] = None
-
-    for j in range(n_sol):
-        if not bld_id_lists[j]:
-            bld_id_lists[j] = None
+                solar_id_lists[i].append(sol_ids[j])
+                solar_m[i].append(sol_method[j])
+
+            # 2. Solar-Centric Logic: buildings in building order per panel
+            for i, j in zip(*(a[np.lexsort((b_idx, s_idx))] for a in (b_idx, s_idx))):
+                if bld_id_lists[j] is None:
+                    bld_id_lists[j] = []
+                bld_id_lists[j].append(bld_ids[i])
+
+        # panel azimuths while the pool is up
+        if pool is not None:
+            chunks = [shapely.to_wkb(c) for c in np.array_split(np.asarray(gdf_solar['geometry']), workers * 4)]
+            azimuth = np.concatenate(list(pool.map(azimuth_partition, chunks)))
+        else:
+            azimuth = calculate_azimuths(gdf_solar['geometry'])
 
     # --- CREATE OUTPUT DataFrames ---
 
     # 1. Modified Building DataFrame (blds)
-    #gdf_blds_out = dict(gdf_buildings)
     gdf_buildings["children"] = solar_id_lists 
     gdf_buildings["has_solar"] = has_solar
     gdf_buildings["method"] = solar_m
-    #blds_out = GeoDataFrameLite(gdf_blds_out)
-    #blds_out.crs = epsg
 
     # 2. Modified Solar DataFrame (gdf_solar)
-    # We must use the solar DataFrame as the base to keep all geometry/attributes
-    #gdf_solar_out = dict(gdf_solar)
     # The new column holds the list of intersecting building IDs
     gdf_solar["parent"] = bld_id_lists 
-    #gdf_solar_out = GeoDataFrameLite(gdf_solar_out)
-    #gdf_solar_out.crs = epsg
     gdf_solar = gdf_solar.rename(columns={'generator:method': 'method'})
-    gdf_solar['area'] = gdf_solar['geometry'].apply(lambda geom: geom.area)
-    gdf_solar['azimuth'] = gdf_solar['geometry'].apply(calculate_azimuth_from_geometry)
+    gdf_solar['area'] = gdf_solar['geometry'].area
+    gdf_solar['azimuth'] = azimuth
 
     return gdf_buildings, gdf_solar
 
-def save_to_geopackage(gpkg_path, target_crs_string):
+@_profiled
+def _qgs_crs(crs):
+    """
+    QgsCoordinateReferenceSystem of a pyproj CRS: by authority code where it has
+    one (crs.to_string() can be WKT, which a memory layer URI can't carry),
+    otherwise from its WKT. None gives an invalid (unset) CRS.
+    """
+    if crs is None:
+        return QgsCoordinateReferenceSystem()
+    authority = crs.to_authority()
+    if authority is not None:
+        qcrs = QgsCoordinateReferenceSystem(":".join(authority))
+        if qcrs.isValid():
+            return qcrs
+    return QgsCoordinateReferenceSystem.fromWkt(crs.to_wkt())
+
+def overlapping_buildings(gdf_buildings, name="Overlapping_Buildings", add_to_project=True):
+    """
+    Topology QA: buildings whose footprints overlap (cross) one another, found
+    with ONE bulk STRtree query (predicate: overlaps) instead of a query per building.
+    Use a projected CRS (see get_utm_crs) so areas are in square metres.
+
+    Returns (pairs, crossing_buildings, layer):
+        pairs: DataFrame index_left, index_right (positions, left < right), overlap_area
+        crossing_buildings: the flagged rows of gdf_buildings
+        layer: memory layer of the flagged buildings (red), with osm_id, building,
+               overlaps (partner count) and overlap_area (sum); None if nothing overlaps
+    """
+    t0 = time.perf_counter()
+    geoms = np.asarray(gdf_buildings.geometry)
+    left, right = shapely.STRtree(geoms).query(geoms, predicate="overlaps")
+    keep = left < right                     # each pair once, no self matches
+    left, right = left[keep], right[keep]
+    t_query = time.perf_counter()
+
+    area = shapely.area(shapely.intersection(geoms[left], geoms[right]))
+    pairs = pd.DataFrame({"index_left": left, "index_right": right, "overlap_area": area})
+    t_area = time.perf_counter()
+
+    flagged = np.unique(np.concatenate([left, right]))
+    crossing_buildings = gdf_buildings.iloc[flagged].reset_index(drop=True)
+    counts = np.bincount(np.concatenate([left, right]), minlength=len(geoms))
+    areas = np.bincount(left, area, len(geoms)) + np.bincount(right, area, len(geoms))
+
+    layer = None
+    if len(flagged):
+        layer = QgsVectorLayer("MultiPolygon", name, "memory")
+        layer.setCrs(_qgs_crs(gdf_buildings.crs))
+        pr = layer.dataProvider()
+        pr.addAttributes([QgsField('osm_id', QVariant.String), QgsField('building', QVariant.String),
+                          QgsField('overlaps', QVariant.Int), QgsField('overlap_area', QVariant.Double)])
+        layer.updateFields()
+        columns = [gdf_buildings[c].to_numpy() if c in gdf_buildings else None for c in ('osm_id', 'building')]
+        features = []
+        for i, wkb in zip(flagged, shapely.to_wkb(geoms[flagged])):
+            geom = QgsGeometry()
+            geom.fromWkb(wkb)
+            geom.convertToMultiType()
+            feat = QgsFeature(layer.fields())
+            feat.setGeometry(geom)
+            feat.setAttributes([None if c is None or pd.isna(c[i]) else str(c[i]) for c in columns]
+                               + [int(counts[i]), float(areas[i])])
+            features.append(feat)
+        pr.addFeatures(features)
+        layer.updateExtents()
+
+        # ---- STYLE: solid red fill ----
+        symbol = QgsFillSymbol.createSimple({"color": "255,0,0", "outline_color": "255,0,0", "outline_width": "0.3"})
+        layer.setRenderer(QgsSingleSymbolRenderer(symbol))
+        if add_to_project:
+            _remove_layer_by_name(name)
+            QgsProject.instance().addMapLayer(layer)
+    t_layer = time.perf_counter()
+
+    print(f"{len(pairs)} overlapping pairs, {len(flagged)} buildings flagged "
+          f"(query {t_query - t0:.2f}s, areas {t_area - t_query:.2f}s, layer {t_layer - t_area:.2f}s)")
+    return pairs, crossing_buildings, layer
+
+#- building types of the BVPC groups (notebook section 2 b)
+BVPC_GROUPS = {
+    "formal": ['house', 'semidetached_house', 'terrace', 'terraced', 'apartments'],
+    "informal": ['residential', 'cabin'],
+    "student": ['student', 'dormitory'],
+}
+
+#- the rules live in city3D_kernels (testable without QGIS); profiled as a stage here
+estimate_population = _profiled(estimate_population)
+
+@_profiled
+def bvpc(gdf, pop, height='building_height'):
+    """
+    Building Volume Per Capita. Volume = footprint area * height, less the ground
+    floor (area * 2.8) of residential/apartments/student buildings over 7 levels
+    that are not a social_facility. gdf must be in a projected CRS (metres).
+
+    Returns (frame, summary):
+        frame: area, volume and bvpc per building (NaN where pop is 0) on gdf's index
+        summary: population, bvpc (all buildings) and the formal / informal / student BVPC
+    """
+    pop = pd.Series(np.asarray(pop, dtype=float), index=gdf.index)
+    b = _population_building(gdf)
+    area = gdf.geometry.area
+    volume = area.astype(float) * gdf[height].astype(float)
+
+    levels = _numeric(gdf, 'building:levels') if 'building:levels' in gdf.columns else np.zeros(len(gdf))
+    no_facility = (pd.isna(gdf['social_facility']).to_numpy() if 'social_facility' in gdf.columns
+                   else np.ones(len(gdf), dtype=bool))
+    ground_floor = no_facility & (levels > 7) & np.isin(b, ['residential', 'apartments', 'student'])
+    volume = volume.where(~ground_floor, volume - area * 2.8)
+
+    frame = pd.DataFrame({
+        'area': area,
+        'volume': volume,
+        'bvpc': np.where(pop > 0, volume / pop, np.nan)
+    }, index=gdf.index)
+
+    def ratio(mask):
+        total = pop[mask].sum()
+        return float(round(volume[mask].sum() / total if total != 0 else 0, 3))
+
+    est_pop = int(pop.sum())
+    summary = {"population": est_pop, "bvpc": float(round(volume.sum() / est_pop, 3)) if est_pop else 0.0}
+    summary.update({group: ratio(np.isin(b, types)) for group, types in BVPC_GROUPS.items()})
+    return frame, summary
+
+#- bundled long-term annual GHI (kWh/m2/year, Global Solar Atlas / Solargis, ~900 m cells)
+GHI_RASTER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "raster", "GHI.tif")
+
+class _BlockReader:
+    """
+    Samples a raster band at pixel positions, reading each native block once
+    and keeping the most recently used blocks (max_blocks) in memory.
+    """
+    def __init__(self, band, max_blocks=256):
+        self.band = band
+        self.bw, self.bh = band.GetBlockSize()
+        self.nodata = band.GetNoDataValue()
+        self.scale = band.GetScale() or 1.0
+        self.offset = band.GetOffset() or 0.0
+        self.max_blocks = max_blocks
+        self.cache = OrderedDict()
+        self.reads = 0
+
+    def _block(self, bx, by):
+        key = (bx, by)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        xoff, yoff = bx * self.bw, by * self.bh
+        data = self.band.ReadAsArray(xoff, yoff, min(self.bw, self.band.XSize - xoff),
+                                     min(self.bh, self.band.YSize - yoff)).astype(float)
+        if self.nodata is not None:
+            data[data == self.nodata] = np.nan
+        self.cache[key] = data * self.scale + self.offset
+        self.reads += 1
+        if len(self.cache) > self.max_blocks:
+            self.cache.popitem(last=False)
+        return self.cache[key]
+
+    def sample(self, cols, rows):
+        """Values at integer pixel (col, row); NaN outside the raster or on nodata."""
+        cols, rows = np.asarray(cols, dtype=np.int64), np.asarray(rows, dtype=np.int64)
+        values = np.full(len(cols), np.nan)
+        inside = (cols >= 0) & (rows >= 0) & (cols < self.band.XSize) & (rows < self.band.YSize)
+        bx, by = cols // self.bw, rows // self.bh
+        nbx = -(-self.band.XSize // self.bw)
+        block_id = np.where(inside, by * nbx + bx, -1)
+        for b in np.unique(block_id[inside]):
+            m = block_id == b
+            block = self._block(int(b % nbx), int(b // nbx))
+            values[m] = block[rows[m] - (b // nbx) * self.bh, cols[m] - (b % nbx) * self.bw]
+        return values
+
+@_profiled
+def sample_ghi(gdf_buildings, raster_path=GHI_RASTER, method="nearest", max_blocks=256):
+    """
+    Long-term annual GHI (kWh/m2/year) on every roof, from a local raster
+    (default: the bundled raster/GHI.tif) -- offline, no request per building.
+
+    Each building's representative point is projected to the raster CRS and
+    looked up in one vectorized pass; only the raster blocks under the
+    buildings are read, each once (block cache of max_blocks blocks).
+    method: "nearest" (the cell under the roof) or "bilinear" (smooths the
+    ~900 m cells). Footprints are far smaller than a cell, so a zonal mean over
+    the footprint equals the nearest value and is not offered separately.
+    Returns a float array aligned with the rows (NaN outside the raster / nodata).
+    """
+    if method not in ("nearest", "bilinear"):
+        raise ValueError("method must be 'nearest' or 'bilinear'")
+    t0 = time.perf_counter()
+    gdal.UseExceptions()
+    ds = gdal.Open(raster_path)
+    reader = _BlockReader(ds.GetRasterBand(1), max_blocks)
+
+    points = shapely.point_on_surface(np.asarray(gdf_buildings.geometry))
+    x, y = shapely.get_x(points), shapely.get_y(points)
+    raster_crs = pyproj.CRS.from_wkt(ds.GetProjection())
+    if gdf_buildings.crs is not None and pyproj.CRS(gdf_buildings.crs) != raster_crs:
+        x, y = pyproj.Transformer.from_crs(gdf_buildings.crs, raster_crs, always_xy=True).transform(x, y)
+
+    # inverse geotransform (north-up raster): fractional pixel coordinates
+    ox, px, _, oy, _, py = ds.GetGeoTransform()
+    fc, fr = (np.asarray(x) - ox) / px, (np.asarray(y) - oy) / py
+
+    if method == "nearest":
+        ghi = reader.sample(np.floor(fc), np.floor(fr))
+    else:
+        c0, r0 = np.floor(fc - 0.5), np.floor(fr - 0.5)
+        dc, dr = fc - 0.5 - c0, fr - 0.5 - r0
+        ghi = (reader.sample(c0, r0) * (1 - dc) * (1 - dr) + reader.sample(c0 + 1, r0) * dc * (1 - dr)
+               + reader.sample(c0, r0 + 1) * (1 - dc) * dr + reader.sample(c0 + 1, r0 + 1) * dc * dr)
+        # next to nodata / the raster edge: fall back to the cell under the roof
+        missing = np.isnan(ghi)
+        ghi[missing] = reader.sample(np.floor(fc[missing]), np.floor(fr[missing]))
+    ds = None
+
+    print(f"GHI for {len(ghi)} roofs from {reader.reads} block read(s) in {time.perf_counter() - t0:.2f}s")
+    return ghi
+
+@_profiled
+def solar_mwh(gdf_buildings, utilization_factor=0.4, ghi=None, efficiency=0.20):
+    """
+    Annual solar potential per roof (MWh/year) = area * utilization_factor * GHI * efficiency / 1000.
+    ghi: per-roof values (default: sample_ghi) or one value for the whole AOI.
+    Area is the 'area' column if present, otherwise the footprint area (projected CRS).
+    """
+    ghi = sample_ghi(gdf_buildings) if ghi is None else ghi
+    area = gdf_buildings['area'] if 'area' in gdf_buildings.columns else gdf_buildings.geometry.area
+    return (((area * utilization_factor) * ghi * efficiency) / 1000).rename('solar_mwh')
+
+#- edit revision of a layer: bumped by the bulk writers in this module and on every commit
+_REVISION_PROPERTY = "geo3D/revision"
+_TRACKING_FLAG = "geo3D_tracked"     # dynamic Qt property: not saved, survives importlib.reload
+_GPKG_MANIFEST = "geo3d_manifest"
+
+#- OSM timestamp of the data a layer holds (see update_osm); GeoPackage tables keep it as metadata
+_OSM_BASE_PROPERTY = "geo3D/osm_base"
+_GPKG_OSM_BASE = "GEO3D_OSM_BASE"
+
+_OGR_FIELD_TYPES = {     # names of the OGR field types (osgeo loads on first use)
+    QVariant.Int: "OFTInteger",
+    QVariant.UInt: "OFTInteger64",
+    QVariant.LongLong: "OFTInteger64",
+    QVariant.ULongLong: "OFTInteger64",
+    QVariant.Double: "OFTReal",
+    QVariant.Bool: "OFTInteger",
+    QVariant.Date: "OFTDate",
+    QVariant.Time: "OFTTime",
+    QVariant.DateTime: "OFTDateTime",
+}
+
+def _bump_revision(layer):
+    """Marks a layer as edited so the next incremental GeoPackage save rewrites it."""
+    layer.setCustomProperty(_REVISION_PROPERTY, int(layer.customProperty(_REVISION_PROPERTY, 0)) + 1)
+
+def _track_revisions(layer):
+    """Bumps the revision on every commit made in QGIS (edit sessions, field calculator)."""
+    if layer.type() == QgsMapLayer.VectorLayer and not layer.property(_TRACKING_FLAG):
+        layer.afterCommitChanges.connect(lambda: _bump_revision(layer))
+        layer.setProperty(_TRACKING_FLAG, True)
+
+def _track_added_layers(layers):
+    for layer in layers:
+        _track_revisions(layer)
+
+def _track_project_layers():
+    """Tracks the layers in the project and, from now on, every layer added to it (once per session)."""
+    project = QgsProject.instance()
+    _track_added_layers(project.mapLayers().values())
+    if not project.property(_TRACKING_FLAG):
+        project.layersAdded.connect(_track_added_layers)
+        project.setProperty(_TRACKING_FLAG, True)
+
+def _source_stamp(layer, skip=None):
+    """[size, mtime] of a file-backed layer's file (not skip): catches commits made before tracking began."""
+    path = QgsProviderRegistry.instance().decodeUri(layer.providerType(), layer.source()).get("path")
+    if path and os.path.isfile(path) and not (skip and os.path.exists(skip) and os.path.samefile(path, skip)):
+        return [os.path.getsize(path), os.path.getmtime(path)]
+    return None
+
+def _layer_fingerprint(layer, target_crs, gpkg_path=None):
+    """Feature count, extent, schema, source (and its file stamp) and edit revision -> short hash."""
+    state = [
+        layer.source(), _source_stamp(layer, gpkg_path), layer.crs().authid(), target_crs.authid(),
+        layer.featureCount(), layer.extent().toString(12),
+        [(f.name(), f.typeName()) for f in layer.fields()],
+        int(layer.customProperty(_REVISION_PROPERTY, 0)),
+    ]
+    return hashlib.sha256(json.dumps(state).encode("utf-8")).hexdigest()[:16]
+
+def _gpkg_manifest(ds, create=False):
+    """Returns (manifest layer or None, {table: (fid, fingerprint)}); create: add the table if missing."""
+    lyr = ds.GetLayerByName(_GPKG_MANIFEST)
+    if lyr is None:
+        if not create:
+            return None, {}
+        lyr = ds.CreateLayer(_GPKG_MANIFEST, geom_type=ogr.wkbNone)
+        lyr.CreateField(ogr.FieldDefn("table_name", ogr.OFTString))
+        lyr.CreateField(ogr.FieldDefn("fingerprint", ogr.OFTString))
+    entries = {f.GetField("table_name"): (f.GetFID(), f.GetField("fingerprint")) for f in lyr}
+    return lyr, entries
+
+def _delete_gpkg_table(ds, table):
+    for i in range(ds.GetLayerCount()):
+        if ds.GetLayerByIndex(i).GetName() == table:
+            ds.DeleteLayer(i)
+            return
+
+def _create_gpkg_table(ds, table, layer, srs):
+    """Creates an empty table matching the layer schema; the spatial index is deferred."""
+    if layer.isSpatial():
+        gtype = int(QgsWkbTypes.flatType(layer.wkbType()))
+        if QgsWkbTypes.hasZ(layer.wkbType()):
+            gtype = ogr.GT_SetZ(gtype)
+    else:
+        gtype = ogr.wkbNone
+    out = ds.CreateLayer(table, srs if layer.isSpatial() else None, gtype,
+                         options=["SPATIAL_INDEX=NO", "GEOMETRY_NAME=geom"])
+    for field in layer.fields():
+        defn = ogr.FieldDefn(field.name(), getattr(ogr, _OGR_FIELD_TYPES.get(field.type(), "OFTString")))
+        if field.type() == QVariant.Bool:
+            defn.SetSubType(ogr.OFSTBoolean)
+        out.CreateField(defn)
+    osm_base = layer.customProperty(_OSM_BASE_PROPERTY)
+    if osm_base:
+        out.SetMetadataItem(_GPKG_OSM_BASE, str(osm_base))
+    return out
+
+def _copy_features(layer, out, xform):
+    """Inserts every feature of a QGIS layer into an OGR layer; returns the count."""
+    names = layer.fields().names()
+    defn = out.GetLayerDefn()
+    n = 0
+    for feat in layer.getFeatures():
+        ogr_feat = ogr.Feature(defn)
+        geom = feat.geometry()
+        if geom is not None and not geom.isEmpty() and defn.GetGeomType() != ogr.wkbNone:
+            if xform is not None:
+                geom.transform(xform)
+            ogr_feat.SetGeometry(ogr.CreateGeometryFromWkb(bytes(geom.asWkb())))
+        for i, name in enumerate(names):
+            value = _json_value(feat[name])
+            if value is None:
+                continue
+            if isinstance(value, (list, dict)):
+                value = json.dumps(value)
+            elif isinstance(value, bool):
+                value = int(value)
+            ogr_feat.SetField(i, value)
+        out.CreateFeature(ogr_feat)
+        n += 1
+    return n
+
+def _write_geopackage(gpkg_path, target_crs_string):
+    """Full save: the file is recreated and every vector layer written with QgsVectorFileWriter."""
     if os.path.exists(gpkg_path):
         try:
             os.remove(gpkg_path)
             print(f"Cleared existing file: {gpkg_path}")
         except Exception as e:
             print(f"File locked: {e}")
-            return
+            return None
 
     options = QgsVectorFileWriter.SaveVectorOptions()
     options.driverName = "GPKG"
@@ -965,6 +2881,7 @@ def save_to_geopackage(gpkg_path, target_crs_string):
     
     # Flag to track if the GPKG file has been created yet
     file_created = False
+    osm_bases, n = {}, 0
     
     for layer in QgsProject.instance().mapLayers().values():
         # Only process vector layers
@@ -985,5 +2902,584 @@ def save_to_geopackage(gpkg_path, target_crs_string):
             
             if error == QgsVectorFileWriter.NoError:
                 print(f"✅ Exported: {layer.name()}")
+                n += layer.featureCount()
+                if layer.customProperty(_OSM_BASE_PROPERTY):
+                    osm_bases[options.layerName] = str(layer.customProperty(_OSM_BASE_PROPERTY))
             else:
-                print(f"❌ Failed {layer.name()}: {message}")
\ No newline at end of file
+                print(f"❌ Failed {layer.name()}: {message}")
+
+    # harvest timestamps for update_osm
+    if osm_bases:
+        ds = ogr.Open(gpkg_path, 1)
+        for table, osm_base in osm_bases.items():
+            ds.GetLayerByName(table).SetMetadataItem(_GPKG_OSM_BASE, osm_base)
+        ds = None
+    _profile_out(n)
+    return gpkg_path if file_created else None
+
+@_profiled
+def save_to_geopackage(gpkg_path, target_crs_string, incremental=False):
+    """
+    Saves every vector layer in the project as a table of gpkg_path (CRS target_crs_string).
+
+    incremental=False -> the file is recreated and every layer written with
+                         QgsVectorFileWriter (original behaviour).
+    incremental=True  -> layers are fingerprinted (feature count, extent, schema, source,
+                         edit revision); only changed tables are rewritten and tables of
+                         layers no longer in the project are dropped. The fingerprints are
+                         kept in a manifest table; a table is only listed there once its
+                         rows are committed, so an interrupted save is redone next time.
+                         Inserts run in one transaction and spatial indexes are built after loading.
+    """
+    t0 = time.perf_counter()
+    size_before = os.path.getsize(gpkg_path) if incremental and os.path.exists(gpkg_path) else 0
+    gdal.UseExceptions()
+    _track_project_layers()
+    if not incremental:
+        result = _write_geopackage(gpkg_path, target_crs_string)
+        if result:
+            _profile_bytes(written=os.path.getsize(gpkg_path))
+            print(f"GeoPackage saved in {time.perf_counter() - t0:.2f}s -> {gpkg_path}")
+        return result
+
+    target_crs = QgsCoordinateReferenceSystem(target_crs_string)
+    srs = osr.SpatialReference()
+    srs.SetFromUserInput(target_crs_string)
+    srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+    # 1. Fingerprint project layers (table name as before: lower case, no spaces)
+    layers = {}
+    for layer in QgsProject.instance().mapLayers().values():
+        if layer.type() == QgsMapLayer.VectorLayer:
+            layers[layer.name().replace(" ", "_").lower()] = layer
+
+    if os.path.exists(gpkg_path):
+        ds = ogr.Open(gpkg_path, 1)
+    else:
+        ds = ogr.GetDriverByName("GPKG").CreateDataSource(gpkg_path)
+    manifest, entries = _gpkg_manifest(ds)
+
+    fingerprints = {table: _layer_fingerprint(layer, target_crs, gpkg_path) for table, layer in layers.items()}
+    changed = [t for t in layers
+               if entries.get(t, (None, None))[1] != fingerprints[t] or ds.GetLayerByName(t) is None]
+    stale = [t for t in entries if t not in layers]
+    for table in layers:
+        if table not in changed:
+            print(f"⏩ Unchanged: {layers[table].name()}")
+    if not changed and not stale:
+        ds = None
+        return gpkg_path
+
+    # 2. Forget the tables being replaced (committed before any table is touched),
+    #    then drop and recreate them
+    ds.StartTransaction()
+    if manifest is None:
+        manifest, _ = _gpkg_manifest(ds, create=True)
+    for table in changed + stale:
+        if table in entries:
+            manifest.DeleteFeature(entries[table][0])
+    ds.CommitTransaction()
+    for table in changed + stale:
+        _delete_gpkg_table(ds, table)
+    outputs = {table: _create_gpkg_table(ds, table, layers[table], srs) for table in changed}
+
+    # 3. Bulk inserts + manifest entries in one transaction
+    context = QgsProject.instance().transformContext()
+    counts = {}
+    ds.StartTransaction()
+    try:
+        for table, out in outputs.items():
+            layer = layers[table]
+            xform = None
+            if layer.isSpatial() and layer.crs() != target_crs:
+                xform = QgsCoordinateTransform(layer.crs(), target_crs, context)
+            counts[table] = _copy_features(layer, out, xform)
+            entry = ogr.Feature(manifest.GetLayerDefn())
+            entry.SetField("table_name", table)
+            entry.SetField("fingerprint", fingerprints[table])
+            manifest.CreateFeature(entry)
+        ds.CommitTransaction()
+    except Exception as e:
+        ds.RollbackTransaction()
+        ds = None
+        print(f"❌ Failed, nothing committed (the tables are rewritten on the next save): {e}")
+        return None
+
+    # 4. Spatial indexes once the tables are loaded
+    for table, out in outputs.items():
+        if out.GetGeomType() != ogr.wkbNone:
+            ds.ReleaseResultSet(ds.ExecuteSQL(f"SELECT CreateSpatialIndex('{table}', 'geom')"))
+        print(f"✅ Exported: {layers[table].name()} ({counts[table]} features)")
+    for table in stale:
+        print(f"🗑️ Dropped: {table}")
+    ds = None
+    _profile_bytes(written=max(0, os.path.getsize(gpkg_path) - size_before))
+    _profile_out(sum(counts.values()))
+
+    print(f"GeoPackage saved in {time.perf_counter() - t0:.2f}s -> {gpkg_path}")
+    return gpkg_path
+
+#- columns update_osm leaves alone: ids, and what process3D, ground_heights and the solar join derive
+_NON_TAG_FIELDS = {name for name, _ in _PROCESS3D_SCHEMA if name not in BUILDING_TAGS} | {
+    'osm_id', 'osm_type', 'osm_way_id', 'other_tags', 'mean', 'ground_min', 'ground_max',
+    'has_solar', 'solar_ids', 'solar_method', 'ghi', 'solar_mwh'}
+
+def _is_building(el):
+    tags = el.get("tags", {})
+    return "building" in tags and (el["type"] == "way" or tags.get("type") == "multipolygon")
+
+def _xml_points(parent):
+    return [{"lat": float(nd.get("lat")), "lon": float(nd.get("lon"))}
+            for nd in parent.findall("nd") if nd.get("lat") is not None]
+
+def _osm_xml_element(node):
+    """
+    An OSM XML node/way/relation as an Overpass JSON element. Ways keep their
+    node refs ('nodes'); coordinates from `out geom` become 'geometry'.
+    """
+    el = {"type": node.tag, "id": int(node.get("id")),
+          "tags": {t.get("k"): t.get("v") for t in node.findall("tag")}}
+    if node.get("timestamp"):
+        el["timestamp"] = node.get("timestamp")
+    if node.tag == "node":
+        if node.get("lat") is not None:
+            el["lat"], el["lon"] = float(node.get("lat")), float(node.get("lon"))
+    elif node.tag == "way":
+        el["nodes"] = [int(nd.get("ref")) for nd in node.findall("nd")]
+        points = _xml_points(node)
+        if points:
+            el["geometry"] = points
+    else:
+        el["members"] = []
+        for m in node.findall("member"):
+            member = {"type": m.get("type"), "ref": int(m.get("ref")), "role": m.get("role", "")}
+            points = _xml_points(m)
+            if points:
+                member["geometry"] = points
+            el["members"].append(member)
+    return el
+
+def _new_changes(timestamp=None):
+    return {"upsert": {}, "delete": set(), "timestamp": timestamp}
+
+def _record_change(changes, el, deleted=False):
+    """Later actions on an element replace earlier ones; a building that lost its tags is a deletion."""
+    key = (el["type"], str(el["id"]))
+    if deleted or not _is_building(el):
+        changes["upsert"].pop(key, None)
+        changes["delete"].add(key)
+    else:
+        changes["delete"].discard(key)
+        changes["upsert"][key] = el
+
+@_profiled
+def read_osc(path):
+    """
+    Reads an OSM change file (.osc or .osc.gz, e.g. a replication diff of a
+    regional extract) in one streaming pass.
+
+    Returns {"upsert": {(type, id): element}, "delete": {(type, id)}, "timestamp": newest edit}
+    plus what the file knows about geometry: node positions, way node refs, moved
+    nodes and modified non-building ways. The geometry of the buildings is completed
+    when the changes are applied (see _resolve_osc).
+    """
+    changes = _new_changes()
+    changes.update(nodes={}, ways={}, moved=set(), other_ways=set())
+    action = None
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        for event, node in ET.iterparse(f, events=("start", "end")):
+            if node.tag in ("create", "modify", "delete"):
+                action = node.tag if event == "start" else None
+                if event == "end":
+                    node.clear()
+                continue
+            if event != "end" or action is None or node.tag not in ("node", "way", "relation"):
+                continue
+            el = _osm_xml_element(node)
+            node.clear()
+            if el.get("timestamp") and (changes["timestamp"] is None or el["timestamp"] > changes["timestamp"]):
+                changes["timestamp"] = el["timestamp"]
+
+            if el["type"] == "node":
+                if action != "delete" and "lat" in el:
+                    changes["nodes"][el["id"]] = (el["lon"], el["lat"])
+                    if action == "modify":
+                        changes["moved"].add(el["id"])
+                continue
+            if el["type"] == "way" and action != "delete":
+                changes["ways"][el["id"]] = el["nodes"]
+            if action == "create" and not _is_building(el):
+                continue
+            if action == "modify" and el["type"] == "way" and not _is_building(el):
+                changes["other_ways"].add(el["id"])    # may be part of a building relation
+            _record_change(changes, el, deleted=action == "delete")
+    return changes
+
+@_profiled
+def overpass_changes(large, focus, since):
+    """
+    Buildings created, modified and deleted in the focus area since an OSM
+    timestamp ("2026-01-01T00:00:00Z"), from one Overpass augmented diff.
+    An adiff rather than a (newer:...) filter, which cannot report deletions.
+    Returns the same shape as read_osc; "timestamp" is the server's data timestamp.
+    """
+    settings = f'[out:xml][timeout:180][adiff:"{since}"]'
+    query = f"{_area_header(large, focus, settings)}{_theme_union('buildings')};out geom;"
+    root = ET.fromstring(_fetch_overpass(query, cache=False, raw=True))
+    remark = root.findtext("remark")
+    if remark and "runtime error" in remark:
+        raise RuntimeError(f"Overpass: {remark.strip()}")
+    meta = root.find("meta")
+    changes = _new_changes(meta.get("osm_base") if meta is not None else None)
+
+    for action in root.iter("action"):
+        kind = action.get("type")
+        holder = action if kind == "create" else action.find("new")
+        if holder is None:
+            holder = action.find("old")
+        node = next((c for c in holder if c.tag in ("way", "relation")), None) if holder is not None else None
+        if node is None:
+            continue
+        _record_change(changes, _osm_xml_element(node), deleted=kind == "delete" or node.get("visible") == "false")
+    return changes
+
+def _in_extent(extent, points):
+    """True if any (lon, lat) lies inside the QgsRectangle (always when extent is None)."""
+    if extent is None:
+        return True
+    return any(extent.xMinimum() <= x <= extent.xMaximum() and extent.yMinimum() <= y <= extent.yMaximum()
+               for x, y in points)
+
+def _resolve_osc(changes, extent, index, fetch=True, chunk=200):
+    """
+    Completes the geometry of change-file buildings: from the nodes in the file
+    where it has them all, else from Overpass (current state), in chunked id
+    queries. Buildings whose nodes moved or whose member ways changed are fetched
+    too. Only elements already in the layer (index) or with a node inside extent
+    are looked up, so a regional diff costs as much as the area's edits.
+    Returns the number of buildings left without (complete) geometry; they are dropped.
+    """
+    nodes, ways, upsert = changes["nodes"], changes["ways"], changes["upsert"]
+
+    def incomplete(el):
+        if el["type"] == "way":
+            return "geometry" not in el
+        return not el["members"] or any("geometry" not in m for m in el["members"] if m["type"] == "way")
+
+    def geometry(refs):
+        if refs and all(n in nodes for n in refs):
+            return [{"lat": nodes[n][1], "lon": nodes[n][0]} for n in refs]
+        return None
+
+    def nearby(refs):
+        return _in_extent(extent, [nodes[n] for n in refs if n in nodes])
+
+    missing = {"way": set(), "relation": set()}
+    for key, el in list(upsert.items()):
+        if el["type"] == "way":
+            refs = el.get("nodes", [])
+            if "geometry" not in el and geometry(refs):
+                el["geometry"] = geometry(refs)
+        else:
+            refs = [n for m in el["members"] for n in ways.get(m["ref"], [])]
+            for m in el["members"]:
+                if m["type"] == "way" and "geometry" not in m and geometry(ways.get(m["ref"])):
+                    m["geometry"] = geometry(ways[m["ref"]])
+        if not incomplete(el):
+            continue
+        if key in index or nearby(refs):
+            missing[el["type"]].add(el["id"])
+        else:
+            del upsert[key]        # outside the area and not in the layer
+
+    covered = {n for el in upsert.values() for n in el.get("nodes", ())}
+    moved = {n for n in changes["moved"] - covered if _in_extent(extent, [nodes[n]])}
+    members = {w for w in changes["other_ways"] if nearby(ways.get(w, []))}
+
+    groups = [("way(id:{})", missing["way"]), ("relation(id:{})", missing["relation"]),
+              ('node(id:{});way(bn)["building"]', moved),
+              ('way(id:{});relation(bw)["building"]["type"="multipolygon"]', members)]
+    queries = {}
+    for template, ids in groups:
+        ids = sorted(ids)
+        for i in range(0, len(ids), chunk):
+            statement = template.format(",".join(map(str, ids[i:i + chunk])))
+            queries[len(queries)] = f"[out:json][timeout:180];({statement};);out geom;"
+    if fetch and queries:
+        for data in OverpassBatch(queries, cache=False, progress=None).wait().values():
+            for el in data.get("elements", []):
+                if el.get("type") not in ("way", "relation"):
+                    continue
+                key = (el["type"], str(el["id"]))
+                if key in changes["delete"]:
+                    continue           # deleted in the change file
+                if _is_building(el) or key in upsert:
+                    _record_change(changes, el)
+
+    unresolved = [key for key, el in upsert.items() if incomplete(el)]
+    for key in unresolved:
+        del upsert[key]
+    return len(unresolved)
+
+def _osm_fids(layer, ids, chunk=1000):
+    """
+    {(osm type, osm id): [feature ids]} of the features carrying one of ids.
+    Up to chunk ids go to the provider as one filter expression (SQL in a
+    GeoPackage, where update_osm indexes osm_id); more are matched in a single
+    attribute-only pass. The type comes from osm_type, else from osm_way_id
+    (PBF layers: set for ways only).
+    """
+    index = {}
+    ids = {str(i) for i in ids}
+    if not ids:
+        return index
+    fields = layer.fields()
+    names = fields.names()
+    id_fields = [n for n in ("osm_id", "osm_way_id") if n in names]
+    read = id_fields + (["osm_type"] if "osm_type" in names else [])
+    request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry).setSubsetOfAttributes(read, fields)
+    if len(ids) <= chunk:
+        listed = ",".join(QgsExpression.quotedValue(i) for i in sorted(ids))
+        request.setFilterExpression(" OR ".join(f"{QgsExpression.quotedColumnRef(n)} IN ({listed})" for n in id_fields))
+
+    for feat in layer.getFeatures(request):
+        way_id = feat["osm_way_id"] if "osm_way_id" in names else NULL
+        osm_id = feat["osm_id"]
+        if QgsVariantUtils.isNull(osm_id):
+            osm_id = way_id
+        if QgsVariantUtils.isNull(osm_id) or str(osm_id) not in ids:
+            continue
+        if "osm_type" in names:
+            types = (str(feat["osm_type"]),)
+        elif "osm_way_id" in names:
+            types = ("relation",) if QgsVariantUtils.isNull(way_id) else ("way",)
+        else:
+            types = ("way", "relation")
+        for t in types:
+            index.setdefault((t, str(osm_id)), []).append(feat.id())
+    return index
+
+def _hstore(tags):
+    """hstore text as in the GDAL OSM driver's other_tags."""
+    if not tags:
+        return None
+    return ",".join('"{}"=>"{}"'.format(k.replace('"', '\\"'), str(v).replace('"', '\\"')) for k, v in tags.items())
+
+def _tag_value(field, value):
+    if value is None:
+        return None
+    try:
+        if field.type() in (QVariant.Int, QVariant.LongLong):
+            return int(value)
+        if field.type() == QVariant.Double:
+            return float(value)
+    except ValueError:
+        return None
+    return value
+
+@_profiled
+def apply_osm_changes(layer, changes, extent=None, fetch=True, recompute=True, code_length=11, dem=None, keep=()):
+    """
+    Applies building changes (read_osc / overpass_changes) to a building layer in
+    place, through bulk provider calls: deleted buildings are removed, modified
+    ones get their new geometry and tags, created ones are added when they lie
+    in extent (QgsRectangle, EPSG:4326; None = anywhere). Only the touched
+    features are recomputed (process3D / ground_heights with fids=).
+
+    Every column other than the ids, the derived ones (process3D, ground_heights,
+    the solar join) and keep is a tag column: set from the element's tags, NULL
+    where the key is gone. Keys without a column go to other_tags if the layer has it.
+    Returns {"created", "modified", "deleted", "skipped", "outside", "seconds"}.
+    """
+    if not layer or not layer.isValid():
+        return None
+    t0 = time.perf_counter()
+    if layer.isEditable() and not layer.commitChanges():
+        return None
+    fields = layer.fields()
+    names = fields.names()
+    if "osm_id" not in names:
+        raise ValueError(f"{layer.name()} has no osm_id column")
+
+    # --- 1. keyed lookup of the touched features; change files are completed first ---
+    upsert, delete = changes["upsert"], changes["delete"]
+    looked_up = {k[1] for k in list(upsert) + list(delete)}
+    index = _osm_fids(layer, looked_up)
+    skipped = outside = 0
+    if "nodes" in changes:
+        skipped = _resolve_osc(changes, extent, index, fetch)
+        more = {k[1] for k in list(upsert) + list(delete)} - looked_up
+        index.update(_osm_fids(layer, more))
+
+    # --- 2. geometry (EPSG:4326 -> layer) and tag columns per element ---
+    wgs84 = QgsCoordinateReferenceSystem("EPSG:4326")
+    xform = None
+    if layer.crs() != wgs84:
+        xform = QgsCoordinateTransform(wgs84, layer.crs(), QgsProject.instance())
+    multi = QgsWkbTypes.isMultiType(layer.wkbType())
+    skip = _NON_TAG_FIELDS | set(keep) | {names[i] for i in layer.dataProvider().pkAttributeIndexes()}
+    tag_idx = {i: name for i, name in enumerate(names) if name not in skip}
+    other_idx = fields.indexFromName("other_tags")
+    ids = {name: fields.indexFromName(name) for name in ("osm_id", "osm_type", "osm_way_id") if name in names}
+
+    deleted = [fid for key in delete for fid in index.get(key, ())]
+    geometries, attributes, new_features = {}, {}, []
+    for key, el in upsert.items():
+        geom = _overpass_geometry(el, "Polygon")
+        if geom is None:
+            skipped += 1
+            continue
+        fids = index.get(key)
+        if not fids and extent is not None and not geom.boundingBox().intersects(extent):
+            outside += 1
+            continue
+        if xform is not None:
+            geom.transform(xform)
+        if multi:
+            geom.convertToMultiType()
+
+        tags = el.get("tags", {})
+        values = {i: _tag_value(fields.at(i), tags.get(name)) for i, name in tag_idx.items()}
+        if other_idx >= 0:
+            values[other_idx] = _hstore({k: v for k, v in tags.items() if k not in names})
+        if fids:
+            for fid in fids:
+                geometries[fid] = geom
+                attributes[fid] = values
+            continue
+        attrs = [None] * len(fields)
+        for i, v in values.items():
+            attrs[i] = v
+        for name, v in (("osm_id", str(el["id"])), ("osm_type", el["type"]),
+                        ("osm_way_id", str(el["id"]) if el["type"] == "way" else None)):
+            if name in ids:
+                attrs[ids[name]] = v
+        feat = QgsFeature(fields)
+        feat.setGeometry(geom)
+        feat.setAttributes(attrs)
+        new_features.append(feat)
+
+    # --- 3. bulk provider writes ---
+    pr = layer.dataProvider()
+    new_fids = []
+    with profile_stage("attribute write", len(deleted) + len(geometries) + len(new_features)):
+        if deleted and not pr.deleteFeatures(deleted):
+            return None
+        if geometries and not (pr.changeGeometryValues(geometries) and pr.changeAttributeValues(attributes)):
+            return None
+        if new_features:
+            ok, added = pr.addFeatures(new_features)
+            if not ok:
+                return None
+            new_fids = [f.id() for f in added]
+
+    # --- 4. derived fields of the touched features only ---
+    touched = list(geometries) + new_fids
+    if recompute and touched:
+        if "building_height" in names:
+            process3D(layer, code_length=code_length, dem=dem, fids=touched)
+        elif dem is not None:
+            ground_heights(layer, dem, fids=touched)
+
+    osm_base = changes.get("timestamp")
+    previous = layer.customProperty(_OSM_BASE_PROPERTY)
+    if osm_base and (not previous or osm_base > str(previous)):
+        layer.setCustomProperty(_OSM_BASE_PROPERTY, osm_base)
+    if deleted or touched or layer.customProperty(_OSM_BASE_PROPERTY) != previous:
+        _bump_revision(layer)
+    layer.updateExtents()
+    layer.triggerRepaint()
+    _profile_out(len(touched) + len(deleted))
+
+    summary = {"created": len(new_fids), "modified": len(geometries), "deleted": len(deleted),
+               "skipped": skipped, "outside": outside, "seconds": round(time.perf_counter() - t0, 3)}
+    print(f"OSM update of {layer.name()}: {summary['created']} created, {summary['modified']} modified, "
+          f"{summary['deleted']} deleted ({skipped} without geometry, {outside} outside) in {summary['seconds']:.2f}s")
+    return summary
+
+def _gpkg_building_table(gpkg_path):
+    """The one buildings table of a GeoPackage written by save_to_geopackage."""
+    ds = ogr.Open(gpkg_path)
+    tables = [ds.GetLayerByIndex(i) for i in range(ds.GetLayerCount())]
+    found = [t.GetName() for t in tables if t.GetName().startswith("buildings")
+             and t.GetLayerDefn().GetFieldIndex("osm_id") >= 0]
+    ds = None
+    if len(found) != 1:
+        raise ValueError(f"Pass table=: buildings tables in {gpkg_path}: {found or 'none'}")
+    return found[0]
+
+def _gpkg_osm_base(gpkg_path, table, osm_base=None):
+    """Reads (or with osm_base, writes) a table's harvest timestamp; also indexes osm_id for the keyed lookup."""
+    ds = ogr.Open(gpkg_path, 1)
+    lyr = ds.GetLayerByName(table)
+    if lyr is None:
+        ds = None
+        raise ValueError(f"No table {table} in {gpkg_path}")
+    if osm_base:
+        lyr.SetMetadataItem(_GPKG_OSM_BASE, osm_base)
+    else:
+        osm_base = lyr.GetMetadataItem(_GPKG_OSM_BASE)
+        ds.ExecuteSQL(f'CREATE INDEX IF NOT EXISTS "{table}_osm_id_idx" ON "{table}" ("osm_id")')
+    ds = None
+    return osm_base
+
+@_profiled
+def update_osm(target, osc=None, large=None, focus=None, since=None, table=None, aoi=None,
+               fetch=True, recompute=True, code_length=11, dem=None, keep=()):
+    """
+    Brings a harvested building layer up to date with OSM without harvesting
+    again: only the created, modified and deleted buildings are written and
+    recomputed, so the cost follows the number of edits, not the city size.
+
+    target: a building layer (edited in place), or the path of a GeoPackage
+            from save_to_geopackage (table: its buildings table, found if only one).
+    osc:    an OSM change file (.osc/.osc.gz). Buildings are kept to the extent of
+            aoi (a layer) or of the target; ways the file has no node positions for,
+            and buildings whose nodes moved, are fetched from Overpass (fetch=False: skipped).
+    large/focus: without osc, an Overpass augmented diff of the focus area since
+            `since` (default: the timestamp the layer was harvested at).
+    recompute, code_length, dem: derived fields of the touched buildings (see process3D).
+    keep:   further columns that are not OSM tags (left untouched).
+
+    The new OSM timestamp is stored with the layer (and the GeoPackage table), so
+    the next update starts where this one ended. Returns apply_osm_changes' summary.
+
+    Example:
+        update_osm(blds, large="Cape Town", focus="Observatory")
+        update_osm("city.gpkg", osc="south-africa-updates.osc.gz")
+    """
+    gpkg = isinstance(target, str)
+    if gpkg:
+        table = table or _gpkg_building_table(target)
+        osm_base = _gpkg_osm_base(target, table)
+        layer = QgsVectorLayer(f"{target}|layername={table}", table, "ogr")
+        if osm_base:
+            layer.setCustomProperty(_OSM_BASE_PROPERTY, osm_base)
+    else:
+        layer = target
+        osm_base = layer.customProperty(_OSM_BASE_PROPERTY)
+    if not layer or not layer.isValid():
+        return None
+
+    extent = None
+    if osc is not None:
+        changes = read_osc(osc)
+        bounds = aoi or layer
+        extent = QgsCoordinateTransform(bounds.crs(), QgsCoordinateReferenceSystem("EPSG:4326"),
+                                        QgsProject.instance()).transformBoundingBox(bounds.extent())
+    else:
+        since = since or osm_base
+        if not since:
+            raise ValueError("No harvest timestamp stored with the layer; pass since='YYYY-MM-DDTHH:MM:SSZ'")
+        if not (large and focus):
+            raise ValueError("large and focus name the area to query (or pass osc=)")
+        changes = overpass_changes(large, focus, since)
+
+    summary = apply_osm_changes(layer, changes, extent, fetch, recompute, code_length, dem, keep)
+    if gpkg:
+        osm_base = layer.customProperty(_OSM_BASE_PROPERTY)
+        del layer        # release the file before writing its metadata
+        if summary is not None and osm_base:
+            _gpkg_osm_base(target, table, str(osm_base))
+    return summary
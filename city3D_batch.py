@@ -0,0 +1,334 @@
+#- geo3D_qgis: 2026
+#- arkriger
+
+"""
+Headless batch runner: harvest -> process3D -> solar join -> viz / GeoPackage
+for one or more AOIs described in a JSON config, without the QGIS GUI
+(no iface, no canvas, no zooms). Meant for nightly refreshes on a server.
+
+    python city3D_batch.py nightly.json
+    python city3D_batch.py nightly.json --aoi "Salt River" --profile
+
+Run it with the Python of a QGIS install (OSGeo4W shell on Windows,
+python3 with python3-qgis on Linux; set QGIS_PREFIX_PATH if QGIS is not
+found). No display is needed.
+
+Config:
+
+    {
+      "output_dir": "result",
+      "defaults": {"large": "Western Cape", "bus_operator": "MyCiTi"},
+      "aois": [
+        {"focus": "University Estate"},
+        {"focus": "Mamre", "source": "pbf", "pbf": "data/western-cape.osm.pbf"}
+      ]
+    }
+
+AOI settings ("defaults" apply to every AOI, an AOI entry overrides them):
+
+    focus         area name (required)
+    large         enclosing area of the Overpass area lookup
+    source        "overpass" (default) or "pbf"
+    pbf           .osm.pbf, or its store from build_pbf_store (source "pbf")
+    tiled         harvest buildings with overpass2qgis_tiled (default false)
+    tags          building key whitelist: a list, or "BUILDING_TAGS" for city3D.BUILDING_TAGS
+    themes        extra Overpass layers (default ["farmland", "green", "water"])
+    bus_operator  q_Troutes operator (omit for no bus routes)
+    code_length, workers, dem
+                  passed to process3D (workers also to _with_solar)
+    solar         solar join onto the buildings (default true)
+    ghi           also sample_ghi / solar_mwh per building (default true)
+    viz           create_3Dviz payload "json", "inline", "sidecar", or false
+    gpkg          write geo3D.gpkg (default true)
+    crs           GeoPackage CRS (default: UTM zone of the buildings)
+    incremental   save_to_geopackage incremental mode (default true)
+
+Relative paths are taken from the config file's folder. Every AOI writes to
+<output_dir>/<focus>/; batch_summary.json in output_dir lists the outcome of
+each AOI. The exit code is 1 when any AOI failed.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import traceback
+
+DEFAULTS = {
+    "large": None, "source": "overpass", "pbf": None, "tiled": False, "tags": None,
+    "themes": ["farmland", "green", "water"], "bus_operator": None,
+    "code_length": 11, "workers": None, "dem": None,
+    "solar": True, "ghi": True, "viz": "json", "gpkg": True, "crs": None, "incremental": True,
+}
+
+def start_qgis():
+    """
+    A QgsApplication without GUI, with processing initialised (extract_blds
+    uses native:clip). Returns the application, or None when an already
+    running QGIS is reused (it is then left running).
+    """
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from qgis.core import QgsApplication
+
+    app = None
+    if QgsApplication.instance() is None:
+        app = QgsApplication([], False)
+        app.initQgis()
+    plugins = os.path.join(QgsApplication.pkgDataPath(), "python", "plugins")
+    if plugins not in sys.path:
+        sys.path.append(plugins)
+
+    from processing.core.Processing import Processing
+    Processing.initialize()
+    return app
+
+def _log(focus, message):
+    """Timestamped progress line of one AOI (flushed, so it shows up in redirected logs)."""
+    print(f"{time.strftime('%H:%M:%S')} [{focus}] {message}", flush=True)
+
+def _slug(name):
+    """Folder name for an AOI."""
+    return re.sub(r"[^\w.-]+", "_", name).strip("_") or "aoi"
+
+def _layer_frame(layer):
+    """(GeoDataFrame, fids) of a layer, row i is feature fids[i]."""
+    import geopandas as gpd
+    feats = [f for f in layer.getFeatures() if f.hasGeometry()]
+    gdf = gpd.GeoDataFrame.from_features(feats, crs=layer.crs().authid())
+    return gdf, [f.id() for f in feats]
+
+def _plain(value):
+    """numpy/pandas cell -> value a QGIS attribute takes (lists become comma separated text)."""
+    if isinstance(value, (list, tuple)):
+        return ",".join(str(v) for v in value) if len(value) else None
+    if value is None:
+        return None
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+def write_columns(city3D, layer, fids, columns):
+    """
+    Writes {name: (QVariant type, values)} onto the features fids in one
+    provider call; missing fields are added first.
+    """
+    from qgis.core import QgsField
+
+    pr = layer.dataProvider()
+    existing = layer.fields().names()
+    to_add = [QgsField(name, vtype) for name, (vtype, _) in columns.items() if name not in existing]
+    if to_add:
+        pr.addAttributes(to_add)
+        layer.updateFields()
+    fields = layer.fields()
+    idx = {name: fields.indexFromName(name) for name in columns}
+    changes = {fid: {} for fid in fids}
+    for name, (_, values) in columns.items():
+        for fid, value in zip(fids, values):
+            changes[fid][idx[name]] = _plain(value)
+    if not pr.changeAttributeValues(changes):
+        raise RuntimeError(f"Could not write {list(columns)} to {layer.name()}")
+    city3D._bump_revision(layer)
+
+def harvest(city3D, cfg, focus):
+    """Buildings, solar (GeoDataFrame or layer) and the extra layers of one AOI."""
+    layers = {}
+    solar = None
+    if cfg["source"] == "pbf":
+        if not cfg["pbf"]:
+            raise ValueError("source 'pbf' needs a 'pbf' path")
+        aoi = city3D.extract_bndrs(cfg["pbf"], focus, zoom=False)
+        layers["buildings"] = city3D.extract_blds(cfg["pbf"], focus, aoi)
+        layers["aoi"] = aoi
+        if cfg["themes"]:
+            _log(focus, f"themes {cfg['themes']} are Overpass-only; skipped for a pbf source")
+    elif cfg["source"] == "overpass":
+        if not cfg["large"]:
+            raise ValueError("source 'overpass' needs 'large'")
+        tags = city3D.BUILDING_TAGS if cfg["tags"] == "BUILDING_TAGS" else cfg["tags"]
+        themes = list(cfg["themes"]) + (["solar"] if cfg["solar"] else [])
+        if cfg["tiled"]:
+            layers["buildings"] = city3D.overpass2qgis_tiled(cfg["large"], focus, zoom=False, tags=tags,
+                                                            progress=None)
+            found = city3D.q_themes(cfg["large"], focus, themes, zoom=False) if themes else {}
+        else:
+            #- one Overpass request (one area lookup) for every theme
+            found = city3D.q_themes(cfg["large"], focus, ["buildings"] + themes, zoom=False,
+                                    tags={"buildings": tags})
+            layers["buildings"] = found.pop("buildings")
+        solar = found.pop("solar", None)
+        layers.update(found)
+        if cfg["bus_operator"]:
+            layers["bus"] = city3D.q_Troutes(cfg["large"], operator=cfg["bus_operator"])
+    else:
+        raise ValueError(f"unknown source {cfg['source']!r}")
+
+    if layers["buildings"] is None or layers["buildings"].featureCount() == 0:
+        raise RuntimeError("no buildings harvested")
+    return layers, solar
+
+def solar_join(city3D, cfg, focus, blds, gdf, fids, solar, aoi, epsg):
+    """_with_solar (and GHI) on the processed buildings (gdf, fids), written back onto blds."""
+    from qgis.PyQt.QtCore import QVariant
+
+    gdf = gdf.to_crs(epsg)
+    if cfg["source"] == "pbf":
+        sol = city3D._harvestSolar(cfg["pbf"], focus, aoi, epsg)
+        if "osm_way_id" in sol.columns:
+            sol["osm_id"] = sol["osm_id"].fillna(sol["osm_way_id"])
+    elif solar is not None and solar.featureCount():
+        sol, _ = _layer_frame(solar)
+        sol = sol.to_crs(epsg)
+    else:
+        sol = None
+
+    columns = {}
+    if sol is not None and len(sol) and "generator:method" in sol.columns:
+        gdf, _ = city3D._with_solar(gdf, sol, workers=cfg["workers"])
+        columns["has_solar"] = (QVariant.Bool, gdf["has_solar"].tolist())
+        columns["solar_ids"] = (QVariant.String, gdf["children"].tolist())
+        columns["solar_method"] = (QVariant.String, gdf["method"].tolist())
+        _log(focus, f"solar: {int(gdf['has_solar'].sum())} of {len(gdf)} buildings carry panels")
+    else:
+        columns["has_solar"] = (QVariant.Bool, [False] * len(gdf))
+        _log(focus, "solar: no panels mapped")
+
+    if cfg["ghi"]:
+        ghi = city3D.sample_ghi(gdf)
+        columns["ghi"] = (QVariant.Double, ghi.tolist())
+        columns["solar_mwh"] = (QVariant.Double, city3D.solar_mwh(gdf, ghi=ghi).tolist())
+    write_columns(city3D, blds, fids, columns)
+
+def run_aoi(city3D, cfg, output_dir):
+    """Full chain for one AOI; returns its summary entry."""
+    from qgis.core import QgsProject
+
+    focus = cfg["focus"]
+    out_dir = os.path.join(output_dir, _slug(focus))
+    os.makedirs(out_dir, exist_ok=True)
+    t0 = time.perf_counter()
+    entry = {"focus": focus, "output": out_dir, "status": "failed"}
+
+    #- every AOI starts from an empty project, so the GeoPackage only holds its own layers
+    QgsProject.instance().removeAllMapLayers()
+
+    _log(focus, f"harvest ({cfg['source']})")
+    layers, solar = harvest(city3D, cfg, focus)
+    blds = layers["buildings"]
+    entry["buildings"] = blds.featureCount()
+
+    _log(focus, f"process3D: {entry['buildings']} buildings")
+    if city3D.process3D(blds, code_length=cfg["code_length"], workers=cfg["workers"], dem=cfg["dem"]) is None:
+        raise RuntimeError("process3D failed")
+
+    epsg = None
+    if cfg["solar"] or (cfg["gpkg"] and not cfg["crs"]):
+        gdf, fids = _layer_frame(blds)
+        epsg = city3D.get_utm_crs(gdf)
+    if cfg["solar"]:
+        _log(focus, "solar join")
+        solar_join(city3D, cfg, focus, blds, gdf, fids, solar, layers.get("aoi"), epsg)
+
+    if cfg["viz"]:
+        _log(focus, f"create_3Dviz ({cfg['viz']})")
+        entry["html"] = city3D.create_3Dviz(out_dir, blds, layers.get("farmland"), layers.get("green"),
+                                            layers.get("water"), layers.get("bus"), payload=cfg["viz"], report=True)
+    if cfg["gpkg"]:
+        crs = cfg["crs"] or f"EPSG:{epsg}"
+        _log(focus, f"GeoPackage ({crs})")
+        entry["gpkg"] = city3D.save_to_geopackage(os.path.join(out_dir, "geo3D.gpkg"), crs,
+                                                  incremental=cfg["incremental"])
+        if entry["gpkg"] is None:
+            raise RuntimeError("save_to_geopackage failed")
+
+    entry["status"] = "ok"
+    entry["seconds"] = round(time.perf_counter() - t0, 2)
+    _log(focus, f"done in {entry['seconds']}s")
+    return entry
+
+def load_config(path):
+    """Reads the config; returns (output_dir, [per-AOI settings]) with paths resolved."""
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+
+    def resolve(p):
+        return p if p is None or os.path.isabs(p) else os.path.normpath(os.path.join(base, p))
+
+    defaults = dict(DEFAULTS, **config.get("defaults", {}))
+    aois = []
+    for entry in config.get("aois", []):
+        if isinstance(entry, str):
+            entry = {"focus": entry}
+        cfg = dict(defaults, **entry)
+        unknown = set(cfg) - set(DEFAULTS) - {"focus"}
+        if unknown:
+            raise ValueError(f"unknown setting(s) {sorted(unknown)} for {cfg.get('focus')!r}")
+        if not cfg.get("focus"):
+            raise ValueError(f"AOI without 'focus': {entry}")
+        if cfg["viz"] not in (False, None, "json", "inline", "sidecar"):
+            raise ValueError(f"viz must be 'json', 'inline', 'sidecar' or false, not {cfg['viz']!r}")
+        cfg["pbf"], cfg["dem"] = resolve(cfg["pbf"]), resolve(cfg["dem"])
+        aois.append(cfg)
+    return resolve(config.get("output_dir", "result")), aois
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("config", help="JSON config file")
+    parser.add_argument("--aoi", nargs="+", help="run only these focus names")
+    parser.add_argument("--output-dir", help="overrides output_dir of the config")
+    parser.add_argument("--profile", action="store_true", help="write profile.json (stage timings) per AOI")
+    parser.add_argument("--fail-fast", action="store_true", help="stop at the first failed AOI")
+    args = parser.parse_args(argv)
+
+    output_dir, aois = load_config(args.config)
+    output_dir = args.output_dir or output_dir
+    if args.aoi:
+        missing = set(args.aoi) - {a["focus"] for a in aois}
+        if missing:
+            parser.error(f"not in the config: {sorted(missing)}")
+        aois = [a for a in aois if a["focus"] in args.aoi]
+    os.makedirs(output_dir, exist_ok=True)
+
+    app = start_qgis()
+    from qgis.core import QgsProject
+    import city3D
+
+    summary = []
+    for cfg in aois:
+        if args.profile:
+            city3D.reset_profile()
+            city3D.set_profiling(True)
+        try:
+            entry = run_aoi(city3D, cfg, output_dir)
+        except Exception as e:
+            _log(cfg["focus"], f"FAILED: {e}")
+            traceback.print_exc()
+            entry = {"focus": cfg["focus"], "status": "failed", "error": f"{type(e).__name__}: {e}"}
+        if args.profile:
+            out_dir = os.path.join(output_dir, _slug(cfg["focus"]))
+            os.makedirs(out_dir, exist_ok=True)
+            city3D.profile_summary()
+            entry["profile"] = city3D.export_profile(os.path.join(out_dir, "profile.json"))
+            city3D.set_profiling(False)
+        summary.append(entry)
+        if args.fail_fast and entry["status"] != "ok":
+            break
+
+    with open(os.path.join(output_dir, "batch_summary.json"), "w", encoding="utf-8") as f:
+        json.dump({"config": os.path.abspath(args.config), "finished": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                   "aois": summary}, f, indent=1)
+    failed = [e["focus"] for e in summary if e["status"] != "ok"]
+    print(f"{len(summary) - len(failed)} of {len(summary)} AOIs done" + (f"; failed: {failed}" if failed else ""))
+
+    QgsProject.instance().removeAllMapLayers()
+    if app is not None:
+        app.exitQgis()
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
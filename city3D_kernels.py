@@ -0,0 +1,546 @@
+#- geo3D_qgis: 2026
+#- arkriger
+
+"""
+QGIS-free kernels of the per-building stages in city3D.
+
+Everything here works on plain arrays, strings and WKB so it can run in the
+worker processes of the partitioned pipeline (process3D(..., workers=n),
+_with_solar(..., workers=n)), where the QGIS bindings are not available.
+city3D imports these functions; its public names are unchanged. Without
+QGIS they can also be tested on their own (python -m pytest tests).
+shapely, pyproj and pandas (like the heavy imports of city3D) are loaded on first use.
+"""
+
+import json
+import types
+import importlib
+import numpy as np
+
+class _LazyModule(types.ModuleType):
+    """
+    Stands in for a module that is imported on first attribute access, so
+    importing (or reloading) city3D doesn't pay for dependencies a session
+    never uses. After the import its namespace is copied in: later lookups
+    are plain attribute hits.
+    """
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__["_lazy_target"] = name
+
+    def __getattr__(self, attr):
+        # probes for dunders (__file__, __path__, __wrapped__ from inspect,
+        # pickle, doctest, ...) must not trigger the import
+        if attr.startswith("__"):
+            raise AttributeError(attr)
+        module = importlib.import_module(self.__dict__["_lazy_target"])
+        self.__dict__.update(module.__dict__)
+        self.__dict__["_lazy_loaded"] = True
+        return getattr(module, attr)
+
+    def __repr__(self):
+        state = "" if self.__dict__.get("_lazy_loaded") else " (not loaded)"
+        return f"<lazy module '{self.__dict__['_lazy_target']}'{state}>"
+
+shapely = _LazyModule("shapely")
+pyproj = _LazyModule("pyproj")
+pd = _LazyModule("pandas")
+
+def get_rgb_color(bld):
+    """Returns RGB list as a string to match the original notebook format."""
+    if bld in ['house', 'semidetached_house', 'terrace']:
+        rgb = [255, 255, 204]
+    elif bld == 'apartments':
+        rgb = [252, 194, 3]
+    elif bld in ['residential', 'dormitory', 'cabin']:
+        rgb = [119, 3, 252]
+    elif bld in ['garage', 'parking']:
+        rgb = [3, 132, 252]
+    elif bld in ['retail', 'supermarket']:
+        rgb = [253, 141, 60]
+    elif bld in ['office', 'commercial']:
+        rgb = [185, 206, 37]
+    elif bld in ['school', 'kindergarten', 'university', 'college']:
+        rgb = [128, 0, 38]
+    elif bld in ['clinic', 'doctors', 'hospital']:
+        rgb = [89, 182, 178]
+    elif bld in ['community_centre', 'service', 'post_office', 'hall', 'civic',
+                  'townhall', 'police', 'library', 'fire_station']:
+        rgb = [181, 182, 89]
+    elif bld in ['warehouse', 'industrial']:
+        rgb = [193, 255, 193]
+    elif bld == 'hotel':
+        rgb = [139, 117, 0]
+    elif bld in ['church', 'mosque', 'synagogue']:
+        rgb = [225, 225, 51]
+    else:
+        rgb = [255, 255, 204]
+    return str(rgb)
+
+def _round2(values):
+    """Vectorized equivalent of Python's round(x, 2) for a float array."""
+    values = np.asarray(values, dtype=float)
+    out = np.round(values, 2)
+    # np.round scales by 100 first, which can tip values sitting on a .xx5 tie
+    # the other way. Hand those (rare) ties to Python's correctly-rounded round().
+    scaled = values * 100.0
+    ties = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if ties.any():
+        out[ties] = [round(float(v), 2) for v in values[ties]]
+    return out
+
+def _format2(values):
+    """Vectorized force_dot: 2-decimal strings with '.', NaN becomes None."""
+    values = np.asarray(values, dtype=float)
+    out = np.char.mod("%.2f", values).astype(object)
+    out[np.isnan(values)] = None
+    return out.tolist()
+
+def _raw_float(val):
+    """_to_float for plain Python values (None for NULL)."""
+    if val is None or val == "": return 0.0
+    try: return float(str(val).replace(',', '.'))
+    except: return 0.0
+
+def _building_heights(b_type, levels, ground_h, min_h):
+    """
+    process3D height rules on whole columns (masks mirror the per-feature branches).
+    Returns (building_height, roof_height, bottom_bridge_height, bottom_roof_height), NaN = empty.
+    """
+    storey_h = 2.8
+    is_cabin = b_type == 'cabin'
+    is_bridge = b_type == 'bridge'
+    is_roof = b_type == 'roof'
+
+    b_h = np.where(is_cabin, _round2(levels * storey_h), _round2(levels * storey_h + 1.3))
+    r_h = _round2(b_h + ground_h)
+    bb_h = np.where(is_bridge, _round2(min_h + ground_h), np.nan)
+    br_h = np.where(is_roof, _round2(levels * storey_h + ground_h), np.nan)
+    r_h = np.where(is_roof, _round2(br_h + 1.3), r_h)
+    b_h = np.where(is_roof, np.nan, b_h)
+    return b_h, r_h, bb_h, br_h
+
+_PLUS_ALPHABET = "23456789CFGHJMPQRVWX"
+
+def _plus_cell_height(code_length):
+    """Latitude extent (degrees) of a Plus Code cell of this length."""
+    return 20.0 / 20 ** (min(code_length, 10) // 2 - 1) / 5 ** max(code_length - 10, 0)
+
+def encode_plus_codes(lat, lon, code_length=11):
+    """
+    Encodes arrays of WGS84 lat/lon into Plus Codes in one vectorized pass.
+    code_length: 2, 4, 6, 8 or 10 (pair digits, '0'-padded below 8) or 11-15
+    (grid refinement). Length 11 is identical to get_homebaked_plus_code.
+    As in Open Location Code, longitudes wrap into [-180, 180) and latitude 90
+    falls in the topmost cell.
+    """
+    if code_length not in (2, 4, 6, 8, 10) and not 11 <= code_length <= 15:
+        raise ValueError("code_length must be 2, 4, 6, 8, 10 or 11-15")
+
+    alphabet = np.array(list(_PLUS_ALPHABET))
+    lat = np.atleast_1d(np.asarray(lat, dtype=float))
+    lat = np.where(lat >= 90.0, 90.0 - _plus_cell_height(code_length) / 2, np.maximum(lat, -90.0))
+    lon = (np.atleast_1d(np.asarray(lon, dtype=float)) + 180.0) % 360.0 - 180.0
+    l_rem = (lat + 90.0) / 20.0
+    n_rem = (lon + 180.0) / 20.0
+    digits = []
+    for _ in range(min(code_length, 10) // 2):
+        l_idx = np.trunc(l_rem)
+        l_rem = (l_rem - l_idx) * 20.0
+        n_idx = np.trunc(n_rem)
+        n_rem = (n_rem - n_idx) * 20.0
+        digits.append(alphabet[np.clip(l_idx, 0, 19).astype(int)])
+        digits.append(alphabet[np.clip(n_idx, 0, 19).astype(int)])
+    # grid refinement: 5 rows x 4 columns per extra digit
+    for _ in range(code_length - 10):
+        row = np.trunc(l_rem * 5 / 20)
+        col = np.trunc(n_rem * 4 / 20)
+        l_rem = (l_rem * 5 / 20 - row) * 20.0
+        n_rem = (n_rem * 4 / 20 - col) * 20.0
+        digits.append(alphabet[np.clip(row * 4 + col, 0, 19).astype(int)])
+
+    digits += [np.full(len(l_rem), "0")] * (8 - len(digits))
+    digits.insert(8, np.full(len(l_rem), "+"))
+    codes = digits[0].astype(object)
+    for d in digits[1:]:
+        codes = codes + d.astype(object)
+    return codes.tolist()
+
+def get_homebaked_plus_code(lat, lon):
+    """Computes 11-digit Plus Code based on the Base20 offset formula."""
+    alphabet = "23456789CFGHJMPQRVWX"
+    lat = 90.0 - _plus_cell_height(11) / 2 if lat >= 90.0 else max(lat, -90.0)
+    lon = (lon + 180.0) % 360.0 - 180.0
+    lat_val, lon_val = lat + 90.0, lon + 180.0
+    lat_digits, lon_digits = [], []
+    l_rem, n_rem = lat_val / 20.0, lon_val / 20.0
+    for _ in range(5):
+        l_idx = int(l_rem)
+        l_rem = (l_rem - l_idx) * 20.0
+        lat_digits.append(alphabet[max(0, min(19, l_idx))])
+        n_idx = int(n_rem)
+        n_rem = (n_rem - n_idx) * 20.0
+        lon_digits.append(alphabet[max(0, min(19, n_idx))])
+    row, col = int(l_rem * 5 / 20), int(n_rem * 4 / 20)
+    grid_idx = (row * 4) + col
+    last_digit = alphabet[max(0, min(19, grid_idx))]
+    return (f"{lat_digits[0]}{lon_digits[0]}{lat_digits[1]}{lon_digits[1]}"
+            f"{lat_digits[2]}{lon_digits[2]}{lat_digits[3]}{lon_digits[3]}+"
+            f"{lat_digits[4]}{lon_digits[4]}{last_digit}")
+
+def decode_plus_code(code):
+    """
+    Area covered by a Plus Code (any length, '+' and '0' padding allowed).
+    Returns dict: south, west, north, east, lat, lon (cell centre) and length.
+    """
+    digits = code.upper().replace("+", "").rstrip("0")
+    if (not digits or len(digits) > 15 or (len(digits) < 10 and len(digits) % 2)
+            or any(c not in _PLUS_ALPHABET for c in digits)):
+        raise ValueError(f"Not a valid Plus Code: {code!r}")
+
+    south, west, res = -90.0, -180.0, 20.0
+    for i in range(0, min(len(digits), 10), 2):
+        south += _PLUS_ALPHABET.index(digits[i]) * res
+        west += _PLUS_ALPHABET.index(digits[i + 1]) * res
+        res /= 20.0
+    lat_res = lon_res = res * 20.0
+    # grid refinement: 5 rows x 4 columns per extra digit
+    for c in digits[10:]:
+        row, col = divmod(_PLUS_ALPHABET.index(c), 4)
+        lat_res, lon_res = lat_res / 5.0, lon_res / 4.0
+        south += row * lat_res
+        west += col * lon_res
+    return {
+        "south": south, "west": west, "north": south + lat_res, "east": west + lon_res,
+        "lat": south + lat_res / 2.0, "lon": west + lon_res / 2.0, "length": len(digits)
+    }
+
+def calculate_azimuths(geometries):
+    """
+    Array version of calculate_azimuth_from_geometry: azimuth (angle from North,
+    clockwise, 0-180) of the minimum rotated rectangle for every geometry of a
+    GeoSeries / array in one pass. Non-polygons and degenerate shapes get 0.0.
+    """
+    geoms = np.asarray(geometries, dtype=object)
+    azimuth = np.zeros(len(geoms))
+    if not len(geoms):
+        return azimuth
+
+    # Polygon (3) / MultiPolygon (6) only; None has type id -1
+    ok = np.isin(shapely.get_type_id(geoms), (3, 6)) & ~shapely.is_empty(geoms)
+    rect = np.empty(len(geoms), dtype=object)
+    rect[ok] = shapely.minimum_rotated_rectangle(geoms[ok])
+    ok &= shapely.get_type_id(rect) == 3
+
+    ring = shapely.get_exterior_ring(rect[ok])
+    p0, p1, p2 = (shapely.get_coordinates(shapely.get_point(ring, k)) for k in range(3))
+
+    segment1 = p1 - p0
+    segment2 = p2 - p1
+    len1 = np.linalg.norm(segment1, axis=1)
+    len2 = np.linalg.norm(segment2, axis=1)
+
+    long_segment = np.where((len1 >= len2)[:, None], segment1, segment2)
+    long_len = np.maximum(len1, len2)
+
+    angle_deg = np.degrees(np.arctan2(long_segment[:, 1], long_segment[:, 0]))
+
+    # Convert angle (from X-axis CCW) to Azimuth (from North CW)
+    az = (90.0 - angle_deg) % 360.0
+
+    # Constrain to 0-180 range
+    az = np.where(az > 180.0, az - 180.0, az)
+    azimuth[ok] = np.where(long_len == 0, 0.0, az)
+    return azimuth
+
+# ---- QgsGeometry text formats, so worker output matches the single-process path ----
+
+def _qgs_number(value):
+    """qgsDoubleToString(value, 17): fixed 17 decimals, trailing zeros trimmed."""
+    text = f"{value:.17f}".rstrip("0").rstrip(".")
+    return "0" if text == "-0" else text
+
+def _qgs_wkt_body(geom):
+    kind = geom.geom_type
+    if kind in ("Point", "LineString", "LinearRing"):
+        return "(" + ", ".join(" ".join(_qgs_number(c) for c in pt) for pt in geom.coords) + ")"
+    if kind == "Polygon":
+        return "(" + ",".join(_qgs_wkt_body(r) for r in (geom.exterior, *geom.interiors)) + ")"
+    if kind == "GeometryCollection":
+        return "(" + ",".join(_qgs_wkt(g) for g in geom.geoms) + ")"
+    return "(" + ",".join(_qgs_wkt_body(g) for g in geom.geoms) + ")"
+
+def _qgs_wkt(geom):
+    """QgsGeometry.asWkt() text of a shapely geometry ('Polygon ((x y, ...))')."""
+    name = geom.geom_type + ("Z" if shapely.has_z(geom) else "")
+    return f"{name} EMPTY" if geom.is_empty else f"{name} {_qgs_wkt_body(geom)}"
+
+def _qgs_round(coords):
+    """qgsRound(x, 17) on a coordinate sequence, as nested lists."""
+    a = np.asarray(coords, dtype=float)
+    sign = np.where(a < 0, -1.0, 1.0)
+    return ((np.floor(np.abs(a) * 1e17 + 0.5) / 1e17) * sign).tolist()
+
+def _qgs_json_coordinates(geom):
+    """'coordinates' member of QgsGeometry.asJson(); None for collections."""
+    kind = geom.geom_type
+    if kind == "Point":
+        return _qgs_round(geom.coords)[0]
+    if kind in ("LineString", "LinearRing"):
+        return _qgs_round(geom.coords)
+    if kind == "Polygon":
+        return [_qgs_round(r.coords) for r in (geom.exterior, *geom.interiors)]
+    if kind.startswith("Multi"):
+        return [_qgs_json_coordinates(g) for g in geom.geoms]
+    return None
+
+# ---- partitioning and worker entry points ----
+
+_VIZ_MAX_PRECISION = 7     # 1e-7 degrees (~1 cm); at 1e-8 a longitude of 180 overflows int32
+_GEOM_CODES = {"Polygon": 1, "MultiPolygon": 2, "LineString": 3, "MultiLineString": 4, "Point": 5, "MultiPoint": 6}
+
+def _encode_viz_layer(geojson, properties, precision=6):
+    """
+    Compact binary encoding of a GeoJSON FeatureCollection for the 3D viz:
+    pruned, dictionary-encoded properties (JSON header), ring/part counts
+    (uint32) and coordinates quantized to 10^-precision degrees, delta-encoded
+    as int32. Decoded in the browser by geo3dDecode.
+    precision: 0-7 (10^-7 degrees is about 1 cm; 180 * 10^8 no longer fits int32).
+    """
+    if not (isinstance(precision, int) and 0 <= precision <= _VIZ_MAX_PRECISION):
+        raise ValueError(f"precision must be an integer from 0 to {_VIZ_MAX_PRECISION}, got {precision!r}")
+    types, parts, coords = [], [], []
+
+    def line(pts):
+        parts.append(len(pts))
+        coords.extend(pt[:2] for pt in pts)
+
+    def poly(rings):
+        parts.append(len(rings))
+        for r in rings: line(r)
+
+    encoders = {
+        "Polygon": poly,
+        "MultiPolygon": lambda c: (parts.append(len(c)), [poly(p) for p in c]),
+        "LineString": line,
+        "MultiLineString": lambda c: (parts.append(len(c)), [line(l) for l in c]),
+        "Point": lambda c: coords.append(c[:2]),
+        "MultiPoint": line,
+    }
+
+    features = geojson.get("features", [])
+    columns = {k: [] for k in properties}
+    for feat in features:
+        geom = feat.get("geometry") or {}
+        gtype = geom.get("type")
+        if gtype in encoders:
+            types.append(_GEOM_CODES[gtype])
+            encoders[gtype](geom["coordinates"])
+        else:
+            types.append(0)
+        props = feat.get("properties") or {}
+        for k in properties:
+            v = props.get(k)
+            # list-like strings (e.g. fill_color "[255, 255, 204]") travel as arrays
+            if isinstance(v, str) and v.startswith("["):
+                try: v = json.loads(v)
+                except ValueError: pass
+            columns[k].append(v)
+
+    # ---- properties: per column a dictionary of distinct values + indexes ----
+    props_out = {}
+    for k, values in columns.items():
+        keys = [json.dumps(v) for v in values]
+        lookup = {}
+        idx = [lookup.setdefault(s, len(lookup)) for s in keys]
+        props_out[k] = {"dict": [json.loads(s) for s in lookup], "idx": idx}
+
+    scale = 10 ** precision
+    q = np.round(np.asarray(coords, dtype=float).reshape(-1, 2) * scale).astype(np.int64)
+    deltas = np.diff(q, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    if deltas.size and (deltas.min() < -2**31 or deltas.max() >= 2**31):
+        raise ValueError(f"Coordinates do not fit the int32 encoding at precision {precision} "
+                         "(not in degrees?); use a lower precision or payload='json'")
+    deltas = deltas.astype("<i4")
+
+    header = json.dumps({
+        "n": len(types), "nparts": len(parts), "ncoords": len(q), "scale": scale, "props": props_out
+    }, separators=(",", ":")).encode("utf-8")
+
+    def pad(b):
+        return b + b"\0" * (-len(b) % 4)
+
+    return (pad(np.asarray([len(header)], dtype="<u4").tobytes() + header)
+            + pad(np.asarray(types, dtype=np.uint8).tobytes())
+            + np.asarray(parts, dtype="<u4").tobytes()
+            + deltas.tobytes())
+
+def _numeric(gdf, col):
+    """Notebook numeric conversion: fillna(0) then to_numeric (unparsable -> NaN); numeric columns as they are."""
+    s = gdf[col]
+    if not pd.api.types.is_numeric_dtype(s):
+        s = pd.to_numeric(s.fillna(0), errors='coerce')
+    return s.to_numpy(dtype=float)
+
+def _population_building(gdf):
+    """'building' with residential=student rewritten to 'student' (as the notebook does)."""
+    b = gdf['building'].to_numpy(dtype=object)
+    if 'residential' in gdf.columns:
+        b = np.where(gdf['residential'].to_numpy(dtype=object) == 'student', 'student', b)
+    return b
+
+def estimate_population(gdf, f_house=6, inf_structure=4):
+    """
+    Vectorized notebook pop(row): residents per building from 'building',
+    'building:units', 'rooms', 'building:flats', 'beds', 'building:levels',
+    'residential' and 'social_facility', with the same rule order and results
+    (NaN where the notebook yields NaN). Raw string tags are converted as in the notebook.
+
+    f_house: residents per formal house; inf_structure: residents per informal structure.
+    Returns a float Series named 'pop' on gdf's index.
+    """
+    cols = gdf.columns
+    n = len(gdf)
+    b = _population_building(gdf)
+    zeros = np.zeros(n)
+
+    def column(name):
+        return _numeric(gdf, name) if name in cols else None
+
+    units, rooms, flats, beds = column('building:units'), column('rooms'), column('building:flats'), column('beds')
+    levels = column('building:levels')
+    multi = (levels if levels is not None else zeros) > 1
+    # "col in c and row[col] != 0" (NaN != 0 holds, so NaN values are returned as NaN)
+    has_units = units != 0 if units is not None else np.zeros(n, dtype=bool)
+    has_rooms = rooms != 0 if rooms is not None else np.zeros(n, dtype=bool)
+    has_flats = flats != 0 if flats is not None else np.zeros(n, dtype=bool)
+    units = units if units is not None else zeros
+    rooms = rooms if rooms is not None else zeros
+    flats_v = flats if flats is not None else zeros
+
+    no_facility = (pd.isna(gdf['social_facility']).to_numpy() if 'social_facility' in cols
+                   else np.ones(n, dtype=bool))
+    university = (gdf['residential'].to_numpy(dtype=object) == 'university' if 'residential' in cols
+                  else np.zeros(n, dtype=bool))
+
+    house = np.isin(b, ['house', 'semidetached_house'])
+    terrace = np.isin(b, ['terrace', 'terraced'])
+    cabin = b == 'cabin'
+    social = (b == 'residential') & no_facility
+    shelter = (b == 'residential') & ~no_facility
+    apartments = b == 'apartments'
+    student = b == 'student'
+    dorm = (b == 'dormitory') & university
+
+    # apartments: int(row.get('building:flats', 0)) * 3
+    flats_int = np.trunc(flats_v)
+    bad = apartments & ~has_rooms & np.isnan(flats_int)
+    if bad.any():
+        raise ValueError(f"apartments with unparsable 'building:flats' at {list(gdf.index[bad][:10])}")
+
+    conditions = [
+        house,
+        terrace & has_units, terrace,
+        cabin,
+        social & multi & has_rooms, social & multi & has_flats, social,
+        shelter & multi & has_units, shelter & multi, shelter,
+        apartments & has_rooms, apartments,
+        student & multi & has_rooms, student & multi, student,
+        dorm & multi & has_rooms, dorm & multi, dorm,
+    ]
+    choices = [
+        f_house,
+        units * f_house, f_house,
+        inf_structure,
+        rooms, flats_v * inf_structure, inf_structure,
+        units * inf_structure, beds if beds is not None else inf_structure, inf_structure,
+        rooms, flats_int * 3,
+        rooms, flats if flats is not None else 3, 3,
+        rooms, beds if beds is not None else 3, 3,
+    ]
+    pop = np.select(conditions, [np.broadcast_to(np.asarray(c, dtype=float), n) for c in choices], 0.0)
+    return pd.Series(pop, index=gdf.index, name='pop')
+
+def grid_partitions(x, y, parts):
+    """
+    Splits points (e.g. bbox centres) into about `parts` spatial grid cells.
+    Returns a list of index arrays, one per non-empty cell.
+    """
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    if not len(x):
+        return []
+    side = max(1, int(np.ceil(np.sqrt(parts))))
+    span_x = max(x.max() - x.min(), 1e-12)
+    span_y = max(y.max() - y.min(), 1e-12)
+    col = np.minimum(((x - x.min()) / span_x * side).astype(int), side - 1)
+    row = np.minimum(((y - y.min()) / span_y * side).astype(int), side - 1)
+    cell = row * side + col
+    order = np.argsort(cell, kind="stable")
+    bounds = np.flatnonzero(np.diff(cell[order])) + 1
+    return np.split(order, bounds)
+
+def process3D_partition(task):
+    """
+    Worker side of process3D for one grid cell.
+
+    task: {"wkb": [bytes], "columns": {name: [value or None]}, "address_keys": [...],
+           "crs": source CRS (authid / PROJ string), "code_length": int}
+    Returns {output field: [value per feature]} in the order of task["wkb"].
+    """
+    geoms = shapely.from_wkb(task["wkb"])
+    invalid = ~shapely.is_valid(geoms)
+    if invalid.any():
+        geoms[invalid] = shapely.make_valid(geoms[invalid])
+    n = len(geoms)
+    cols = task["columns"]
+
+    if 'building' in cols:
+        b_type = np.array(['house' if v is None else str(v) for v in cols['building']], dtype=object)
+    else:
+        b_type = np.full(n, 'house', dtype=object)
+
+    def column(key, default):
+        if key not in cols:
+            return np.full(n, default)
+        return np.array([_raw_float(v) for v in cols[key]], dtype=float)
+
+    levels = column('building:levels', 1.0)
+    ground_h = column('mean', 0.0)
+    b_h, r_h, bb_h, br_h = _building_heights(b_type, levels, ground_h, column('min_height', 0.0))
+
+    address = [None] * n
+    if task["address_keys"]:
+        for i, row in enumerate(zip(*[cols[k] for k in task["address_keys"]])):
+            parts = [str(v).strip() for v in row if v is not None]
+            address[i] = " ".join(parts) if parts else None
+
+    types, inverse = np.unique(b_type.astype(str), return_inverse=True)
+    fill_color = np.array([get_rgb_color(t) for t in types], dtype=object)[inverse].tolist()
+
+    points = shapely.point_on_surface(geoms)
+    x, y = shapely.get_x(points), shapely.get_y(points)
+    if task["crs"] == "EPSG:4326":
+        lon, lat = x, y
+    else:
+        lon, lat = pyproj.Transformer.from_crs(task["crs"], "EPSG:4326", always_xy=True).transform(x, y)
+
+    return {
+        'address': address,
+        'plus_code': encode_plus_codes(lat, lon, task["code_length"]),
+        'building_height': _format2(b_h),
+        'roof_height': _format2(r_h),
+        'ground_height': _format2(ground_h),
+        'bottom_bridge_height': _format2(bb_h),
+        'bottom_roof_height': _format2(br_h),
+        'footprint': [json.dumps(_qgs_json_coordinates(g)) for g in geoms],
+        'geometry_wkt': [_qgs_wkt(g) for g in geoms],
+        'fill_color': fill_color
+    }
+
+def solar_partition(task):
+    """(building index, panel index) pairs where the building contains the panel, for one cell."""
+    buildings, panels = shapely.from_wkb(task[0]), shapely.from_wkb(task[1])
+    return shapely.STRtree(panels).query(buildings, predicate="contains")
+
+def azimuth_partition(wkb):
+    return calculate_azimuths(shapely.from_wkb(wkb))
@@ -0,0 +1,8 @@
+#- geo3D_qgis: 2026
+#- arkriger
+
+#- the tests cover city3D_kernels, which imports without QGIS; run from the repo root: python -m pytest tests
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,67 @@
+#- geo3D_qgis: 2026
+#- arkriger
+
+import numpy as np
+import pytest
+
+from city3D_kernels import encode_plus_codes, decode_plus_code, get_homebaked_plus_code, _round2
+
+LENGTHS = [2, 4, 6, 8, 10, 11, 12, 13, 14, 15]
+EPS = 1e-9      # decode sums digit offsets; cell edges can be off by float noise
+
+#- random points plus the poles and the antimeridian
+_rng = np.random.default_rng(7)
+LAT = np.concatenate([_rng.uniform(-90, 90, 5000), [90.0, -90.0, 89.9999999, -89.9999999, 0.0, 0.0, 45.0, -33.93]])
+LON = np.concatenate([_rng.uniform(-180, 180, 5000), [180.0, -180.0, 179.9999999, -180.0, 180.0, -179.9999999, 540.0, 18.42]])
+
+def _inside(lat, lon, cell):
+    """Point in the decoded cell (lat 90 belongs to the topmost cell, lon wraps)."""
+    lon = (lon + 180.0) % 360.0 - 180.0
+    return (cell["south"] - EPS <= lat <= cell["north"] + EPS
+            and cell["west"] - EPS <= lon < cell["east"] + EPS)
+
+@pytest.mark.parametrize("length", LENGTHS)
+def test_round_trip(length):
+    for code, lat, lon in zip(encode_plus_codes(LAT, LON, length), LAT, LON):
+        cell = decode_plus_code(code)
+        assert cell["length"] == length
+        assert _inside(lat, lon, cell), (code, lat, lon, cell)
+        assert cell["south"] >= -90.0 - EPS and cell["north"] <= 90.0 + EPS, code
+        assert cell["west"] >= -180.0 - EPS and cell["east"] <= 180.0 + EPS, code
+
+@pytest.mark.parametrize("length", LENGTHS)
+def test_cell_centre_encodes_to_same_code(length):
+    codes = encode_plus_codes(LAT[:500], LON[:500], length)
+    cells = [decode_plus_code(c) for c in codes]
+    again = encode_plus_codes([c["lat"] for c in cells], [c["lon"] for c in cells], length)
+    assert again == codes
+
+def test_poles_and_antimeridian():
+    north, south = encode_plus_codes([90.0, -90.0], [0.0, 0.0], 10)
+    assert decode_plus_code(north)["north"] == pytest.approx(90.0)
+    assert decode_plus_code(south)["south"] == pytest.approx(-90.0)
+    assert encode_plus_codes([10.0], [180.0]) == encode_plus_codes([10.0], [-180.0])
+    assert encode_plus_codes([10.0], [200.0]) == encode_plus_codes([10.0], [-160.0])
+
+def test_length_11_matches_homebaked():
+    codes = encode_plus_codes(LAT, LON, 11)
+    assert codes == [get_homebaked_plus_code(float(a), float(o)) for a, o in zip(LAT, LON)]
+
+def test_padding_and_case():
+    assert encode_plus_codes([-33.93], [18.42], 4)[0].endswith("0000+")
+    code = encode_plus_codes([-33.93], [18.42], 6)[0]
+    assert decode_plus_code(code.lower()) == decode_plus_code(code)
+
+@pytest.mark.parametrize("code", ["", "2", "4VCQ2", "4VCQ2V0M+", "4VCQ2V2M+RRRRRRRR", "4VCQ2V2M+R2A"])
+def test_invalid_codes(code):
+    with pytest.raises(ValueError):
+        decode_plus_code(code)
+
+def test_invalid_length():
+    with pytest.raises(ValueError):
+        encode_plus_codes([0.0], [0.0], 9)
+
+def test_round2_matches_round_on_ties():
+    ties = [k / 100 + 0.005 for k in range(-100000, 100000)] + [x * 2.8 + 1.3 for x in range(200)]
+    values = np.array(ties + list(_rng.uniform(-1000, 1000, 20000)))
+    assert _round2(values).tolist() == [round(v, 2) for v in values.tolist()]
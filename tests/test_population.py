@@ -0,0 +1,143 @@
+#- geo3D_qgis: 2026
+#- arkriger
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from city3D_kernels import estimate_population
+
+NUMERIC = ['building:flats', 'building:units', 'beds', 'rooms', 'building:levels']
+
+def _notebook_pop(gdf, f_house=6, inf_structure=4):
+    """The notebook's row-wise pop(row), with its student rewrite and numeric conversion."""
+    gdf = gdf.copy()
+    if 'residential' in gdf.columns:
+        gdf.loc[(gdf['residential'] == 'student') & gdf['residential'].notna(), 'building'] = 'student'
+    for col in NUMERIC:
+        if col in gdf.columns:
+            gdf[col] = pd.to_numeric(gdf[col].fillna(0), errors='coerce')
+    c = gdf.columns
+
+    def pop(row):
+        if row['building'] in ['house', 'semidetached_house']:
+            return f_house
+        if row['building'] in ['terrace', 'terraced']:
+            if 'building:units' in c and row['building:units'] != 0:
+                return row['building:units'] * f_house
+            return f_house
+        if row['building'] == 'cabin':
+            return inf_structure
+        if row['building'] == 'residential' and pd.isna(row.get('social_facility')):
+            if row.get('building:levels', 0) > 1:
+                if 'rooms' in c and row['rooms'] != 0:
+                    return row['rooms']
+                if 'building:flats' in c and row['building:flats'] != 0:
+                    return row['building:flats'] * inf_structure
+            return inf_structure
+        if row['building'] == 'residential' and not pd.isna(row.get('social_facility')):
+            if row.get('building:levels', 0) > 1:
+                if 'building:units' in c and row['building:units'] != 0:
+                    return row['building:units'] * inf_structure
+                return row.get('beds', inf_structure)
+            return inf_structure
+        if row['building'] == 'apartments':
+            if 'rooms' in c and row['rooms'] != 0:
+                return row['rooms']
+            return int(row.get('building:flats', 0)) * 3
+        if row['building'] == 'student':
+            if row.get('building:levels', 0) > 1:
+                if 'rooms' in c and row['rooms'] != 0:
+                    return row['rooms']
+                return row.get('building:flats', 3)
+            return 3
+        if row['building'] == 'dormitory' and row.get('residential') == 'university':
+            if row.get('building:levels', 0) > 1:
+                if 'rooms' in c and row['rooms'] != 0:
+                    return row['rooms']
+                return row.get('beds', 3)
+            return 3
+        return 0
+
+    return gdf.apply(pop, axis=1).astype(float)
+
+def _frame(rows, columns=None):
+    return pd.DataFrame(rows, columns=columns).astype(object).where(lambda d: d.notna(), None)
+
+def _check(gdf, **params):
+    got = estimate_population(gdf, **params)
+    assert got.name == 'pop' and got.index.equals(gdf.index)
+    np.testing.assert_array_equal(got.to_numpy(), _notebook_pop(gdf, **params).to_numpy())
+    return got
+
+COLUMNS = ['building', 'building:levels', 'building:units', 'building:flats', 'rooms', 'beds',
+           'residential', 'social_facility']
+
+#- one row per rule, in the notebook's order; expected with f_house=6, inf_structure=4
+RULES = [
+    (['house', None, None, None, None, None, None, None], 6),
+    (['semidetached_house', '3', '4', None, None, None, None, None], 6),
+    (['terrace', None, '3', None, None, None, None, None], 18),
+    (['terraced', None, None, None, None, None, None, None], 6),
+    (['cabin', None, None, None, None, None, None, None], 4),
+    (['residential', '3', None, '5', '12', None, None, None], 12),             # rooms before flats
+    (['residential', '3', None, '5', None, None, None, None], 20),
+    (['residential', '1', None, '5', '12', None, None, None], 4),              # single storey
+    (['residential', '2', '7', None, None, '30', None, 'shelter'], 28),        # units before beds
+    (['residential', '2', None, None, None, '30', None, 'shelter'], 30),
+    (['residential', None, '7', None, None, '30', None, 'shelter'], 4),
+    (['apartments', '5', None, '10', '40', None, None, None], 40),
+    (['apartments', '5', None, '10', None, None, None, None], 30),
+    (['residential', '4', None, '8', '50', None, 'student', None], 50),        # rewritten to student
+    (['dormitory', '4', None, '8', None, None, 'student', None], 8),
+    (['student', '1', None, '8', '50', None, None, None], 3),
+    (['dormitory', '4', None, None, None, '120', 'university', None], 120),
+    (['dormitory', '4', None, None, '60', '120', 'university', None], 60),
+    (['dormitory', '1', None, None, '60', '120', 'university', None], 3),
+    (['dormitory', '4', None, None, None, '120', None, None], 0),              # not a university residence
+    (['retail', '4', None, '8', '50', None, None, None], 0),
+]
+
+def test_rule_order():
+    gdf = _frame([r for r, _ in RULES], COLUMNS)
+    got = _check(gdf)
+    assert got.tolist() == [float(e) for _, e in RULES]
+
+def test_occupancy_parameters():
+    gdf = _frame([r for r, _ in RULES], COLUMNS)
+    _check(gdf, f_house=3.5, inf_structure=2)
+
+def test_nan_building_levels():
+    # unparsable or missing levels never count as multi-storey
+    rows = [['residential', lvl, None, '5', '12', None, None, None] for lvl in (None, 'two', '', '2;3')]
+    rows += [['student', 'x', None, '8', '50', None, None, None], ['dormitory', float('nan'), None, None, '60', '120', 'university', None]]
+    got = _check(_frame(rows, COLUMNS))
+    assert got.tolist() == [4, 4, 4, 4, 3, 3]
+
+def test_nan_values_stay_nan():
+    rows = [['terrace', None, 'many', None, None, None, None, None],
+            ['residential', '3', None, None, 'lots', None, None, None]]
+    got = _check(_frame(rows, COLUMNS))
+    assert got.isna().all()
+
+def test_missing_columns():
+    _check(_frame([['house'], ['apartments'], ['cabin'], ['residential'], ['student']], ['building']))
+    _check(_frame([['apartments', '4'], ['student', '6']], ['building', 'building:flats']))
+
+def test_unparsable_apartment_flats():
+    with pytest.raises(ValueError):
+        estimate_population(_frame([['apartments', 'ten']], ['building', 'building:flats']))
+
+def test_random_frames():
+    rng = np.random.default_rng(18)
+    n = 3000
+    values = [None, '0', '1', '2', '3', '8', '12', 'x']
+    gdf = pd.DataFrame({
+        'building': rng.choice(['house', 'semidetached_house', 'terrace', 'terraced', 'cabin', 'residential',
+                                'apartments', 'student', 'dormitory', 'yes', 'retail'], n),
+        'building:flats': rng.choice(values[:-1], n),
+        'residential': rng.choice([None, 'student', 'university'], n),
+        'social_facility': rng.choice([None, None, 'shelter'], n),
+        **{col: rng.choice(values, n) for col in ['building:levels', 'building:units', 'rooms', 'beds']},
+    }, index=rng.permutation(n) + 100)
+    _check(gdf)
@@ -0,0 +1,103 @@
+#- geo3D_qgis: 2026
+#- arkriger
+
+import json
+import numpy as np
+import pytest
+
+from city3D_kernels import _encode_viz_layer, _VIZ_MAX_PRECISION
+
+def _decode(buf):
+    """Python twin of geo3dDecode (the browser decoder in city3D._VIZ_DECODER_JS)."""
+    hlen = int(np.frombuffer(buf, "<u4", 1)[0])
+    head = json.loads(buf[4:4 + hlen])
+    off = 4 + hlen
+    off += -off % 4
+    types = np.frombuffer(buf, np.uint8, head["n"], off).tolist()
+    off += head["n"]
+    off += -off % 4
+    parts = iter(np.frombuffer(buf, "<u4", head["nparts"], off).tolist())
+    off += head["nparts"] * 4
+    xy = np.cumsum(np.frombuffer(buf, "<i4", head["ncoords"] * 2, off).reshape(-1, 2).astype(np.int64), axis=0)
+    pts = iter((xy / head["scale"]).tolist())
+
+    def many(f):
+        return [f() for _ in range(next(parts))]
+    line = lambda: many(lambda: next(pts))
+    poly = lambda: many(line)
+    kinds = [None, ("Polygon", poly), ("MultiPolygon", lambda: many(poly)), ("LineString", line),
+             ("MultiLineString", lambda: many(line)), ("Point", lambda: next(pts)), ("MultiPoint", line)]
+    features = []
+    for i, t in enumerate(types):
+        props = {k: col["dict"][col["idx"][i]] for k, col in head["props"].items()}
+        geom = {"type": kinds[t][0], "coordinates": kinds[t][1]()} if t else None
+        features.append({"type": "Feature", "properties": props, "geometry": geom})
+    return {"type": "FeatureCollection", "features": features}
+
+def _feature(geom_type, coordinates, **props):
+    return {"type": "Feature", "properties": props, "geometry": {"type": geom_type, "coordinates": coordinates}}
+
+def _collection(rng):
+    ring = [[18.42 + dx, -33.93 + dy] for dx, dy in rng.uniform(-0.01, 0.01, (6, 2))]
+    ring.append(ring[0])
+    return {"type": "FeatureCollection", "features": [
+        _feature("Polygon", [ring], building="house", fill_color="[255, 255, 204]"),
+        _feature("MultiPolygon", [[ring], [ring[::-1]]], building="apartments", fill_color="[252, 194, 3]"),
+        _feature("LineString", [[-179.9999999, 89.9999999], [179.9999999, -89.9999999]], building=None),
+        _feature("MultiLineString", [[[0.0, 0.0], [1.1234567, 2.7654321]], [[-1.5, -2.5], [3.25, 4.125]]]),
+        _feature("Point", [18.4123456789, -33.9123456789], building="house"),
+        _feature("MultiPoint", [[10.0, 20.0], [10.00000005, 20.00000005]]),
+        {"type": "Feature", "properties": {"building": "yes"}, "geometry": None},
+    ]}
+
+def _quantized(coords, precision):
+    """Coordinates as the encoder should return them: rounded to 10^-precision."""
+    if coords and isinstance(coords[0], (int, float)):
+        return (np.round(np.asarray(coords[:2]) * 10 ** precision) / 10 ** precision).tolist()
+    return [_quantized(c, precision) for c in coords]
+
+@pytest.mark.parametrize("precision", range(0, _VIZ_MAX_PRECISION))
+def test_lossless_at_precision(precision):
+    # the line from -179.99 to 179.99 only fits int32 deltas below precision 7
+    gj = _collection(np.random.default_rng(precision))
+    out = _decode(_encode_viz_layer(gj, ["building", "fill_color"], precision))
+    assert len(out["features"]) == len(gj["features"])
+    for src, dst in zip(gj["features"], out["features"]):
+        if src["geometry"] is None:
+            assert dst["geometry"] is None
+            continue
+        assert dst["geometry"]["type"] == src["geometry"]["type"]
+        assert dst["geometry"]["coordinates"] == _quantized(src["geometry"]["coordinates"], precision)
+
+def test_lossless_at_max_precision():
+    gj = _collection(np.random.default_rng(0))
+    gj["features"] = [f for f in gj["features"] if (f["geometry"] or {}).get("type") != "LineString"]
+    out = _decode(_encode_viz_layer(gj, ["building"], _VIZ_MAX_PRECISION))
+    for src, dst in zip(gj["features"], out["features"]):
+        if src["geometry"] is not None:
+            assert dst["geometry"]["coordinates"] == _quantized(src["geometry"]["coordinates"], _VIZ_MAX_PRECISION)
+
+def test_properties_pruned_and_dictionary_encoded():
+    gj = _collection(np.random.default_rng(0))
+    out = _decode(_encode_viz_layer(gj, ["building", "fill_color"]))
+    props = [f["properties"] for f in out["features"]]
+    assert props[0] == {"building": "house", "fill_color": [255, 255, 204]}
+    assert props[2] == {"building": None, "fill_color": None}
+    assert all(set(p) == {"building", "fill_color"} for p in props)
+
+def test_overflow_at_max_precision():
+    # -179.9999999 -> 179.9999999 is a delta of 3.6e9 at 10^-7 degrees: past int32
+    gj = {"type": "FeatureCollection", "features": [
+        _feature("LineString", [[-179.9999999, 0.0], [179.9999999, 0.0]])]}
+    with pytest.raises(ValueError, match="int32"):
+        _encode_viz_layer(gj, [], _VIZ_MAX_PRECISION)
+
+def test_overflow_projected_coordinates():
+    gj = {"type": "FeatureCollection", "features": [_feature("Point", [261000.0, 6243000.0])]}
+    with pytest.raises(ValueError, match="int32"):
+        _encode_viz_layer(gj, [], 6)
+
+@pytest.mark.parametrize("precision", [-1, _VIZ_MAX_PRECISION + 1, 2.5, "6"])
+def test_invalid_precision(precision):
+    with pytest.raises(ValueError, match="precision"):
+        _encode_viz_layer({"type": "FeatureCollection", "features": []}, [], precision)